@@ -0,0 +1,72 @@
+"""
+ Budgets for anytime agents: an agent keeps improving its plan until the budget
+ is used up and then returns the best action found so far.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class DecisionStats:
+    """
+    Reports how much work an agent did for one decision
+    """
+    iterations: int = 0
+    rollouts: int = 0
+    elapsed: float = 0.0
+
+
+class Budget:
+    """
+    Limits a decision by wall-clock time, number of rollouts and/or number of iterations.
+    Any limit left as None is ignored, but at least one must be given.
+    The clock is time.perf_counter, which is monotonic and high resolution; it is only read
+    every check_every calls to exhausted(), so that checking is cheap even for very short
+    iterations.
+    """
+
+    def __init__(self, time_limit: Optional[float] = None, max_rollouts: Optional[int] = None,
+                 max_iterations: Optional[int] = None, check_every: int = 1):
+        if time_limit is None and max_rollouts is None and max_iterations is None:
+            raise ValueError("a budget needs a time_limit, max_rollouts or max_iterations")
+        self.time_limit = time_limit
+        self.max_rollouts = max_rollouts
+        self.max_iterations = max_iterations
+        self.check_every = check_every
+        self.stats = DecisionStats()
+        self._start = 0.0
+        self._deadline = float("inf")
+        self._countdown = 0
+
+    def start(self) -> DecisionStats:
+        """
+        Starts the budget for a new decision and returns the stats object which the
+        agent should update as it goes
+        """
+        self.stats = DecisionStats()
+        self._start = time.perf_counter()
+        self._deadline = self._start + self.time_limit if self.time_limit is not None else float("inf")
+        self._countdown = 0
+        return self.stats
+
+    def exhausted(self) -> bool:
+        stats = self.stats
+        if self.max_iterations is not None and stats.iterations >= self.max_iterations:
+            return self._stop()
+        if self.max_rollouts is not None and stats.rollouts >= self.max_rollouts:
+            return self._stop()
+        if self.time_limit is not None:
+            self._countdown -= 1
+            if self._countdown <= 0:
+                self._countdown = self.check_every
+                if time.perf_counter() >= self._deadline:
+                    return self._stop()
+        return False
+
+    def _stop(self) -> bool:
+        self.stats.elapsed = time.perf_counter() - self._start
+        return True
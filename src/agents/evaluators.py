@@ -0,0 +1,231 @@
+"""
+ Evaluators score a batch of candidate action sequences from a common root state.
+
+ The scorer is a function scorer(root, candidate) -> float which must leave the
+ root unchanged, such as RHEA.evaluate.  An agent calls set_root once per decision
+ and then evaluate for each batch of candidates, so the parallel backends only
+ need to ship the root state to their workers once per decision.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import pickle
+import random
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from agents.game_interfaces import SimpleGameModel, copy_model
+
+Scorer = Callable[[SimpleGameModel, Any], float]
+
+
+class Evaluator(ABC):
+    """
+    If a seed is given each task is scored with the global random module seeded from
+    (seed, task number), so that stochastic games give the same results whichever
+    backend is used.  The thread backend can't do this, as the random module is shared.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed
+        self.n_tasks = 0
+
+    @abstractmethod
+    def set_root(self, scorer: Scorer, root: SimpleGameModel) -> None:
+        pass
+
+    @abstractmethod
+    def evaluate(self, candidates: List[Any]) -> List[float]:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def task_seeds(self, n: int) -> List[Optional[int]]:
+        first = self.n_tasks
+        self.n_tasks += n
+        if self.seed is None:
+            return [None] * n
+        return [hash((self.seed, first + i)) for i in range(n)]
+
+    def __enter__(self) -> Evaluator:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __reduce__(self):
+        # an agent holding an evaluator may itself be sent to a worker process,
+        # where it should just score its candidates locally
+        return SerialEvaluator, (self.seed,)
+
+
+def score_seeded(scorer: Scorer, root: SimpleGameModel, candidate: Any, seed: Optional[int]) -> float:
+    if seed is None:
+        return scorer(root, candidate)
+    saved = random.getstate()
+    random.seed(seed)
+    try:
+        return scorer(root, candidate)
+    finally:
+        random.setstate(saved)
+
+
+class SerialEvaluator(Evaluator):
+    def __init__(self, seed: Optional[int] = None):
+        super().__init__(seed)
+        self.scorer: Optional[Scorer] = None
+        self.root: Optional[SimpleGameModel] = None
+
+    def set_root(self, scorer: Scorer, root: SimpleGameModel) -> None:
+        self.scorer = scorer
+        self.root = root
+
+    def evaluate(self, candidates: List[Any]) -> List[float]:
+        seeds = self.task_seeds(len(candidates))
+        return [score_seeded(self.scorer, self.root, c, s) for c, s in zip(candidates, seeds)]
+
+
+def split(items: List[Any], n: int) -> List[List[Any]]:
+    """
+    Splits items into at most n contiguous chunks of near equal size
+    """
+    n = min(n, len(items))
+    size, extra = divmod(len(items), n) if n else (0, 0)
+    chunks, start = [], 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+class ThreadEvaluator(Evaluator):
+    """
+    Scores chunks of candidates on a persistent thread pool, with a private copy
+    of the root for each thread.  Only useful when scoring releases the GIL.
+    """
+
+    def __init__(self, n_workers: int = 4):
+        super().__init__(None)
+        self.n_workers = n_workers
+        self.pool = ThreadPoolExecutor(n_workers)
+        self.scorer: Optional[Scorer] = None
+        self.roots: List[SimpleGameModel] = []
+
+    def set_root(self, scorer: Scorer, root: SimpleGameModel) -> None:
+        self.scorer = scorer
+        self.roots = [copy_model(root) for _ in range(self.n_workers)]
+
+    def _score_chunk(self, root: SimpleGameModel, chunk: List[Any]) -> List[float]:
+        return [self.scorer(root, c) for c in chunk]
+
+    def evaluate(self, candidates: List[Any]) -> List[float]:
+        self.n_tasks += len(candidates)
+        chunks = split(candidates, self.n_workers)
+        futures = [self.pool.submit(self._score_chunk, root, chunk) for root, chunk in zip(self.roots, chunks)]
+        return [score for future in futures for score in future.result()]
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+def worker_loop(conn) -> None:
+    """
+    Runs in a worker process: holds the current scorer and root and scores the
+    chunks of (seed, candidate) tasks it is sent
+    """
+    scorer, root = None, None
+    while True:
+        message = conn.recv()
+        if message[0] == "root":
+            scorer, root = pickle.loads(message[1])
+        elif message[0] == "eval":
+            conn.send([score_seeded(scorer, root, c, s) for s, c in message[1]])
+        else:
+            break
+    conn.close()
+
+
+class ProcessEvaluator(Evaluator):
+    """
+    Scores chunks of candidates on persistent worker processes, which are reused
+    across decisions.  The scorer and root are pickled once per decision and sent to
+    each worker, after which only the candidates and scores cross process boundaries.
+    """
+
+    def __init__(self, n_workers: int = None, seed: Optional[int] = 0, context: str = None):
+        super().__init__(seed)
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        ctx = multiprocessing.get_context(context)
+        self.conns = []
+        self.processes = []
+        for i in range(self.n_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=worker_loop, args=(child_conn,), daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    def set_root(self, scorer: Scorer, root: SimpleGameModel) -> None:
+        payload = pickle.dumps((scorer, root), protocol=pickle.HIGHEST_PROTOCOL)
+        for conn in self.conns:
+            conn.send(("root", payload))
+
+    def evaluate(self, candidates: List[Any]) -> List[float]:
+        tasks = list(zip(self.task_seeds(len(candidates)), candidates))
+        chunks = split(tasks, self.n_workers)
+        for conn, chunk in zip(self.conns, chunks):
+            conn.send(("eval", chunk))
+        return [score for conn, _ in zip(self.conns, chunks) for score in conn.recv()]
+
+    def close(self) -> None:
+        for conn, process in zip(self.conns, self.processes):
+            try:
+                conn.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+            process.join(timeout=1)
+        self.conns, self.processes = [], []
+
+
+def test():
+    """
+    Checks the serial, thread and process backends make the same decisions, and that an
+    agent with a listener scores locally, so that the listener sees every rollout
+    """
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator, NanoRTSParams
+    from agents.rhea_agent import RHEA
+    from agents.transition_deltas import DeltaRecorder
+    from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+    params = NanoRTSParams(n_units=2)
+    start = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(0)), params)
+    backends = [("serial", lambda: SerialEvaluator(0)), ("thread", lambda: ThreadEvaluator(2)),
+                ("process", lambda: ProcessEvaluator(2, seed=0))]
+    for make_agent, play in [(lambda e: RHEA(l=10, n=10, n_mutants=3, evaluator=e, rng=0),
+                              lambda agent, model: model.act(agent.get_action(model))),
+                             (lambda e: MultiUnitRHEA(2, l=10, n=10, n_mutants=3, evaluator=e, rng=0),
+                              lambda agent, model: model.combo_act(agent.get_actions(model)))]:
+        decisions = {}
+        for name, make_evaluator in backends:
+            model, agent = start.clone(), make_agent(make_evaluator())
+            for _ in range(5):
+                play(agent, model)
+            agent.close()
+            decisions[name] = model.state
+        assert decisions["serial"] == decisions["thread"] == decisions["process"], type(agent).__name__
+
+        agent = make_agent(ProcessEvaluator(2))
+        agent.listener = DeltaRecorder()
+        play(agent, start.clone())
+        agent.close()
+        assert agent.listener.rollout == agent.last_stats.rollouts > 0
+    print("evaluators agree")
+
+
+if __name__ == '__main__':
+    test()
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import copy
+import random
+import time
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterator, List, Sequence
+
+from agents.joint_action_space import JointActionSpace, joint_action_space
+from stats.metrics import METRICS
 
 
 class SimpleGameModel(ABC):
@@ -10,8 +15,12 @@ class SimpleGameModel(ABC):
     def n_actions(self) -> int:
         pass
 
-    def get_actions(self) -> List[int]:
-        return list(range(self.n_actions()))
+    def get_actions(self) -> Sequence[int]:
+        # a range rather than a list, as n_actions can be exponential in the number of units
+        return range(self.n_actions())
+
+    def random_action(self, rng: random.Random = random) -> int:
+        return rng.randrange(self.n_actions())
 
     @abstractmethod
     def act(self, action: int) -> SimpleGameModel:
@@ -30,11 +39,58 @@ class SimpleGameModel(ABC):
         pass
 
     def child(self, action_index: int) -> SimpleGameModel:
-        model_copy = copy.deepcopy(self)
+        model_copy = copy_model(self)
         return model_copy.act(action_index)
 
-    def children(self) -> List[SimpleGameModel]:
-        return [self.child(i) for i in range(self.n_actions())]
+    def children(self) -> Iterator[SimpleGameModel]:
+        # made one at a time: there may be far too many to hold at once
+        return (self.child(i) for i in range(self.n_actions()))
+
+
+class CloneableGameModel(ABC):
+    """
+    Implemented by models that can copy themselves much faster than copy.deepcopy,
+    typically by sharing immutable parts (e.g. params) and copying only the mutable state.
+    """
+    @abstractmethod
+    def clone(self) -> SimpleGameModel:
+        pass
+
+
+def copy_model(model: SimpleGameModel) -> SimpleGameModel:
+    """
+    Copies a model using the fast clone() path when it is available.
+    """
+    if METRICS.enabled:
+        start = time.perf_counter_ns()
+        copied = model.clone() if isinstance(model, CloneableGameModel) else copy.deepcopy(model)
+        METRICS.observe_ns("model.copy_time", start)
+        return copied
+    if isinstance(model, CloneableGameModel):
+        return model.clone()
+    return copy.deepcopy(model)
+
+
+class UndoableGameModel(ABC):
+    """
+    Implemented by models that can record their changes in an undo journal,
+    so that many rollouts can be run from one root state without copying it:
+        model.push_undo(); model.combo_act(...); ...; model.pop_undo()
+    Calls may be nested.
+    """
+    @abstractmethod
+    def push_undo(self) -> None:
+        """
+        Starts recording the changes made from the current state.
+        """
+        pass
+
+    @abstractmethod
+    def pop_undo(self) -> None:
+        """
+        Rolls the state back to where it was at the matching push_undo.
+        """
+        pass
 
 
 class MultiUnitGameModel(SimpleGameModel):
@@ -54,6 +110,67 @@ class MultiUnitGameModel(SimpleGameModel):
     def get_action_space(self) -> List[int]:
         return [self.n_actions_unit_i(i) for i in range(self.n_units())]
 
+    def joint_action_space(self) -> JointActionSpace:
+        return joint_action_space(tuple(self.get_action_space()))
+
+    # the single int interface: an action is a joint action index, see agents.joint_action_space
+
+    def n_actions(self) -> int:
+        return self.joint_action_space().size
+
+    def act(self, action: int) -> MultiUnitGameModel:
+        return self.combo_act(self.joint_action_space().decode(action))
+
+    def random_action(self, rng: random.Random = random) -> int:
+        return self.joint_action_space().sample(rng)
+
+
+class HashableGameModel(ABC):
+    """
+    Implemented by models that can give a 64 bit hash of their current state,
+    used as a key for transposition tables and caches
+    """
+    @abstractmethod
+    def state_hash(self) -> int:
+        pass
+
+
+class BatchGameModel(ABC):
+    """
+    Holds many independent copies of a game and steps them together.
+    Scores and terminal flags are returned as arrays with one entry per game.
+    """
+    @abstractmethod
+    def combo_act(self, actions) -> BatchGameModel:
+        """
+        Applies a [batch_size, n_units] array of actions
+        """
+        pass
+
+    @abstractmethod
+    def score(self):
+        pass
+
+    @abstractmethod
+    def is_terminal(self):
+        pass
+
+    @abstractmethod
+    def repeat(self, batch_size: int) -> BatchGameModel:
+        """
+        Returns a new batch holding batch_size copies of the first game in this one
+        """
+        pass
+
+
+class BatchableGameModel(ABC):
+    """
+    Implemented by models that can be converted to a BatchGameModel for vectorised rollouts
+    """
+    @abstractmethod
+    def to_batch(self, batch_size: int) -> BatchGameModel:
+        pass
+
 
 class SimplePlayerInterface(ABC):
     @abstractmethod
@@ -70,3 +187,30 @@ class StateTransitionListener(ABC):
     @abstractmethod
     def state_transition(self, state: SimpleGameModel, action: int, next_state: SimpleGameModel) -> None:
         pass
+
+
+class TransitionDeltaListener(ABC):
+    """
+    A cheaper alternative to StateTransitionListener: rather than being given copies of
+    the state before and after each step, the listener is told what changed as the
+    model changes it, so rollouts can run in place.  Models that support this have a
+    delta_listener attribute, None by default and not passed on to clones; agents set
+    it on the model they roll out, and call step_end and rollout_end themselves.
+    """
+    @abstractmethod
+    def unit_changed(self, unit_id: int, x0: int, y0: int, x1: int, y1: int, fuel_change: int) -> None:
+        """
+        A unit moved from (x0, y0) to (x1, y1) and / or its fuel changed.
+        Spawned units come from (-1, -1) with their starting fuel as the change
+        """
+        pass
+
+    @abstractmethod
+    def resource_consumed(self, x: int, y: int, amount: int) -> None:
+        pass
+
+    def step_end(self, action) -> None:
+        pass
+
+    def rollout_end(self, score: float) -> None:
+        pass
@@ -0,0 +1,170 @@
+"""
+ The joint actions of a MultiUnitGameModel, as used by its single int SimpleGameModel
+ interface (act, n_actions): unit i's action is digit i of the joint action index, in
+ a mixed radix whose digit sizes are the units' action counts, unit 0 lowest.
+
+ With k units of 5 actions there are 5 ** k joint actions, so nothing here makes a list
+ of them: the place value of each digit is worked out once per action space (and
+ spaces are shared between models with the same action space), after which decoding,
+ encoding and sampling cost O(n_units) and iteration yields one joint action at a time.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from functools import lru_cache
+from typing import Iterator, List, Sequence, Tuple
+
+
+class JointActionSpace:
+    def __init__(self, sizes: Sequence[int]):
+        """
+        :param sizes: the number of actions of each unit
+        """
+        self.sizes: Tuple[int, ...] = tuple(sizes)
+        radix = []
+        place = 1
+        for k in self.sizes:
+            radix.append(place)
+            place *= k
+        # place value of each unit's digit, and the number of joint actions
+        self.radix: Tuple[int, ...] = tuple(radix)
+        self.size = place
+        self.digits: Tuple[Tuple[int, int], ...] = tuple(zip(self.radix, self.sizes))
+
+    def __len__(self) -> int:
+        # len() is limited to sys.maxsize, which 28 units of 5 actions exceed: use size
+        return self.size
+
+    def check(self, index: int) -> int:
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(f"joint action {index} out of range for {self.size} actions")
+        return index
+
+    def decode(self, index: int) -> List[int]:
+        """
+        The action of each unit for a joint action index
+        """
+        return [(index // r) % k for r, k in self.digits]
+
+    def encode(self, actions: Sequence[int]) -> int:
+        return sum(a * r for a, r in zip(actions, self.radix))
+
+    def __getitem__(self, index: int) -> List[int]:
+        return self.decode(self.check(index))
+
+    def __contains__(self, index: int) -> bool:
+        return isinstance(index, int) and 0 <= index < self.size
+
+    def __iter__(self) -> Iterator[List[int]]:
+        """
+        Every joint action in index order, as per-unit action lists, stepping the units'
+        actions like an odometer rather than decoding each index
+        """
+        if self.size == 0:
+            return
+        actions = [0] * len(self.sizes)
+        while True:
+            yield list(actions)
+            for i, k in enumerate(self.sizes):
+                actions[i] += 1
+                if actions[i] < k:
+                    break
+                actions[i] = 0
+            else:
+                return
+
+    def indices(self) -> range:
+        return range(self.size)
+
+    def sample(self, rng: random.Random = random) -> int:
+        """
+        A uniformly random joint action index: a single randrange over the whole space
+        is quicker than a draw for each unit
+        """
+        return rng.randrange(self.size)
+
+    def sample_actions(self, rng: random.Random = random) -> List[int]:
+        return self.decode(self.sample(rng))
+
+
+@lru_cache(maxsize=64)
+def joint_action_space(sizes: Tuple[int, ...]) -> JointActionSpace:
+    """
+    The shared JointActionSpace for a tuple of per-unit action counts
+    """
+    return JointActionSpace(sizes)
+
+
+def test():
+    space = JointActionSpace([2, 3, 4])
+    assert space.size == len(space) == 24
+    assert [space.decode(i) for i in space.indices()] == list(space)
+    assert all(space.encode(space[i]) == i for i in range(24)) and space[-1] == [1, 2, 3]
+    for index in [24, -25]:
+        try:
+            space[index]
+            assert False, index
+        except IndexError:
+            pass
+    assert 23 in space and 24 not in space and list(JointActionSpace([3, 0])) == []
+
+    # 100 units: far too many joint actions to list, but each is cheap to handle
+    big = joint_action_space((5,) * 100)
+    assert big.size == 5 ** 100 and joint_action_space((5,) * 100) is big
+    rng = random.Random(0)
+    for _ in range(100):
+        index = big.sample(rng)
+        assert index in big and big.encode(big[index]) == index
+    assert big[big.size - 1] == [4] * 100 and next(iter(big)) == [0] * 100
+    counts = [0] * 5
+    for _ in range(1000):
+        counts[big.decode(big.sample(rng))[99]] += 1
+    assert min(counts) > 150, counts
+
+    # the per-unit actions of the old and new games' act agree with combo_act
+    import old_nano_rts.old_nano_rts_game as old_game
+    import nano_rts.nano_rts_game as new_game
+    params = old_game.NanoRTSParams(n_units=30, n_resources=60, grid_size=60)
+    old_model = old_game.NanoRTSModel(old_game.NanoStateGenerator(params).generate_random(random.Random(1)), params)
+    new_model = new_game.NanoRTSModel(new_game.generate_random_state(new_game.NanoRTSParams(), random.Random(1)))
+    for model in [old_model, new_model]:
+        for _ in range(10):
+            # new game units can spawn, changing the action space
+            space = model.joint_action_space()
+            assert space.size == model.n_actions() and len(space.sizes) == model.n_units()
+            action = model.random_action(rng)
+            expected = model.clone().combo_act(space.decode(action))
+            assert model.act(action).state == expected.state
+        children = model.children()
+        assert next(children).state == model.child(0).state
+
+    # the single action RHEA on the 30 unit game: 5 ** 30 joint actions
+    from agents.rhea_agent import RHEA
+    agent = RHEA(l=10, n=5, rng=0)
+    for _ in range(5):
+        old_model.act(agent.get_action(old_model))
+    print("joint action spaces ok")
+
+
+def speed_test(n: int = 20000):
+    for n_units in [5, 20, 100]:
+        space = joint_action_space((5,) * n_units)
+        indices = [space.sample() for _ in range(n)]
+        t = time.perf_counter()
+        for index in indices:
+            space.decode(index)
+        t_decode = time.perf_counter() - t
+        t = time.perf_counter()
+        for _ in range(n):
+            space.sample()
+        t_sample = time.perf_counter() - t
+        print(f"{n_units} units: decode {1e6 * t_decode / n:.2f}us, sample {1e6 * t_sample / n:.2f}us")
+
+
+if __name__ == '__main__':
+    test()
+    speed_test()
@@ -0,0 +1,253 @@
+"""
+ Monte Carlo Tree Search with a transposition table.
+
+ Nodes are identified by the hash of their state (see HashableGameModel), so
+ different action sequences that reach the same state share statistics, and the
+ tree from the previous decision is reused simply by looking up the new root.
+
+ Node and edge statistics live in preallocated arrays rather than in per-node
+ objects.  Each node owns a contiguous block of edges with one entry per action
+ of each 'factor': plain MCTS has a single factor with model.n_actions() actions,
+ while the factored multi-unit version (see MultiUnitMCTS) has one factor per unit,
+ so a node needs sum(action_space) edges rather than prod(action_space).
+"""
+
+from __future__ import annotations
+
+import math
+import random
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from agents.budget import Budget, DecisionStats
+from agents.game_interfaces import SimplePlayerInterface, SimpleGameModel, HashableGameModel, copy_model
+from agents.seeding import RandomStream, Seed
+from stats.metrics import record_decision
+
+
+class MCTSTree:
+    """
+    Preallocated node and edge arrays plus the transposition table mapping state hashes to nodes
+    """
+
+    def __init__(self, max_nodes: int, max_edges: int):
+        self.max_nodes = max_nodes
+        self.max_edges = max_edges
+        self.node_visits = np.zeros(max_nodes, dtype=np.int64)
+        self.edge_start = np.zeros(max_nodes, dtype=np.int64)
+        self.edge_visits = np.zeros(max_edges, dtype=np.int64)
+        self.edge_value = np.zeros(max_edges, dtype=np.float64)
+        self.table: Dict[int, int] = {}
+        self.n_nodes = 0
+        self.n_edges = 0
+
+    def clear(self) -> None:
+        self.node_visits[:self.n_nodes] = 0
+        self.edge_visits[:self.n_edges] = 0
+        self.edge_value[:self.n_edges] = 0
+        self.table.clear()
+        self.n_nodes = 0
+        self.n_edges = 0
+
+    def fill_fraction(self) -> float:
+        return max(self.n_nodes / self.max_nodes, self.n_edges / self.max_edges)
+
+    def add(self, key: int, n_edges: int) -> Optional[int]:
+        """
+        Adds a node for a state hash and returns its index, or None if the arrays are full
+        """
+        if self.n_nodes >= self.max_nodes or self.n_edges + n_edges > self.max_edges:
+            return None
+        node = self.n_nodes
+        self.edge_start[node] = self.n_edges
+        self.n_nodes += 1
+        self.n_edges += n_edges
+        self.table[key] = node
+        return node
+
+
+class MCTS(SimplePlayerInterface):
+    # prefix of the metrics recorded for each decision
+    metrics_name = "mcts"
+
+    def __init__(self, n: int = 100, c: float = 1.4, rollout_length: int = 20, max_depth: int = 20,
+                 max_nodes: int = 100000, max_edges: int = 2000000, reuse_tree: bool = True,
+                 budget: Budget = None, rng: Union[Seed, RandomStream] = None):
+        """
+        :param n: number of iterations per decision, used when no budget is given
+        :param c: UCB exploration constant; values are normalised to [0, 1] by the range seen so far
+        :param rollout_length: number of random steps played out from a newly added node
+        :param max_depth: maximum number of tree steps per iteration
+        :param reuse_tree: keep the tree between decisions; it is cleared when it gets nearly full
+        :param rng: seed or RandomStream for the rollouts and tie breaks, see agents.seeding
+        """
+        self.n = n
+        self.c = c
+        self.rollout_length = rollout_length
+        self.max_depth = max_depth
+        self.tree = MCTSTree(max_nodes, max_edges)
+        self.reuse_tree = reuse_tree
+        self.budget = budget
+        self.rng = RandomStream.of(rng)
+        self.last_stats = DecisionStats()
+        self.lo = math.inf
+        self.hi = -math.inf
+
+    def clear(self) -> None:
+        self.tree.clear()
+        self.lo, self.hi = math.inf, -math.inf
+
+    def factors(self, model: SimpleGameModel) -> List[int]:
+        return [model.n_actions()]
+
+    def apply(self, model: SimpleGameModel, actions: List[int]) -> None:
+        model.act(actions[0])
+
+    def random_actions(self, model: SimpleGameModel, factors: List[int]) -> List[int]:
+        return self.rng.integers(factors)
+
+    def select(self, node: int, factors: List[int], n_edges: int) -> np.ndarray:
+        """
+        Picks an edge for each factor by UCB and returns the edge indices
+        """
+        tree = self.tree
+        start = tree.edge_start[node]
+        visits = tree.edge_visits[start:start + n_edges]
+        values = tree.edge_value[start:start + n_edges]
+        spread = self.hi - self.lo if self.hi > self.lo else 1.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            q = (values / visits - self.lo) / spread
+            ucb = q + self.c * np.sqrt(math.log(tree.node_visits[node] + 1) / visits)
+        # try unvisited actions first, in random order
+        unvisited = visits == 0
+        ucb[unvisited] = 1e9 + self.rng.generator.random(np.count_nonzero(unvisited))
+        if len(factors) == 1 or all(k == factors[0] for k in factors):
+            choice = np.argmax(ucb.reshape(len(factors), -1), axis=1)
+            return start + choice + np.arange(len(factors)) * factors[0]
+        edges = np.empty(len(factors), dtype=np.int64)
+        offset = 0
+        for f, k in enumerate(factors):
+            edges[f] = start + offset + np.argmax(ucb[offset:offset + k])
+            offset += k
+        return edges
+
+    def rollout(self, state: SimpleGameModel, factors: List[int]) -> float:
+        for _ in range(self.rollout_length):
+            if state.is_terminal():
+                break
+            self.apply(state, self.random_actions(state, factors))
+        return state.score()
+
+    def iterate(self, model: HashableGameModel, root: int, factors: List[int], offsets: np.ndarray) -> None:
+        tree = self.tree
+        n_edges = sum(factors)
+        state = copy_model(model)
+        path = []
+        on_path = {root}
+        node = root
+        added = None
+        for depth in range(self.max_depth):
+            edges = self.select(node, factors, n_edges)
+            path.append((node, edges))
+            self.apply(state, (edges - tree.edge_start[node] - offsets).tolist())
+            if state.is_terminal():
+                break
+            key = state.state_hash()
+            child = tree.table.get(key)
+            if child is None:
+                added = tree.add(key, n_edges)
+                break
+            if child in on_path:
+                # e.g. a do-nothing action: stop descending and play out from here
+                break
+            on_path.add(child)
+            node = child
+        value = self.rollout(state, factors)
+        self.lo = min(self.lo, value)
+        self.hi = max(self.hi, value)
+        for node, edges in path:
+            tree.node_visits[node] += 1
+            tree.edge_visits[edges] += 1
+            tree.edge_value[edges] += value
+        if added is not None:
+            tree.node_visits[added] += 1
+
+    def search(self, model: HashableGameModel) -> List[int]:
+        """
+        Runs the search from the model's state and returns the most visited action of each factor
+        """
+        tree = self.tree
+        factors = self.factors(model)
+        n_edges = sum(factors)
+        if n_edges > tree.max_edges:
+            raise ValueError(f"a node needs {n_edges} edges but max_edges is {tree.max_edges}: "
+                             f"raise max_edges, or use MultiUnitMCTS for one factor per unit")
+        if not self.reuse_tree or tree.fill_fraction() > 0.9:
+            self.clear()
+        key = model.state_hash()
+        root = tree.table.get(key)
+        if root is None:
+            root = tree.add(key, n_edges)
+            if root is None:
+                # the tree is not full enough to have been cleared, but has no room for the root
+                self.clear()
+                root = tree.add(key, n_edges)
+        offsets = np.cumsum([0] + factors[:-1])
+        budget = self.budget or Budget(max_iterations=self.n)
+        stats = budget.start()
+        while not budget.exhausted():
+            self.iterate(model, root, factors, offsets)
+            stats.iterations += 1
+            stats.rollouts += 1
+        self.last_stats = stats
+        record_decision(self.metrics_name, stats)
+        start = tree.edge_start[root]
+        visits = tree.edge_visits[start:start + n_edges]
+        actions = []
+        offset = 0
+        for k in factors:
+            actions.append(int(np.argmax(visits[offset:offset + k])))
+            offset += k
+        return actions
+
+    def get_action(self, model: HashableGameModel) -> int:
+        return self.search(model)[0]
+
+
+def test():
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator, NanoRTSParams
+    params = NanoRTSParams(n_units=2)
+    start = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(1)), params)
+    # the same seed makes the same decisions
+    runs = []
+    for _ in range(2):
+        model = start.clone()
+        agent = MCTS(n=100, rng=0)
+        actions = []
+        for _ in range(10):
+            actions.append(agent.get_action(model))
+            model.act(actions[-1])
+        runs.append(actions)
+        assert agent.tree.n_nodes > 1
+    assert runs[0] == runs[1]
+
+    # a partly full tree without room for the root is cleared
+    agent = MCTS(n=10, max_edges=100, rng=0)
+    agent.tree.add(-1, 80)
+    agent.get_action(start)
+    assert -1 not in agent.tree.table and agent.tree.n_nodes > 0
+
+    # 5 ** 10 joint actions don't fit in a node
+    params = NanoRTSParams(n_units=10)
+    big = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(1)), params)
+    try:
+        MCTS(n=10).get_action(big)
+        assert False
+    except ValueError as e:
+        assert "MultiUnitMCTS" in str(e)
+    print(f"mcts ok, actions: {runs[0]}")
+
+
+if __name__ == '__main__':
+    test()
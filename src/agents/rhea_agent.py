@@ -2,30 +2,58 @@
  This will provide implementations of core algorithms such as MCTS and RHEA
 """
 
-from typing import List, Optional
-import random
+from typing import List, Optional, Union
 
-from agents.game_interfaces import SimplePlayerInterface, SimpleGameModel, StateTransitionListener
+from agents.game_interfaces import SimplePlayerInterface, SimpleGameModel, StateTransitionListener, copy_model, \
+    UndoableGameModel, HashableGameModel, TransitionDeltaListener
+from agents.budget import Budget, DecisionStats
+from agents.evaluators import Evaluator
+from agents.rollout_cache import PrefixCache
+from agents.seeding import RandomStream, Seed
+from stats.metrics import METRICS, record_decision
 
 
 class RHEA(SimplePlayerInterface):
-    def __init__(self, l: int = 5, n: int = 10, p_mut: float = 0.2, use_buffer: bool = True, discount: float = None):
+    def __init__(self, l: int = 5, n: int = 10, p_mut: float = 0.2, use_buffer: bool = True, discount: float = None,
+                 budget: Budget = None, n_mutants: int = 1, evaluator: Evaluator = None,
+                 cache: PrefixCache = None, rng: Union[Seed, RandomStream] = None):
+        """
+        :param n: number of iterations per decision, used when no budget is given
+        :param budget: optional time / rollout budget; the agent keeps improving its plan
+               until the budget runs out, and reports its work in last_stats
+        :param n_mutants: number of mutants scored against the current sequence on each iteration
+        :param evaluator: optional evaluator used to score the candidates of each iteration
+               as one batch, e.g. in parallel (not while a listener is set); closed by close()
+        :param cache: optional prefix cache, so that rollouts on HashableGameModels without
+               undo resume from the longest previously seen action prefix
+        :param rng: seed or RandomStream for this agent's random numbers, see agents.seeding
+        """
+        if n_mutants < 1:
+            raise ValueError("n_mutants must be at least 1")
         self.l = l
         self.n = n
         self.p_mut = p_mut
         self.use_buffer = use_buffer
         self.discount = discount
         self.current: List[float] = []
-        self.listener: Optional[StateTransitionListener] = None
+        # a StateTransitionListener is given a copy of the state for every step, a
+        # TransitionDeltaListener only the changes, so rollouts still run in place
+        self.listener: Optional[Union[StateTransitionListener, TransitionDeltaListener]] = None
+        self.budget = budget
+        self.n_mutants = n_mutants
+        self.evaluator = evaluator
+        self.cache = cache
+        self.rng = RandomStream.of(rng)
+        self.last_stats = DecisionStats()
 
     def get_int_action(self, state: SimpleGameModel, action_float: float):
         return int(action_float * state.n_actions())
 
     def random_action_sequence(self) -> List[float]:
-        return [random.random() for _ in range(self.l)]
+        return self.rng.floats(self.l)
 
     def mutate_sequence(self, seq: List[float]) -> List[float]:
-        return [random.random() if random.random() < self.p_mut else x for x in seq]
+        return self.rng.mutate(seq, self.p_mut)
 
     def score_state(self, state: SimpleGameModel, step: int) -> float:
         if self.discount is None:
@@ -35,6 +63,8 @@ class RHEA(SimplePlayerInterface):
             return state.score() * discount
 
     def score(self, state: SimpleGameModel, seq: List[float]) -> float:
+        if isinstance(self.listener, TransitionDeltaListener):
+            return self.score_with_deltas(state, seq, self.listener)
         noted_events = 0
         for step, action_float in enumerate(seq):
             if state.is_terminal():
@@ -43,7 +73,8 @@ class RHEA(SimplePlayerInterface):
             # could delete this if listener not needed - it's a hook to better understand the algorithm or for learning
             if self.listener:
                 next_state = state.child(action)
-                self.listener.state_transition(state, action, next_state)
+                with METRICS.timer("rhea.listener_time"):
+                    self.listener.state_transition(state, action, next_state)
                 state = next_state
                 noted_events += 1
             else:
@@ -51,20 +82,95 @@ class RHEA(SimplePlayerInterface):
         # print(f"{noted_events=}, {state.score()=}")
         return self.score_state(state, len(seq))
 
+    def score_with_deltas(self, state: SimpleGameModel, seq: List[float], listener: TransitionDeltaListener) -> float:
+        """
+        Same as score, with the model reporting its changes to the listener as it goes.
+        The whole rollout counts as listener time, since the model calls the listener
+        from inside each step
+        """
+        with METRICS.timer("rhea.listener_time"):
+            state.delta_listener = listener
+            try:
+                for step, action_float in enumerate(seq):
+                    if state.is_terminal():
+                        value = self.score_state(state, step)
+                        break
+                    action = self.get_int_action(state, action_float)
+                    state.act(action)
+                    listener.step_end(action)
+                else:
+                    value = self.score_state(state, len(seq))
+            finally:
+                state.delta_listener = None
+            listener.rollout_end(value)
+        return value
+
+    def score_cached(self, model: HashableGameModel, seq: List[float]) -> float:
+        """
+        Same as score, but resumes from the longest cached prefix of the sequence and
+        caches the states it passes through
+        """
+        keys = self.cache.prefix_keys(model.state_hash(), seq)
+        start, state = self.cache.resume(model, keys)
+        for step in range(start, len(seq)):
+            if state.is_terminal():
+                return self.score_state(state, step)
+            state.act(self.get_int_action(state, seq[step]))
+            if keys[step + 1] is not None and not state.is_terminal():
+                self.cache.store(keys[step + 1], state)
+        return self.score_state(state, len(seq))
+
+    def evaluate(self, model: SimpleGameModel, seq: List[float]) -> float:
+        """
+        Scores a sequence from the model's current state, leaving the model unchanged.
+        Undoable models are rolled back after the rollout instead of being copied, which is
+        cheaper than the copies the cache makes to resume and store states, so the cache is
+        only used for models without undo.  Listeners see every step, so the cache isn't
+        used while one is set either
+        """
+        in_place = self.listener is None or isinstance(self.listener, TransitionDeltaListener)
+        if in_place and isinstance(model, UndoableGameModel):
+            model.push_undo()
+            try:
+                return self.score(model, seq)
+            finally:
+                model.pop_undo()
+        if self.listener is None and self.cache is not None and isinstance(model, HashableGameModel):
+            return self.score_cached(model, seq)
+        return self.score(copy_model(model), seq)
+
+    def close(self) -> None:
+        if self.evaluator:
+            self.evaluator.close()
+
     def get_action(self, model: SimpleGameModel) -> int:
         if self.use_buffer:
             self.current = self.current or self.random_action_sequence()
         else:
             self.current = self.random_action_sequence()
 
-        for i in range(self.n):
-            mutated_copy = self.mutate_sequence(self.current)
-            current_scored = (self.current, self.score(model.copy_state(), self.current))
-            mutated_scored = (mutated_copy, self.score(model.copy_state(), mutated_copy))
-            if mutated_scored[1] >= current_scored[1]:
-                self.current = mutated_scored[0]
+        # a listener must see every rollout, so score locally rather than on the evaluator's
+        # copies of the agent (in other processes, or calling it from several threads)
+        evaluator = self.evaluator if self.listener is None else None
+        if evaluator:
+            evaluator.set_root(self.evaluate, model)
+        budget = self.budget or Budget(max_iterations=self.n)
+        stats = budget.start()
+        while not budget.exhausted():
+            candidates = [self.current] + [self.mutate_sequence(self.current) for _ in range(self.n_mutants)]
+            if evaluator:
+                scores = evaluator.evaluate(candidates)
+            else:
+                scores = [self.evaluate(model, seq) for seq in candidates]
+            best = max(range(1, len(candidates)), key=scores.__getitem__)
+            if scores[best] >= scores[0]:
+                self.current = candidates[best]
+            stats.iterations += 1
+            stats.rollouts += len(candidates)
+        self.last_stats = stats
+        record_decision("rhea", stats)
         selected_action_float = self.current[0]
         self.current = self.current[1:]
-        self.current.append(random.random())
+        self.current.append(self.rng.random())
         selected_action = self.get_int_action(model, selected_action_float)
         return selected_action
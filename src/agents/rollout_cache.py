@@ -0,0 +1,112 @@
+"""
+ A cache of intermediate rollout states keyed by (root state hash, action prefix).
+ Prefixes are keyed on the agent's genes (e.g. RHEA's action floats) rather than the
+ int actions, so sequences only need converting for the steps that are replayed.
+
+ RHEA keeps a shifted buffer and mutates only a few genes per iteration, so
+ consecutive rollouts from the same root often share long action prefixes.  With
+ this cache a rollout resumes from the state at the end of the longest cached
+ prefix instead of replaying from the root.
+
+ States are stored every `stride` steps, so the cache only has to look up l / stride
+ prefixes per rollout.  Memory is bounded by evicting the least recently used entries.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from agents.game_interfaces import SimpleGameModel, copy_model
+
+PrefixKey = Tuple[int, int, int]
+
+
+class PrefixCache:
+    def __init__(self, max_entries: int = 10000, stride: int = 2):
+        """
+        :param stride: store a state every this many steps.  It should be well below the
+               agents' sequence length l (5 by default) or rollouts never resume part way
+        """
+        self.max_entries = max_entries
+        self.stride = stride
+        self.entries: OrderedDict[PrefixKey, SimpleGameModel] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.steps_saved = 0
+        self.evictions = 0
+        # an agent scoring on a ThreadEvaluator uses its cache from several threads
+        self.lock = threading.Lock()
+
+    def prefix_keys(self, root_hash: int, actions: Sequence[Hashable]) -> List[Optional[PrefixKey]]:
+        """
+        Returns a list with keys[k] set to the key of the first k actions
+        when k is a multiple of stride, and None otherwise
+        """
+        keys: List[Optional[PrefixKey]] = [None] * (len(actions) + 1)
+        h = 0
+        for k, action in enumerate(actions, 1):
+            h = hash((h, action))
+            if k % self.stride == 0:
+                keys[k] = (root_hash, k, h)
+        return keys
+
+    def resume(self, model: SimpleGameModel, keys: List[Optional[PrefixKey]]) -> Tuple[int, SimpleGameModel]:
+        """
+        Finds the longest cached prefix and returns its length and a copy of its state
+        that may be changed freely; returns (0, copy of model) if nothing is cached
+        """
+        with self.lock:
+            for k in range(len(keys) - 1, 0, -1):
+                key = keys[k]
+                if key is not None:
+                    state = self.entries.get(key)
+                    if state is not None:
+                        self.entries.move_to_end(key)
+                        self.hits += 1
+                        self.steps_saved += k
+                        return k, copy_model(state)
+            self.misses += 1
+        return 0, copy_model(model)
+
+    def store(self, key: Optional[PrefixKey], state: SimpleGameModel) -> None:
+        """
+        Stores a copy of the state reached by a prefix, unless it is already cached.
+        Only non-terminal states should be stored, so that a resumed rollout scores
+        terminal states at the step they were first reached
+        """
+        if key is None or key in self.entries:
+            return
+        state = copy_model(state)
+        with self.lock:
+            self.entries[key] = state
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "steps_saved": self.steps_saved,
+            "evictions": self.evictions,
+        }
+
+    def __getstate__(self):
+        # when an agent is sent to a worker process the worker starts with an empty cache
+        state = self.__dict__.copy()
+        state["entries"] = OrderedDict()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
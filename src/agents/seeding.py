@@ -0,0 +1,179 @@
+"""
+ Per-agent random number streams, so that runs are reproducible without relying on
+ the shared global random module (whose state depends on everything else that used
+ it, e.g. other agents in the same process).
+
+ A RandomStream wraps a NumPy Generator and hands out floats from a block drawn in a
+ single vectorised call, refilled when used up.  Mutation masks come from a pre-drawn
+ block of the gaps between mutated genes, so only the genes that change cost a Python
+ step rather than every gene needing a call to random().  A stream made
+ without a seed is seeded from the global random module, so code that calls
+ random.seed() before making its agents stays reproducible.
+
+ split_seeds derives independent seeds for workers or games from one seed with a
+ NumPy SeedSequence, so a parallel run is the same however the work is spread out.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from typing import List, Sequence, Union
+
+import numpy as np
+
+Seed = Union[None, int, np.random.SeedSequence, np.random.Generator]
+
+
+def split_seeds(seed: Union[int, Sequence[int]], n: int) -> List[int]:
+    """
+    n independent 64-bit seeds derived from seed, for random.Random, NumPy or a RandomStream
+    """
+    return [int(child.generate_state(1, np.uint64)[0]) for child in np.random.SeedSequence(seed).spawn(n)]
+
+
+class RandomStream:
+    def __init__(self, seed: Seed = None, block_size: int = 1024):
+        """
+        :param seed: an int, SeedSequence or Generator (used directly); if None the seed is
+               drawn from the global random module
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.generator = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        self.block_size = block_size
+        self._block: List[float] = []
+        self._pos = 0
+        # mutation gaps for the last p_mut used, and the index of the next gene to mutate
+        self._p_mut = None
+        self._gaps: List[int] = []
+        self._gap_pos = 0
+        self._next = 0
+
+    @staticmethod
+    def of(rng: Union[Seed, RandomStream]) -> RandomStream:
+        return rng if isinstance(rng, RandomStream) else RandomStream(rng)
+
+    def floats(self, n: int) -> List[float]:
+        """
+        n uniform floats in [0, 1)
+        """
+        pos = self._pos
+        if pos + n > len(self._block):
+            # keep what is left of the old block, so the values don't depend on the block size
+            self._block = self._block[pos:] + self.generator.random(max(self.block_size, n)).tolist()
+            pos = 0
+        self._pos = pos + n
+        return self._block[pos:pos + n]
+
+    def random(self) -> float:
+        pos = self._pos
+        if pos >= len(self._block):
+            self._block = self.generator.random(self.block_size).tolist()
+            pos = 0
+        self._pos = pos + 1
+        return self._block[pos]
+
+    def randrange(self, n: int) -> int:
+        return int(self.random() * n)
+
+    def integers(self, bounds: Sequence[int]) -> List[int]:
+        """
+        One int in range(k) for each k in bounds
+        """
+        return [int(u * k) for u, k in zip(self.floats(len(bounds)), bounds)]
+
+    def mutate(self, seq: List[float], p_mut: float) -> List[float]:
+        """
+        A copy of seq with each value replaced by a new random float with probability p_mut.
+        Rather than testing every gene, the gaps between mutated genes are drawn from a
+        block of geometric samples, carrying on from one sequence to the next
+        """
+        out = list(seq)
+        if p_mut <= 0:
+            return out
+        if p_mut != self._p_mut:
+            self._p_mut = p_mut
+            self._gaps = self.generator.geometric(p_mut, self.block_size).tolist()
+            self._next = self._gaps[0] - 1
+            self._gap_pos = 1
+        i, n = self._next, len(out)
+        if i < n:
+            gaps, gap_pos = self._gaps, self._gap_pos
+            while i < n:
+                out[i] = self.random()
+                if gap_pos >= len(gaps):
+                    gaps = self._gaps = self.generator.geometric(p_mut, self.block_size).tolist()
+                    gap_pos = 0
+                i += gaps[gap_pos]
+                gap_pos += 1
+            self._gap_pos = gap_pos
+        self._next = i - n
+        return out
+
+
+def test():
+    # the same seed gives the same values however they are drawn
+    a, b = RandomStream(1, block_size=7), RandomStream(1, block_size=1000)
+    assert a.floats(5) + [a.random() for _ in range(20)] + a.floats(30) == b.floats(55)
+    assert RandomStream(np.random.default_rng(2)).floats(3) == RandomStream(2).floats(3)
+    random.seed(3)
+    first = RandomStream().floats(10)
+    random.seed(3)
+    assert RandomStream().floats(10) == first
+    stream = RandomStream(4)
+    seq = stream.floats(10000)
+    mutated = stream.mutate(seq, 0.2)
+    changed = sum(x != y for x, y in zip(seq, mutated)) / len(seq)
+    assert abs(changed - 0.2) < 0.02, changed
+    short = [0.5] * 20
+    changed = sum(x != 0.5 for _ in range(1000) for x in stream.mutate(short, 0.1)) / 20000
+    assert abs(changed - 0.1) < 0.01 and stream.mutate(short, 0) == short, changed
+    assert all(0 <= i < k for i, k in zip(stream.integers([5] * 1000 + [1, 2]), [5] * 1000 + [1, 2]))
+    seeds = split_seeds(5, 4)
+    assert len(set(seeds)) == 4 and seeds == split_seeds(5, 4) and split_seeds(6, 4) != seeds
+
+    # agents with the same seed play the same game, whatever else uses the global random module
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator
+    from agents.rhea_agent import RHEA
+    from agents.mcts_agent import MCTS
+    from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+    from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+    from multi_unit_agents.population_rhea import PopulationRHEA
+    start = NanoRTSModel(NanoStateGenerator().generate_random(random.Random(0)))
+    for make_agent in [lambda rng: RHEA(l=10, n=10, rng=rng), lambda rng: MCTS(n=50, rng=rng),
+                       lambda rng: MultiUnitRHEA(start.n_units(), l=10, n=10, rng=rng),
+                       lambda rng: MultiUnitRandomPlayer(rng),
+                       lambda rng: PopulationRHEA(start.n_units(), l=10, n=3, pop_size=8, rng=rng)]:
+        games = []
+        for game in range(2):
+            random.seed(game)
+            model, agent = start.clone(), make_agent(7)
+            for step in range(10):
+                if isinstance(agent, (RHEA, MCTS)):
+                    model.act(agent.get_action(model))
+                else:
+                    model.combo_act(agent.get_actions(model))
+                random.random()
+            games.append(model.state)
+        assert games[0] == games[1], type(make_agent(0)).__name__
+    print("random streams ok")
+
+
+def speed_test(n: int = 200000, l: int = 20, p_mut: float = 0.2):
+    seq = [random.random() for _ in range(l)]
+    t = time.perf_counter()
+    for _ in range(n):
+        [random.random() if random.random() < p_mut else x for x in seq]
+    t_global = time.perf_counter() - t
+    stream = RandomStream(0)
+    t = time.perf_counter()
+    for _ in range(n):
+        stream.mutate(seq, p_mut)
+    t_stream = time.perf_counter() - t
+    print(f"mutating {l} genes: global random {1e6 * t_global / n:.2f}us, stream {1e6 * t_stream / n:.2f}us")
+
+
+if __name__ == '__main__':
+    test()
+    speed_test()
@@ -0,0 +1,117 @@
+"""
+ Fixed-layout binary encodings of game states, and a shared memory block of state
+ slots for handing states between processes without pickling them.
+
+ A StateCodec encodes every state of a game (up to some capacity of units etc.) into
+ the same number of bytes, so states can be written straight into preallocated
+ buffers.  A SharedStateBlock holds n_slots of them plus a float64 value per slot:
+ the parent writes root states into slots, workers attached to the block by name
+ decode them, and write their results into the values.
+"""
+
+from __future__ import annotations
+
+import pickle
+import time
+from abc import ABC, abstractmethod
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+
+
+class StateCodec(ABC):
+    # number of bytes in an encoded state
+    size: int
+
+    @abstractmethod
+    def encode_into(self, state: Any, buffer, offset: int = 0) -> None:
+        """
+        Writes the state into a writable buffer (bytearray, memoryview, shared memory etc)
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, buffer, offset: int = 0) -> Any:
+        pass
+
+    def encode(self, state: Any) -> bytes:
+        buffer = bytearray(self.size)
+        self.encode_into(state, buffer)
+        return bytes(buffer)
+
+
+class SharedStateBlock:
+    def __init__(self, codec: StateCodec, n_slots: int, name: str = None):
+        """
+        Creates a new block, or attaches to an existing one if its name is given.
+        The creator should call unlink() when every process is done with it
+        """
+        self.codec = codec
+        self.n_slots = n_slots
+        self.values_offset = codec.size * n_slots
+        size = self.values_offset + 8 * n_slots
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.values = np.ndarray(n_slots, dtype=np.float64, buffer=self.memory.buf, offset=self.values_offset)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, slot: int, state: Any) -> None:
+        self.codec.encode_into(state, self.memory.buf, slot * self.codec.size)
+
+    def read(self, slot: int) -> Any:
+        return self.codec.decode(self.memory.buf, slot * self.codec.size)
+
+    def __getstate__(self):
+        # sent to another process as its name: the receiver attaches to the same memory
+        return {"codec": self.codec, "n_slots": self.n_slots, "name": self.name}
+
+    def __setstate__(self, state) -> None:
+        self.__init__(state["codec"], state["n_slots"], state["name"])
+
+    def close(self) -> None:
+        self.values = None
+        self.memory.close()
+
+    def unlink(self) -> None:
+        self.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self) -> SharedStateBlock:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+
+def benchmark(codec: StateCodec, model, n: int = 20000) -> None:
+    """
+    Prints the size and encode / decode times of the model's state with the codec and with pickle
+    """
+    state = model.state
+    buffer = bytearray(codec.size)
+    for label, encode, decode in [
+        ("pickle", lambda: pickle.dumps(state, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ("codec", lambda: codec.encode_into(state, buffer) or buffer, codec.decode),
+    ]:
+        data = encode()
+        t = time.perf_counter()
+        for _ in range(n):
+            encode()
+        t_encode = time.perf_counter() - t
+        t = time.perf_counter()
+        for _ in range(n):
+            decode(data)
+        t_decode = time.perf_counter() - t
+        print(f"{label}: {len(data)} bytes, encode {1e6 * t_encode / n:.2f}us, decode {1e6 * t_decode / n:.2f}us")
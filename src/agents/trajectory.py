@@ -0,0 +1,271 @@
+"""
+ Compact trajectory files: a game is stored as its actions plus a keyframe (the encoded
+ state, see agents.shared_state) every `interval` steps, instead of a list of copied
+ states.  The rules are deterministic, so any step can be rebuilt by decoding the
+ nearest keyframe before it and replaying the actions since.
+
+ The file is written append-only and every record has a fixed size:
+     header
+     block 0: keyframe (state before step 0), then the actions of steps 0 .. interval - 1
+     block 1: keyframe (state before step interval), then the next interval actions
+     ...
+ so the offset of any keyframe or action is computed rather than looked up, and the
+ number of steps follows from the file size.  A file is still readable if the
+ recording stopped part way through a block.
+
+ Actions are stored as rows of `width` int32s: either a single int passed to act, or
+ the action list passed to combo_act, padded with zeros (units beyond the number in
+ a game are not given actions when replaying).
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+from collections.abc import Sequence as SequenceABC
+from typing import Any, Callable, Iterator, Optional, Sequence, Union
+
+import numpy as np
+
+from agents.game_interfaces import SimpleGameModel, StateTransitionListener
+from agents.shared_state import StateCodec
+
+MAGIC = b"NRTSTRJ1"
+# magic, state size, action width, keyframe interval, combo actions
+HEADER = struct.Struct("<8sIIIB")
+
+Action = Union[int, Sequence[int]]
+
+
+class TrajectoryRecorder(StateTransitionListener):
+    def __init__(self, path: str, codec: StateCodec, width: int = 1, interval: int = 64, combo: bool = None):
+        """
+        :param width: ints per action row, e.g. the most units a game can have for combo actions
+        :param interval: steps between keyframes; reading a step replays up to interval - 1 actions
+        :param combo: whether actions are combo_act lists (else act ints); if None it is
+               worked out from the first action recorded, when the header is written
+        """
+        self.path = path
+        self.codec = codec
+        self.width = width
+        self.interval = interval
+        self.combo = combo
+        self.file = open(path, "wb")
+        self.n_steps = 0
+        self._row = np.zeros(width, dtype="<i4")
+        self._last: Optional[SimpleGameModel] = None
+        self._header_written = False
+
+    def write_header(self) -> None:
+        if not self._header_written:
+            self.file.write(HEADER.pack(MAGIC, self.codec.size, self.width, self.interval, bool(self.combo)))
+            self._header_written = True
+
+    def record(self, model: SimpleGameModel, action: Action) -> None:
+        """
+        Records an action about to be applied to the model
+        """
+        combo = not isinstance(action, (int, np.integer))
+        if self.n_steps == 0:
+            if self.combo is None:
+                self.combo = combo
+            self.write_header()
+        if combo != self.combo:
+            raise ValueError(f"recording {'combo' if self.combo else 'single'} actions, got {action!r}")
+        if self.n_steps % self.interval == 0:
+            self.file.write(self.codec.encode(model.state))
+        row = self._row
+        if combo:
+            if len(action) > self.width:
+                raise ValueError(f"{len(action)} actions don't fit rows of width {self.width}")
+            row.fill(0)
+            row[:len(action)] = action
+        else:
+            row[0] = action
+        self.file.write(row.tobytes())
+        self.n_steps += 1
+
+    def state_transition(self, state: SimpleGameModel, action: Action, next_state: SimpleGameModel) -> None:
+        # a recorder holds a single trajectory, so each transition has to start where the last one ended
+        if self._last is not None and state is not self._last:
+            raise ValueError("transition doesn't follow on from the last one: use a recorder per trajectory")
+        self.record(state, action)
+        self._last = next_state
+
+    def close(self) -> None:
+        if not self.file.closed:
+            # a recording with no steps is still a valid (empty) trajectory file
+            self.write_header()
+            self.file.close()
+
+    def __enter__(self) -> TrajectoryRecorder:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class TrajectoryReader(SequenceABC):
+    """
+    A read-only sequence of the n_steps + 1 states of a recorded trajectory (from the
+    initial state to the state after the last action), rebuilt on demand from the
+    memory-mapped file.  make_model turns a decoded state into a model to replay
+    actions on, e.g. lambda state: NanoRTSModel(state, params)
+    """
+
+    def __init__(self, path: str, codec: StateCodec, make_model: Callable[[Any], SimpleGameModel]):
+        self.codec = codec
+        self.make_model = make_model
+        with open(path, "rb") as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, state_size, self.width, self.interval, combo = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        if state_size != codec.size:
+            raise ValueError(f"{path} holds {state_size} byte states, but the codec encodes {codec.size}")
+        self.combo = bool(combo)
+        self.action_size = 4 * self.width
+        self.block_size = state_size + self.interval * self.action_size
+        full, rest = divmod(len(self.mm) - HEADER.size, self.block_size)
+        self.n_steps = full * self.interval + max(0, rest - state_size) // self.action_size
+        # the first keyframe holds the initial state, so a file without one holds no states
+        self.n_states = self.n_steps + 1 if full or rest >= state_size else 0
+
+    def _block(self, i: int) -> int:
+        return HEADER.size + (i // self.interval) * self.block_size
+
+    def action(self, step: int) -> np.ndarray:
+        """
+        The action row of a step, as a read-only view of the file
+        """
+        if not 0 <= step < self.n_steps:
+            raise IndexError(step)
+        offset = self._block(step) + self.codec.size + (step % self.interval) * self.action_size
+        return np.frombuffer(self.mm, dtype="<i4", count=self.width, offset=offset)
+
+    def actions(self) -> np.ndarray:
+        """
+        All the action rows as an [n_steps, width] array
+        """
+        return np.array([self.action(step) for step in range(self.n_steps)], dtype=np.int32).reshape(-1, self.width)
+
+    def apply(self, model: SimpleGameModel, step: int) -> None:
+        row = self.action(step)
+        if self.combo:
+            model.combo_act(row[:model.n_units()].tolist())
+        else:
+            model.act(int(row[0]))
+
+    def model(self, step: int) -> SimpleGameModel:
+        """
+        A model at the given step, from the nearest keyframe at or before it
+        """
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError(step)
+        start = min(step, self.n_steps - 1) // self.interval * self.interval if self.n_steps else 0
+        model = self.make_model(self.codec.decode(self.mm, self._block(start)))
+        for i in range(start, step):
+            self.apply(model, i)
+        return model
+
+    def __getitem__(self, step: int):
+        return self.model(step).state
+
+    def __len__(self) -> int:
+        return self.n_states
+
+    def __iter__(self) -> Iterator:
+        """
+        Replays the whole trajectory once, yielding a copy of each state
+        """
+        if not self.n_states:
+            return
+        model = self.make_model(self.codec.decode(self.mm, HEADER.size))
+        yield model.state.clone()
+        for step in range(self.n_steps):
+            self.apply(model, step)
+            yield model.state.clone()
+
+    def close(self) -> None:
+        self.mm.close()
+
+    def __enter__(self) -> TrajectoryReader:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def test():
+    """
+    Records random games of both versions, reads back every state and compares
+    the file size with pickled copies of the states
+    """
+    import os
+    import pickle
+    import random
+    import tempfile
+    from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+    import old_nano_rts.old_nano_rts_game as old_game
+    import nano_rts.nano_rts_game as new_game
+    from old_nano_rts.old_nano_rts_codec import OldNanoRTSCodec
+    from nano_rts.nano_rts_codec import NanoRTSCodec
+
+    random.seed(0)
+    player = MultiUnitRandomPlayer()
+    old_params, new_params = old_game.NanoRTSParams(), new_game.NanoRTSParams()
+    games = [
+        ("old nano rts", OldNanoRTSCodec.for_params(old_params), old_params.n_units,
+         old_game.NanoRTSModel(old_game.NanoStateGenerator(old_params).generate_random(random.Random(1)), old_params),
+         lambda state: old_game.NanoRTSModel(state, old_params)),
+        ("nano rts", NanoRTSCodec(), 32,
+         new_game.NanoRTSModel(new_game.generate_random_state(new_params, random.Random(1)), new_params),
+         lambda state: new_game.NanoRTSModel(state, new_params)),
+    ]
+    with tempfile.TemporaryDirectory() as folder:
+        for name, codec, width, model, make_model in games:
+            path = os.path.join(folder, "trajectory.bin")
+            states = [model.state.clone()]
+            with TrajectoryRecorder(path, codec, width, interval=16) as recorder:
+                for step in range(200):
+                    if model.is_terminal():
+                        break
+                    actions = player.get_actions(model)
+                    next_model = model.clone()
+                    next_model.combo_act(actions)
+                    recorder.state_transition(model, actions, next_model)
+                    model = next_model
+                    states.append(model.state.clone())
+            with TrajectoryReader(path, codec, make_model) as reader:
+                assert len(reader) == len(states)
+                for step in random.sample(range(len(states)), len(states)):
+                    assert reader[step] == states[step]
+                assert list(reader) == states and reader[-1] == states[-1]
+                size = os.path.getsize(path)
+            pickled = len(pickle.dumps(states, pickle.HIGHEST_PROTOCOL))
+            print(f"{name}: {len(states) - 1} steps in {size} bytes, pickled states take {pickled}")
+
+        # single int actions, and a recording cut off part way through a block
+        model = old_game.NanoRTSModel(old_game.NanoStateGenerator(old_params).generate_random(random.Random(2)))
+        recorder = TrajectoryRecorder(path, games[0][1], interval=8)
+        states = [model.state.clone()]
+        for step in range(21):
+            action = random.randrange(model.n_actions())
+            recorder.record(model, action)
+            model.act(action)
+            states.append(model.state.clone())
+        recorder.close()
+        with TrajectoryReader(path, games[0][1], games[0][4]) as reader:
+            assert not reader.combo and list(reader) == states
+
+        # nothing recorded: the file still has a header, and holds no states
+        TrajectoryRecorder(path, games[0][1]).close()
+        with TrajectoryReader(path, games[0][1], games[0][4]) as reader:
+            assert len(reader) == 0 and list(reader) == []
+    print("trajectories replay ok")
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,162 @@
+"""
+ A TransitionDeltaListener that collects the changes reported during rollouts as
+ tuples, handed over as a batch of int64 records when each rollout ends (converting
+ once per batch is much cheaper than writing each change into an array).
+
+ Each record is a row of FIELDS:
+     kind: UNIT_CHANGED or RESOURCE_CONSUMED
+     rollout, step: which rollout and step it happened in
+     unit_id, x0, y0, x1, y1, change: as reported, with unit_id -1, (x1, y1) = (x0, y0)
+     and change = -amount for a consumed resource
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from agents.game_interfaces import TransitionDeltaListener
+
+UNIT_CHANGED, RESOURCE_CONSUMED = range(2)
+FIELDS = ("kind", "rollout", "step", "unit_id", "x0", "y0", "x1", "y1", "change")
+
+
+class DeltaRecorder(TransitionDeltaListener):
+    def __init__(self, on_rollout: Callable[[np.ndarray, float], None] = None, keep: bool = True):
+        """
+        :param on_rollout: called with the records of each rollout ([n, len(FIELDS)] array) and its score
+        :param keep: keep the records of every rollout, otherwise only those of the current one
+        """
+        self.on_rollout = on_rollout
+        self.keep = keep
+        self.rows: List[Tuple[int, ...]] = []
+        self.rollout = 0
+        self.step = 0
+        self.rollout_start = 0
+        self.scores: List[float] = []
+
+    def unit_changed(self, unit_id: int, x0: int, y0: int, x1: int, y1: int, fuel_change: int) -> None:
+        self.rows.append((UNIT_CHANGED, self.rollout, self.step, unit_id, x0, y0, x1, y1, fuel_change))
+
+    def resource_consumed(self, x: int, y: int, amount: int) -> None:
+        self.rows.append((RESOURCE_CONSUMED, self.rollout, self.step, -1, x, y, x, y, -amount))
+
+    def step_end(self, action) -> None:
+        self.step += 1
+
+    def rollout_end(self, score: float) -> None:
+        if self.on_rollout is not None:
+            self.on_rollout(self.to_array(self.rows[self.rollout_start:]), score)
+        self.scores.append(score)
+        self.rollout += 1
+        self.step = 0
+        if self.keep:
+            self.rollout_start = len(self.rows)
+        else:
+            self.rows.clear()
+
+    @staticmethod
+    def to_array(rows: List[Tuple[int, ...]]) -> np.ndarray:
+        return np.array(rows, dtype=np.int64).reshape(-1, len(FIELDS))
+
+    def records(self) -> np.ndarray:
+        """
+        All the records kept so far as an [n, len(FIELDS)] array
+        """
+        return self.to_array(self.rows)
+
+    def clear(self) -> None:
+        self.rows.clear()
+        self.rollout = self.step = self.rollout_start = 0
+        self.scores.clear()
+
+
+def test():
+    """
+    Rebuilds the unit positions and fuel at the end of random games of both versions
+    from the recorded deltas, and checks RHEA and MultiUnitRHEA report every rollout
+    """
+    import random
+    import old_nano_rts.old_nano_rts_game as old_game
+    import nano_rts.nano_rts_game as new_game
+    from agents.rhea_agent import RHEA
+    from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+
+    rng = random.Random(0)
+    old_model = old_game.NanoRTSModel(old_game.NanoStateGenerator().generate_random(rng))
+    new_model = new_game.NanoRTSModel(new_game.generate_random_state(new_game.NanoRTSParams(), rng))
+    resource = new_game.UnitType.Resource
+    for model, units, resources in [
+        (old_model, lambda m: dict(enumerate(m.state.units)), lambda m: dict(m.state.resources)),
+        (new_model, lambda m: {i: u for i, u in m.state.units.items() if u.type != resource},
+         lambda m: {(u.x, u.y): u.fuel for u in m.state.units.values() if u.type == resource})]:
+        recorder = DeltaRecorder()
+        rebuilt = {unit_id: [unit.x, unit.y, unit.fuel] for unit_id, unit in units(model).items()}
+        rebuilt_resources = resources(model)
+        model = model.clone()
+        model.delta_listener = recorder
+        for step in range(100):
+            actions = [rng.randrange(model.n_actions_unit_i(i)) for i in range(model.n_units())]
+            model.combo_act(actions)
+            recorder.step_end(actions)
+        recorder.rollout_end(model.score())
+        for kind, _, _, unit_id, x0, y0, x1, y1, change in recorder.records().tolist():
+            if kind == UNIT_CHANGED:
+                unit = rebuilt.setdefault(unit_id, [x0, y0, 0])
+                assert unit[:2] == [x0, y0]
+                unit[0], unit[1] = x1, y1
+                unit[2] += change
+            else:
+                rebuilt_resources[x0, y0] += change
+        assert {unit_id: [u.x, u.y, u.fuel] for unit_id, u in units(model).items()} == rebuilt
+        assert resources(model) == {xy: fuel for xy, fuel in rebuilt_resources.items() if fuel}
+
+    for agent, model in [(RHEA(l=10, n=5), old_model), (MultiUnitRHEA(old_model.n_units(), l=10, n=5), old_model),
+                         (MultiUnitRHEA(new_model.n_units(), l=10, n=5), new_model)]:
+        scores = []
+        agent.listener = DeltaRecorder(lambda records, score: scores.append(score))
+        before = model.clone()
+        agent.get_actions(model) if isinstance(agent, MultiUnitRHEA) else agent.get_action(model)
+        assert model.state == before.state and model.delta_listener is None
+        assert len(scores) == agent.last_stats.rollouts and len(agent.listener.records())
+    print("deltas rebuild the states")
+
+
+class CountingListener:
+    """
+    A StateTransitionListener that only counts transitions, for timing the copying listener path
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def state_transition(self, state, action, next_state) -> None:
+        self.count += 1
+
+
+def speed_test(n: int = 200):
+    import random
+    import old_nano_rts.old_nano_rts_game as old_game
+    import nano_rts.nano_rts_game as new_game
+    from agents.rhea_agent import RHEA
+    from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+    old_model = old_game.NanoRTSModel(old_game.NanoStateGenerator().generate_random(random.Random(0)))
+    new_model = new_game.NanoRTSModel(new_game.generate_random_state(new_game.NanoRTSParams(), random.Random(0)))
+    for name, make_agent, model in [("RHEA, old nano rts", lambda: RHEA(l=20, n=n), old_model),
+                                    ("MultiUnitRHEA, nano rts", lambda: MultiUnitRHEA(new_model.n_units(), l=20, n=n),
+                                     new_model)]:
+        for label, listener in [("no listener", None), ("state copies", CountingListener()),
+                                ("deltas", DeltaRecorder(keep=False))]:
+            random.seed(0)
+            agent = make_agent()
+            agent.listener = listener
+            t = time.perf_counter()
+            agent.get_actions(model) if isinstance(agent, MultiUnitRHEA) else agent.get_action(model)
+            print(f"{name}, {label}: {1000 * (time.perf_counter() - t):.1f}ms for {n} iterations")
+
+
+if __name__ == '__main__':
+    test()
+    speed_test()
@@ -0,0 +1,41 @@
+"""
+ Zobrist hashing: each (feature, value) pair of a state maps to a random 64 bit key,
+ and the hash of a state is the XOR of the keys of its features.  A change to one
+ feature can then be applied to the hash with two XORs.
+
+ Keys are derived from the feature tuple with splitmix64 rather than drawn from a
+ random generator, so they are the same in every process and in every run.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Tuple
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class ZobristTable:
+    """
+    Maps tuples of ints to 64 bit keys.  Tuples should start with a tag saying
+    which kind of feature they describe, e.g. (UNIT_POSITION, unit_index, x, y).
+    Keys are cached, so repeated lookups cost a single dict access.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self._keys: Dict[Tuple[int, ...], int] = {}
+
+    def __call__(self, *feature: int) -> int:
+        key = self._keys.get(feature)
+        if key is None:
+            # hash() of a tuple of ints doesn't depend on PYTHONHASHSEED
+            key = splitmix64(splitmix64(hash(feature) & MASK64) ^ self.seed)
+            self._keys[feature] = key
+        return key
@@ -0,0 +1,318 @@
+"""
+Reproducible benchmarks for the game engines, agents and renderers.
+
+Each benchmark builds its workload from a fixed seed, runs it a few times untimed to
+warm up, then times a number of trials of exactly the same work.  Games that reach a
+terminal state are restarted from the start state, so every timed step is a live one.
+Results are rates (higher is better) reported as the mean over the trials with a 95%
+confidence interval, and written as JSON:
+
+    {"meta": {...}, "results": {"old_nano_rts.combo_act": {"unit": "steps/s", "mean": ...,
+                                "std": ..., "ci95": ..., "trials": [...]}, ...}}
+
+Given a baseline file from an earlier run, a benchmark counts as a regression when
+its mean dropped by more than the threshold and the two confidence intervals don't
+overlap, in which case the run exits with status 1.  Timings are only comparable on
+the same machine, so keep the baseline next to the machine it was made on.
+
+Renderer benchmarks (draw_grid, and the dirty-region rendering.cached_renderer) draw
+to an off-screen surface with the SDL dummy video driver, and are skipped when pygame
+is not installed.
+
+Usage: python -m benchmarks.run_benchmarks --out results.json [--baseline baseline.json]
+Add --quick for a smaller, faster run, or --filter rhea to run only some benchmarks.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+import old_nano_rts.old_nano_rts_game as old_game
+import nano_rts.nano_rts_game as new_game
+from agents.rhea_agent import RHEA
+from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+
+# two-sided 95% critical values of Student's t for 1 .. 30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# (l, n, n_units, grid_size) points for the RHEA decision benchmarks
+RHEA_POINTS = [(10, 10, 2, 10), (20, 20, 5, 10), (20, 20, 10, 20)]
+
+
+class Skip(Exception):
+    """
+    Raised by a benchmark setup when it can't run here, e.g. a missing optional package
+    """
+
+
+@dataclass
+class Benchmark:
+    """
+    setup(seed, quick) builds the workload and returns a function that does it once,
+    returning the number of operations done (steps, copies, decisions, frames)
+    """
+    name: str
+    unit: str
+    setup: Callable[[int, bool], Callable[[], int]]
+
+
+def confidence_interval(values: List[float]) -> float:
+    """
+    Half width of the 95% confidence interval of the mean
+    """
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean = sum(values) / n
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    t = T_95[n - 2] if n - 1 <= len(T_95) else 1.96
+    return t * std / math.sqrt(n)
+
+
+def summarise(unit: str, rates: List[float]) -> Dict[str, Any]:
+    n = len(rates)
+    mean = sum(rates) / n
+    std = math.sqrt(sum((r - mean) ** 2 for r in rates) / (n - 1)) if n > 1 else 0.0
+    return {"unit": unit, "mean": mean, "std": std, "ci95": confidence_interval(rates), "trials": rates}
+
+
+def old_model(seed: int, n_units: int = 5, grid_size: int = 10) -> old_game.NanoRTSModel:
+    params = old_game.NanoRTSParams(n_units=n_units, grid_size=grid_size, n_resources=2 * grid_size)
+    return old_game.NanoRTSModel(old_game.NanoStateGenerator(params).generate_random(random.Random(seed)), params)
+
+
+def new_model(seed: int, n_workers: int = 8, grid_size: int = 10) -> new_game.NanoRTSModel:
+    params = new_game.NanoRTSParams(grid_size=grid_size)
+    return new_game.NanoRTSModel(new_game.generate_random_state(params, random.Random(seed), n_workers=n_workers,
+                                                                n_resources=2 * grid_size), params)
+
+
+def random_actions(model, seed: int, n_steps: int) -> List[List[int]]:
+    rng = random.Random(seed)
+    return [[rng.randrange(model.n_actions_unit_i(i)) for i in range(model.n_units())] for _ in range(n_steps)]
+
+
+def combo_act_benchmark(make_model: Callable[[int], Any]) -> Callable[[int, bool], Callable[[], int]]:
+    def setup(seed: int, quick: bool) -> Callable[[], int]:
+        start = make_model(seed)
+        # actions are drawn up front so only the rules are timed
+        actions = random_actions(start, seed, 2000 if quick else 20000)
+
+        def run() -> int:
+            model = start.clone()
+            for step_actions in actions:
+                # a random old game ends within a couple of hundred steps: start it again
+                # rather than timing steps that return straight away
+                if model.is_terminal():
+                    model = start.clone()
+                model.combo_act(step_actions)
+            return len(actions)
+
+        return run
+
+    return setup
+
+
+def copy_state_benchmark(make_model: Callable[[int], Any]) -> Callable[[int, bool], Callable[[], int]]:
+    def setup(seed: int, quick: bool) -> Callable[[], int]:
+        # copy a state part way through a game rather than a freshly generated one
+        model = make_model(seed)
+        for step_actions in random_actions(model, seed, 20):
+            model.combo_act(step_actions)
+        n = 2000 if quick else 20000
+
+        def run() -> int:
+            for _ in range(n):
+                model.copy_state()
+            return n
+
+        return run
+
+    return setup
+
+
+def rhea_benchmark(l: int, n: int, n_units: int, grid_size: int,
+                   multi_unit: bool) -> Callable[[int, bool], Callable[[], int]]:
+    def setup(seed: int, quick: bool) -> Callable[[], int]:
+        start = old_model(seed, n_units, grid_size)
+        n_decisions = 2 if quick else 10
+
+        def run() -> int:
+            # a new agent on the same seed makes the same decisions each trial
+            model = start.clone()
+            agent = MultiUnitRHEA(n_units, l=l, n=n, rng=seed) if multi_unit else RHEA(l=l, n=n, rng=seed)
+            for _ in range(n_decisions):
+                if model.is_terminal():
+                    model = start.clone()
+                if multi_unit:
+                    model.combo_act(agent.get_actions(model))
+                else:
+                    model.act(agent.get_action(model))
+            return n_decisions
+
+        return run
+
+    return setup
+
+
+def render_benchmark(new_version: bool, cached: bool = False) -> Callable[[int, bool], Callable[[], int]]:
+    def setup(seed: int, quick: bool) -> Callable[[], int]:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        try:
+            import pygame
+        except ImportError:
+            raise Skip("pygame is not installed")
+        if new_version:
+            from nano_rts.nano_rts_view_controller import NanoRTSView
+            model = new_model(seed)
+        else:
+            from old_nano_rts.old_nano_rts_view_controller import NanoRTSView
+            model = old_model(seed)
+        view = NanoRTSView(model)
+        surface = pygame.Surface(view.view_size(), pygame.SRCALPHA)
+        actions = random_actions(model, seed, 50 if quick else 500)
+
+        def run() -> int:
+            view.model = model.clone()
+            if cached:
+                from rendering.cached_renderer import CachedGridRenderer
+                renderer = CachedGridRenderer(view, surface)
+            for step_actions in actions:
+                if view.model.is_terminal():
+                    view.model = model.clone()
+                if cached:
+                    renderer.render(view.model.state)
+                else:
+                    view.draw_grid(surface)
+                view.model.combo_act(step_actions)
+            return len(actions)
+
+        return run
+
+    return setup
+
+
+def all_benchmarks() -> List[Benchmark]:
+    benchmarks = [
+        Benchmark("old_nano_rts.combo_act", "steps/s", combo_act_benchmark(old_model)),
+        Benchmark("nano_rts.combo_act", "steps/s", combo_act_benchmark(new_model)),
+        Benchmark("old_nano_rts.copy_state", "copies/s", copy_state_benchmark(old_model)),
+        Benchmark("nano_rts.copy_state", "copies/s", copy_state_benchmark(new_model)),
+    ]
+    for l, n, n_units, grid_size in RHEA_POINTS:
+        point = f"l{l}_n{n}_units{n_units}_grid{grid_size}"
+        benchmarks.append(Benchmark(f"multi_unit_rhea.{point}", "decisions/s",
+                                    rhea_benchmark(l, n, n_units, grid_size, multi_unit=True)))
+        # a single RHEA agent has 5 ** n_units actions per step, so only small teams are practical
+        if n_units <= 2:
+            benchmarks.append(Benchmark(f"rhea.{point}", "decisions/s",
+                                        rhea_benchmark(l, n, n_units, grid_size, multi_unit=False)))
+    benchmarks.append(Benchmark("old_nano_rts.render", "frames/s", render_benchmark(new_version=False)))
+    benchmarks.append(Benchmark("nano_rts.render", "frames/s", render_benchmark(new_version=True)))
+    benchmarks.append(Benchmark("old_nano_rts.render_cached", "frames/s", render_benchmark(False, cached=True)))
+    benchmarks.append(Benchmark("nano_rts.render_cached", "frames/s", render_benchmark(True, cached=True)))
+    return benchmarks
+
+
+def run_benchmark(benchmark: Benchmark, seed: int, trials: int, warmup: int, quick: bool) -> Dict[str, Any]:
+    try:
+        run = benchmark.setup(seed, quick)
+    except Skip as reason:
+        return {"unit": benchmark.unit, "skipped": str(reason)}
+    for _ in range(warmup):
+        run()
+    rates = []
+    for _ in range(trials):
+        t = time.perf_counter()
+        ops = run()
+        rates.append(ops / (time.perf_counter() - t))
+    return summarise(benchmark.unit, rates)
+
+
+def run_all(seed: int = 0, trials: int = 5, warmup: int = 1, quick: bool = False,
+            name_filter: str = None) -> Dict[str, Any]:
+    results = {}
+    for benchmark in all_benchmarks():
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        result = results[benchmark.name] = run_benchmark(benchmark, seed, trials, warmup, quick)
+        if "skipped" in result:
+            print(f"{benchmark.name:45s} skipped: {result['skipped']}")
+        else:
+            print(f"{benchmark.name:45s} {result['mean']:12.1f} +- {result['ci95']:8.1f} {result['unit']}")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": seed,
+            "trials": trials,
+            "warmup": warmup,
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1) -> List[str]:
+    """
+    Prints the change in each benchmark run in both, and returns the names of the
+    regressions: a mean more than threshold (a fraction) below the baseline, with
+    non-overlapping confidence intervals
+    """
+    if baseline["meta"].get("quick") != current["meta"].get("quick"):
+        print("warning: comparing a quick run with a full one")
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or "skipped" in base or "skipped" in result:
+            continue
+        change = result["mean"] / base["mean"] - 1
+        regressed = change < -threshold and result["mean"] + result["ci95"] < base["mean"] - base["ci95"]
+        if regressed:
+            regressions.append(name)
+        print(f"{name:45s} {100 * change:+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the nanoRTS engines, agents and renderers")
+    parser.add_argument("--out", default="benchmarks.json", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fractional slowdown that counts as a regression (default 0.1)")
+    parser.add_argument("--trials", type=int, default=5, help="timed trials per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the trials")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="smaller workloads, for a fast check")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+    current = run_all(args.seed, args.trials, args.warmup, args.quick, args.filter)
+    with open(args.out, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"results in {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
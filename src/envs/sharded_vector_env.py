@@ -0,0 +1,183 @@
+"""
+ A VectorEnv split across worker processes for multi-core data collection.
+
+ The batch is divided into contiguous shards of rows, each stepped by a VectorEnv in
+ its own process.  The observation, action, reward and flag arrays live in shared
+ memory, so the only thing sent through the pipes is a short command per step:
+ the caller writes actions into env.actions (or passes them to step), the workers
+ read them and write their rows of the results in place.
+
+ With the same seed a ShardedVectorEnv generates the same games as a VectorEnv of the
+ whole batch, whatever the number of workers.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from envs.vector_env import VectorEnv, VectorGame, NanoRTSGame, OldNanoRTSGame, buffer_specs
+
+RESET, STEP, CLOSE = range(3)
+
+
+def _attach(names: Dict[str, str], specs, rows: slice = slice(None)):
+    blocks = {name: shared_memory.SharedMemory(name=names[name]) for name in specs}
+    arrays = {name: np.ndarray(shape, dtype, buffer=blocks[name].buf)[rows] for name, (shape, dtype) in specs.items()}
+    return blocks, arrays
+
+
+def _worker(conn, game: VectorGame, names: Dict[str, str], batch_size: int, start: int, stop: int,
+            max_steps: int, seed: int) -> None:
+    blocks, buffers = _attach(names, buffer_specs(game, batch_size), slice(start, stop))
+    env = VectorEnv(game, stop - start, max_steps, seed, buffers, first_row=start)
+    try:
+        while True:
+            command, seeds = conn.recv()
+            if command == RESET:
+                env.reset(seeds)
+            elif command == STEP:
+                env.step()
+            else:
+                break
+            conn.send(env.games_finished)
+    finally:
+        del env, buffers
+        for block in blocks.values():
+            block.close()
+        conn.close()
+
+
+class ShardedVectorEnv:
+    def __init__(self, game: VectorGame, batch_size: int, n_workers: int = None, max_steps: int = None,
+                 seed: int = None):
+        """
+        Takes the same parameters as VectorEnv, plus the number of worker processes
+        (default: one per cpu, but no more than batch_size)
+        """
+        self.game = game
+        self.batch_size = batch_size
+        self.n_workers = min(n_workers or multiprocessing.cpu_count(), batch_size)
+        specs = buffer_specs(game, batch_size)
+        self._blocks = {name: shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+                        for name, (shape, dtype) in specs.items()}
+        arrays = {name: np.ndarray(shape, dtype, buffer=self._blocks[name].buf)
+                  for name, (shape, dtype) in specs.items()}
+        self.obs = arrays["obs"]
+        self.actions = arrays["actions"]
+        self.rewards = arrays["rewards"]
+        self.terminated = arrays["terminated"]
+        self.truncated = arrays["truncated"]
+        self.final_scores = arrays["final_scores"]
+        self.games_finished = 0
+        names = {name: block.name for name, block in self._blocks.items()}
+        bounds = np.linspace(0, batch_size, self.n_workers + 1).astype(int)
+        self.shards: List[Tuple[int, int]] = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        self._conns = []
+        self._processes = []
+        for start, stop in self.shards:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, daemon=True,
+                                              args=(child, game, names, batch_size, start, stop, max_steps, seed))
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        self.closed = False
+
+    def _wait(self) -> None:
+        self.games_finished = sum(conn.recv() for conn in self._conns)
+
+    def reset(self, seeds: Sequence[int] = None) -> np.ndarray:
+        if seeds is not None and len(seeds) != self.batch_size:
+            raise ValueError(f"expected {self.batch_size} seeds, got {len(seeds)}")
+        for conn, (start, stop) in zip(self._conns, self.shards):
+            conn.send((RESET, None if seeds is None else list(seeds[start:stop])))
+        self._wait()
+        return self.obs
+
+    def step(self, actions: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        As VectorEnv.step; the actions are copied into the shared actions array unless
+        they already are that array
+        """
+        if actions is not None and actions is not self.actions:
+            self.actions[...] = actions
+        for conn in self._conns:
+            conn.send((STEP, None))
+        self._wait()
+        return self.obs, self.rewards, self.terminated, self.truncated
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for conn in self._conns:
+            try:
+                conn.send((CLOSE, None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+        # drop the views before releasing the memory under them
+        self.obs = self.actions = self.rewards = self.terminated = self.truncated = self.final_scores = None
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+
+    def __enter__(self) -> ShardedVectorEnv:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
+
+
+def test():
+    """
+    Checks that the sharded env gives exactly the same results as the plain one
+    """
+    for game in [OldNanoRTSGame(), NanoRTSGame()]:
+        single = VectorEnv(game, 10, max_steps=25, seed=3)
+        with ShardedVectorEnv(game, 10, n_workers=3, max_steps=25, seed=3) as sharded:
+            assert np.array_equal(single.reset(), sharded.reset())
+            rng = np.random.default_rng(0)
+            for step in range(60):
+                actions = rng.integers(game.n_actions_unit, size=single.actions.shape)
+                for a, b in zip(single.step(actions), sharded.step(actions)):
+                    assert np.array_equal(a, b)
+                assert np.array_equal(single.final_scores, sharded.final_scores)
+            assert sharded.games_finished == single.games_finished > 0
+            seeds = list(range(100, 110))
+            assert np.array_equal(single.reset(seeds), sharded.reset(seeds))
+    print("sharded env matches vector env")
+
+
+def speed_test(batch_size: int = 256, n_steps: int = 200, n_workers: int = None):
+    game = NanoRTSGame()
+    actions = np.random.default_rng(0).integers(game.n_actions_unit, size=(n_steps, batch_size, game.n_units))
+    for label, env in [("single process", VectorEnv(game, batch_size, max_steps=200, seed=0)),
+                       ("sharded", ShardedVectorEnv(game, batch_size, n_workers, max_steps=200, seed=0))]:
+        with env:
+            env.reset()
+            t = time.perf_counter()
+            for i in range(n_steps):
+                env.step(actions[i])
+            elapsed = time.perf_counter() - t
+        print(f"{label}: {n_steps * batch_size / elapsed:,.0f} env steps per second")
+
+
+if __name__ == '__main__':
+    test()
+    speed_test()
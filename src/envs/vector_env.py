@@ -0,0 +1,273 @@
+"""
+ A Gym style vectorised environment: B games of either nanoRTS version stepped together,
+ with observations as [B, C, grid_size, grid_size] planes for learned policies and
+ value functions.
+
+ All the arrays the environment returns (observations, rewards, terminated and
+ truncated flags, final scores) are allocated once and overwritten in place on
+ every step, so callers that want to keep them must copy them.  Games that end are
+ reset automatically: the observation returned for them is the first observation of
+ the next game, and final_scores holds the score the finished game ended with.
+
+ Rewards are the change in the model's score over the step.
+
+ The games themselves are Python models, so step is a Python loop over the rows,
+ calling each model's combo_act and drawing its planes; only the buffers are batched.
+ For a NumPy step of the old game across the whole batch see
+ old_nano_rts.batch_nano_rts_game, and ShardedVectorEnv to spread the rows over processes.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import nano_rts.nano_rts_game as nano_rts
+import old_nano_rts.old_nano_rts_game as old_nano_rts
+from agents.game_interfaces import MultiUnitGameModel
+
+# observation channels
+UNIT_TYPE, OWNER, FUEL, RESOURCES = range(4)
+N_CHANNELS = 4
+
+
+class VectorGame(ABC):
+    """
+    Says how to make a game and how to draw its state into observation planes.
+    Instances are sent to worker processes by ShardedVectorEnv, so must be picklable.
+    """
+    grid_size: int
+    # width of the action arrays: units beyond the number in a game ignore their action,
+    # and units beyond the width do nothing
+    n_units: int
+    n_actions_unit: int
+
+    @abstractmethod
+    def make(self, rng: random.Random) -> MultiUnitGameModel:
+        pass
+
+    @abstractmethod
+    def observe(self, model: MultiUnitGameModel, out: np.ndarray) -> None:
+        """
+        Writes the planes for the model's state into out, a [C, grid_size, grid_size] array
+        """
+        pass
+
+
+class OldNanoRTSGame(VectorGame):
+    """
+    The old game has a single player and one type of unit, so those planes are 1 where
+    there are units.  Several units can share a cell, so their fuel is added up
+    """
+
+    def __init__(self, params: old_nano_rts.NanoRTSParams = None):
+        self.params = params or old_nano_rts.NanoRTSParams()
+        self.grid_size = self.params.grid_size
+        self.n_units = self.params.n_units
+        self.n_actions_unit = old_nano_rts.NanoRTSModel.actions_per_unit
+        self.generator = old_nano_rts.NanoStateGenerator(self.params)
+
+    def make(self, rng: random.Random) -> old_nano_rts.NanoRTSModel:
+        return old_nano_rts.NanoRTSModel(self.generator.generate_random(rng), self.params)
+
+    def observe(self, model: old_nano_rts.NanoRTSModel, out: np.ndarray) -> None:
+        out.fill(0)
+        g = self.grid_size
+        for unit in model.state.units:
+            x, y = int(unit.x) % g, int(unit.y) % g
+            out[UNIT_TYPE, x, y] = 1
+            out[OWNER, x, y] = 1
+            out[FUEL, x, y] += unit.fuel
+        # the model's resource grid is already an [x, y] array of fuel
+        out[RESOURCES] = model.resource_grid().as_numpy()
+
+
+class NanoRTSGame(VectorGame):
+    """
+    The two player game: the type plane holds the UnitType value and the owner plane
+    player_id + 1, with 0 for empty cells.  Resources only appear in the resource plane
+    """
+
+    def __init__(self, params: nano_rts.NanoRTSParams = None, n_units: int = 32, n_workers: int = 2,
+                 n_resources: int = 5):
+        self.params = params or nano_rts.NanoRTSParams()
+        self.grid_size = self.params.grid_size
+        self.n_units = n_units
+        self.n_actions_unit = nano_rts.N_UNIT_ACTIONS
+        self.n_workers = n_workers
+        self.n_resources = n_resources
+
+    def make(self, rng: random.Random) -> nano_rts.NanoRTSModel:
+        state = nano_rts.generate_random_state(self.params, rng, self.n_workers, self.n_resources)
+        return nano_rts.NanoRTSModel(state, self.params)
+
+    def observe(self, model: nano_rts.NanoRTSModel, out: np.ndarray) -> None:
+        out.fill(0)
+        resource = nano_rts.UnitType.Resource
+        for unit in model.state.units.values():
+            x, y = unit.x, unit.y
+            if unit.type == resource:
+                out[RESOURCES, x, y] = unit.fuel
+            else:
+                out[UNIT_TYPE, x, y] = unit.type
+                out[OWNER, x, y] = unit.player_id + 1
+                out[FUEL, x, y] = unit.fuel
+
+
+def buffer_specs(game: VectorGame, batch_size: int) -> Dict[str, Tuple[Tuple[int, ...], np.dtype]]:
+    """
+    Shapes and types of the arrays a vector env reads and writes
+    """
+    g = game.grid_size
+    return {
+        "obs": ((batch_size, N_CHANNELS, g, g), np.dtype(np.float32)),
+        "actions": ((batch_size, game.n_units), np.dtype(np.int64)),
+        "rewards": ((batch_size,), np.dtype(np.float32)),
+        "terminated": ((batch_size,), np.dtype(np.bool_)),
+        "truncated": ((batch_size,), np.dtype(np.bool_)),
+        "final_scores": ((batch_size,), np.dtype(np.float64)),
+    }
+
+
+def allocate_buffers(game: VectorGame, batch_size: int) -> Dict[str, np.ndarray]:
+    return {name: np.zeros(shape, dtype) for name, (shape, dtype) in buffer_specs(game, batch_size).items()}
+
+
+class VectorEnv:
+    def __init__(self, game: VectorGame, batch_size: int, max_steps: int = None, seed: int = None,
+                 buffers: Dict[str, np.ndarray] = None, first_row: int = 0):
+        """
+        :param max_steps: games still running after this many steps are truncated and reset
+        :param seed: games are generated from a random.Random per row, seeded from (seed, row)
+        :param buffers: arrays to use instead of allocating them, as given by allocate_buffers
+        :param first_row: index of the first row within a larger batch, so that a shard of a
+               ShardedVectorEnv generates the same games as a VectorEnv of the whole batch
+        """
+        self.game = game
+        self.batch_size = batch_size
+        self.max_steps = max_steps
+        self.first_row = first_row
+        buffers = buffers or allocate_buffers(game, batch_size)
+        self.obs = buffers["obs"]
+        self.actions = buffers["actions"]
+        self.rewards = buffers["rewards"]
+        self.terminated = buffers["terminated"]
+        self.truncated = buffers["truncated"]
+        self.final_scores = buffers["final_scores"]
+        self.rngs = [random.Random(None if seed is None else hash((seed, first_row + b))) for b in range(batch_size)]
+        self.models: List[Optional[MultiUnitGameModel]] = [None] * batch_size
+        self.scores = np.zeros(batch_size, dtype=np.float64)
+        self.steps = np.zeros(batch_size, dtype=np.int64)
+        self.games_finished = 0
+
+    def _new_game(self, b: int) -> None:
+        model = self.game.make(self.rngs[b])
+        self.models[b] = model
+        self.scores[b] = model.score()
+        self.steps[b] = 0
+        self.game.observe(model, self.obs[b])
+
+    def reset(self, seeds: Sequence[int] = None) -> np.ndarray:
+        """
+        Starts a new game in every row and returns the observations.  If seeds are
+        given, row b's games are generated from random.Random(seeds[b]) from now on
+        """
+        if seeds is not None:
+            if len(seeds) != self.batch_size:
+                raise ValueError(f"expected {self.batch_size} seeds, got {len(seeds)}")
+            self.rngs = [random.Random(seed) for seed in seeds]
+        for b in range(self.batch_size):
+            self._new_game(b)
+        self.rewards.fill(0)
+        self.terminated.fill(False)
+        self.truncated.fill(False)
+        return self.obs
+
+    def step(self, actions: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Applies actions[b] to game b and returns (obs, rewards, terminated, truncated).
+        If actions is None the env's own actions array is used, which callers may fill in place.
+        The rows are stepped one after another
+        """
+        if self.models[0] is None:
+            raise RuntimeError("call reset() before step()")
+        if actions is None:
+            actions = self.actions
+        max_steps = self.max_steps
+        for b in range(self.batch_size):
+            model = self.models[b]
+            model.combo_act(actions[b].tolist())
+            self.steps[b] += 1
+            score = model.score()
+            self.rewards[b] = score - self.scores[b]
+            terminated = model.is_terminal()
+            truncated = not terminated and max_steps is not None and self.steps[b] >= max_steps
+            self.terminated[b] = terminated
+            self.truncated[b] = truncated
+            if terminated or truncated:
+                self.final_scores[b] = score
+                self.games_finished += 1
+                self._new_game(b)
+            else:
+                self.scores[b] = score
+                self.game.observe(model, self.obs[b])
+        return self.obs, self.rewards, self.terminated, self.truncated
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> VectorEnv:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def test():
+    """
+    Checks that the observations match the models, are reused in place and that
+    finished games are reset
+    """
+    for game in [OldNanoRTSGame(), NanoRTSGame()]:
+        env = VectorEnv(game, 8, max_steps=30, seed=1)
+        obs = env.reset()
+        rng = np.random.default_rng(0)
+        expected = np.zeros_like(obs[0])
+        for step in range(100):
+            actions = rng.integers(game.n_actions_unit, size=env.actions.shape)
+            before = env.scores.copy()
+            result, rewards, terminated, truncated = env.step(actions)
+            assert result is obs
+            for b, model in enumerate(env.models):
+                game.observe(model, expected)
+                assert np.array_equal(obs[b], expected)
+                if terminated[b] or truncated[b]:
+                    assert rewards[b] == env.final_scores[b] - before[b] and env.steps[b] == 0
+                else:
+                    assert rewards[b] == model.score() - before[b]
+        assert env.games_finished >= env.batch_size * (100 // 30)
+        # the same seeds give the same games
+        first = env.reset(list(range(8))).copy()
+        assert np.array_equal(env.reset(list(range(8))), first)
+    print("vector env ok")
+
+
+def speed_test(batch_size: int = 64, n_steps: int = 500):
+    for game in [OldNanoRTSGame(), NanoRTSGame()]:
+        env = VectorEnv(game, batch_size, max_steps=200, seed=0)
+        env.reset()
+        actions = np.random.default_rng(0).integers(game.n_actions_unit, size=(n_steps, batch_size, game.n_units))
+        t = time.perf_counter()
+        for i in range(n_steps):
+            env.step(actions[i])
+        elapsed = time.perf_counter() - t
+        print(f"{type(game).__name__}: {n_steps * batch_size / elapsed:,.0f} env steps per second")
+
+
+if __name__ == '__main__':
+    test()
+    speed_test()
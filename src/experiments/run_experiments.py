@@ -0,0 +1,206 @@
+"""
+Headless experiment runner for the old nanoRTS game.
+
+Plays every combination of agent config, game params and seed, spreading the games
+across a process pool.  Games are handed out one at a time, so idle workers pick up
+the next game as soon as they finish (no static partitioning).  Each result is
+appended to a CSV file and flushed as soon as the game finishes, so a crash loses
+at most the games in progress, and re-running with the same output file skips the
+games that are already recorded.
+
+Example config file:
+{
+    "agents": [
+        {"type": "random"},
+        {"type": "rhea", "l": 20, "n": 20, "p_mut": 0.25, "discount": 0.999},
+        {"type": "multi_rhea", "l": 20, "n": 20, "p_mut": 0.2}
+    ],
+    "games": [
+        {"grid_size": 10, "n_units": 2, "n_resources": 10},
+        {"grid_size": 20, "n_units": 5, "n_resources": 20}
+    ],
+    "seeds": [0, 1, 2],
+    "max_steps": 200
+}
+
+Usage: python -m experiments.run_experiments --config sweep.json --out results.csv --workers 8
+Add --metrics metrics.json to profile the games (see stats.metrics).
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from typing import Any, Dict, Iterator, List, Set, Tuple, Union
+
+from agents.game_interfaces import MultiUnitPlayerInterface, SimplePlayerInterface
+from agents.rhea_agent import RHEA
+from agents.seeding import RandomStream, split_seeds
+from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+from multi_unit_agents.population_rhea import PopulationRHEA
+from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoRTSParams, NanoStateGenerator
+from stats.metrics import METRICS
+
+DEFAULT_CONFIG = {
+    "agents": [
+        {"type": "random"},
+        {"type": "rhea", "l": 20, "n": 20, "p_mut": 0.25, "discount": 0.999},
+        {"type": "multi_rhea", "l": 20, "n": 20, "p_mut": 0.2},
+    ],
+    "games": [{"grid_size": 10, "n_units": 2, "n_resources": 10}],
+    "seeds": [0, 1, 2],
+    "max_steps": 200,
+}
+
+COLUMNS = ["key", "agent", "agent_config", "grid_size", "n_units", "n_resources", "seed",
+           "final_score", "steps", "terminal", "decision_time_mean", "decision_time_max", "wall_time"]
+
+Task = Tuple[str, Dict[str, Any], Dict[str, Any], int, int]
+
+
+def make_agent(config: Dict[str, Any], n_units: int, seed: int) -> Union[SimplePlayerInterface,
+                                                                         MultiUnitPlayerInterface]:
+    """
+    The agent draws its random numbers from its own stream, seeded from the game's seed,
+    so a game plays out the same whichever worker runs it and whatever ran there before
+    """
+    kwargs = {k: v for k, v in config.items() if k != "type"}
+    agent_type = config["type"]
+    rng = RandomStream(split_seeds(seed, 1)[0])
+    if agent_type == "random":
+        return MultiUnitRandomPlayer(rng)
+    if agent_type == "rhea":
+        return RHEA(**kwargs, rng=rng)
+    if agent_type == "multi_rhea":
+        return MultiUnitRHEA(n_units, **kwargs, rng=rng)
+    if agent_type == "population_rhea":
+        return PopulationRHEA(n_units, **kwargs, rng=rng)
+    raise ValueError(f"unknown agent type: {agent_type}")
+
+
+def task_key(agent_config: Dict[str, Any], game_config: Dict[str, Any], seed: int) -> str:
+    return json.dumps([agent_config, game_config, seed], sort_keys=True)
+
+
+def make_tasks(config: Dict[str, Any]) -> Iterator[Task]:
+    max_steps = config.get("max_steps", DEFAULT_CONFIG["max_steps"])
+    for agent_config, game_config, seed in itertools.product(config["agents"], config["games"], config["seeds"]):
+        yield task_key(agent_config, game_config, seed), agent_config, game_config, seed, max_steps
+
+
+def run_game(task: Task) -> Dict[str, Any]:
+    """
+    Plays one game and returns its result row.  Runs in a worker process.
+    """
+    key, agent_config, game_config, seed, max_steps = task
+    t_start = time.perf_counter()
+    random.seed(seed)
+    params = NanoRTSParams(**game_config)
+    model = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(seed)), params)
+    agent = make_agent(agent_config, params.n_units, seed)
+    decision_times: List[float] = []
+    steps = 0
+    if METRICS.enabled:
+        METRICS.reset()
+    while steps < max_steps and not model.is_terminal():
+        t0 = time.perf_counter()
+        if isinstance(agent, MultiUnitPlayerInterface):
+            actions = agent.get_actions(model)
+            decision_times.append(time.perf_counter() - t0)
+            model.combo_act(actions)
+        else:
+            action = agent.get_action(model)
+            decision_times.append(time.perf_counter() - t0)
+            model.act(action)
+        steps += 1
+    return {
+        "key": key,
+        "agent": agent_config["type"],
+        "agent_config": json.dumps(agent_config, sort_keys=True),
+        "grid_size": params.grid_size,
+        "n_units": params.n_units,
+        "n_resources": params.n_resources,
+        "seed": seed,
+        "final_score": model.score(),
+        "steps": steps,
+        "terminal": model.is_terminal(),
+        "decision_time_mean": sum(decision_times) / len(decision_times) if decision_times else 0.0,
+        "decision_time_max": max(decision_times, default=0.0),
+        "wall_time": time.perf_counter() - t_start,
+        # not a CSV column: collected by run when metrics are enabled
+        "metrics": METRICS.snapshot() if METRICS.enabled else None,
+    }
+
+
+def completed_keys(path: str) -> Set[str]:
+    """
+    Returns the keys of the games already recorded in a results file
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="") as f:
+        return {row["key"] for row in csv.DictReader(f)}
+
+
+def run(config: Dict[str, Any], out_path: str, n_workers: int = None, metrics_path: str = None) -> int:
+    """
+    Runs all the games in config that are not already in out_path, and returns the number played.
+    If metrics_path is given the games are profiled (see stats.metrics) and the metrics
+    snapshot of each game is written there as JSON, keyed by the game's key, merged into
+    the snapshots already in the file from earlier runs
+    """
+    done = completed_keys(out_path)
+    tasks = [task for task in make_tasks(config) if task[0] not in done]
+    if not tasks:
+        return 0
+    new_file = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+    snapshots = {}
+    if metrics_path:
+        if os.path.exists(metrics_path) and os.path.getsize(metrics_path) > 0:
+            with open(metrics_path) as f:
+                snapshots = json.load(f)
+        # read by the workers when they start
+        os.environ["NANORTS_METRICS"] = "1"
+        METRICS.enable()
+    with open(out_path, "a", newline="") as f, multiprocessing.Pool(n_workers) as pool:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+        for i, row in enumerate(pool.imap_unordered(run_game, tasks, chunksize=1)):
+            snapshot = row.pop("metrics")
+            if snapshot is not None:
+                snapshots[row["key"]] = snapshot
+            writer.writerow(row)
+            f.flush()
+            print(f"[{i + 1}/{len(tasks)}] {row['agent']} seed={row['seed']} "
+                  f"score={row['final_score']} steps={row['steps']}")
+    if metrics_path:
+        with open(metrics_path, "w") as f:
+            json.dump(snapshots, f, indent=2)
+    return len(tasks)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a sweep of nanoRTS games")
+    parser.add_argument("--config", help="JSON file with agents, games, seeds and max_steps")
+    parser.add_argument("--out", default="results.csv", help="CSV file to append results to")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--metrics", help="JSON file to write per-game profiling metrics to")
+    args = parser.parse_args(argv)
+    config = DEFAULT_CONFIG
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    n_played = run(config, args.out, args.workers, args.metrics)
+    print(f"played {n_played} games, results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+ Factored MCTS for multi-unit games.
+
+ The joint action space of old_nano_rts is 5 ** n_units, far too many children per
+ node once there are more than a few units.  Here every unit keeps its own action
+ statistics at each node and picks its action by UCB independently of the others;
+ the joint action is applied to the game and the result is credited to each unit's
+ chosen action.  A node then needs only sum(action_space) edges.
+"""
+
+from __future__ import annotations
+
+import random
+from typing import List
+
+from agents.game_interfaces import MultiUnitPlayerInterface, MultiUnitGameModel
+from agents.mcts_agent import MCTS
+
+
+class MultiUnitMCTS(MCTS, MultiUnitPlayerInterface):
+    metrics_name = "multi_unit_mcts"
+
+    def factors(self, model: MultiUnitGameModel) -> List[int]:
+        return model.get_action_space()
+
+    def apply(self, model: MultiUnitGameModel, actions: List[int]) -> None:
+        model.combo_act(actions)
+
+    def get_actions(self, model: MultiUnitGameModel) -> List[int]:
+        return self.search(model)
+
+
+def test():
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator, NanoRTSParams
+    params = NanoRTSParams(n_units=5)
+    model = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(1)), params)
+    agent = MultiUnitMCTS(n=200, rollout_length=20)
+    for i in range(30):
+        model.combo_act(agent.get_actions(model))
+    print(f"score after 30 steps: {model.score()}, tree nodes: {agent.tree.n_nodes}")
+
+
+if __name__ == '__main__':
+    test()
@@ -1,10 +1,12 @@
-import random
-from typing import List
+from typing import List, Union
 
 from agents.game_interfaces import MultiUnitPlayerInterface, MultiUnitGameModel
+from agents.seeding import RandomStream, Seed
 
 
 class MultiUnitRandomPlayer(MultiUnitPlayerInterface):
-    def get_actions(self, model: MultiUnitGameModel) -> List[int]:
-        return [random.randrange(model.n_actions_unit_i(i)) for i in range(model.n_units())]
+    def __init__(self, rng: Union[Seed, RandomStream] = None):
+        self.rng = RandomStream.of(rng)
 
+    def get_actions(self, model: MultiUnitGameModel) -> List[int]:
+        return self.rng.integers(model.get_action_space())
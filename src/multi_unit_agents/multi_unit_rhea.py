@@ -1,58 +1,342 @@
 """
  This will provide implementations of core algorithms such as MCTS and RHEA
+
+ The plan is an [n_units, l] NumPy array of action floats, one row per unit.  A
+ mutant is a copy of the incumbent with one row rewritten; the incumbent's score is
+ kept from the iteration that accepted it rather than being rolled out again.
+
+ With coevolve set, each iteration instead mutates every unit's row, scoring each
+ against the other units' current rows (cooperative coevolution): the mutants are
+ rolled out as one batch on a BatchableGameModel, and the improving rows are merged.
 """
 
 from __future__ import annotations
 
-import copy
-from typing import List, Optional
-import random
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
 
 from agents.game_interfaces import MultiUnitPlayerInterface, StateTransitionListener, \
-    MultiUnitGameModel
+    MultiUnitGameModel, copy_model, UndoableGameModel, HashableGameModel, TransitionDeltaListener, \
+    BatchableGameModel
+from agents.budget import Budget, DecisionStats
+from agents.evaluators import Evaluator
+from agents.rollout_cache import PrefixCache
+from agents.seeding import RandomStream, Seed
+from stats.metrics import METRICS, record_decision
+
+# a plan: [n_units, l] action floats (a list of per-unit lists is accepted too)
+Genome = Union[np.ndarray, List[List[float]]]
+
+# below this many candidates the sequential rollouts are quicker than a batch (old
+# nano rts, l=20: a batch of 8 costs twice as much per rollout, a batch of 64 a third)
+MIN_BATCH = 24
 
 
 class MultiUnitRHEA(MultiUnitPlayerInterface):
-    def __init__(self, n_units: int, l: int = 5, n: int = 10, p_mut: float = 0.2):
+    def __init__(self, n_units: int, l: int = 5, n: int = 10, p_mut: float = 0.2, budget: Budget = None,
+                 n_mutants: int = 1, evaluator: Evaluator = None, cache: PrefixCache = None,
+                 cache_incumbent_fitness: bool = True, coevolve: bool = False,
+                 rng: Union[Seed, RandomStream] = None):
+        """
+        :param n: number of iterations per decision, used when no budget is given
+        :param budget: optional time / rollout budget; the agent keeps improving its plan
+               until the budget runs out, and reports its work in last_stats
+        :param n_mutants: number of mutants scored against the current sequences on each iteration
+               (for each unit, when coevolving)
+        :param evaluator: optional evaluator used to score the candidates of each iteration
+               as one batch, e.g. in parallel (not while a listener is set); closed by close()
+        :param cache: optional prefix cache, so that rollouts on HashableGameModels without
+               undo resume from the longest previously seen action prefix
+        :param cache_incumbent_fitness: if set, the current plan is scored once per decision
+               rather than on every iteration.  This is exact for deterministic games
+        :param coevolve: mutate every unit's row on each iteration, against the others'
+               current rows, rather than one randomly chosen row; an iteration then costs
+               about n_units * n_mutants rollouts
+        :param rng: seed or RandomStream for this agent's random numbers, see agents.seeding
+        """
+        if n_mutants < 1:
+            raise ValueError("n_mutants must be at least 1")
         self.n_units = n_units
         self.l = l
         self.n = n
         self.p_mut = p_mut
-        self.current: List[List[float]] = [self.random_action_sequence() for _ in range(n_units)]
-        self.listener: Optional[StateTransitionListener] = None
+        self.rng = RandomStream.of(rng)
+        self.current: np.ndarray = self.random_genome()
+        self.current_fitness: Optional[float] = None
+        # a StateTransitionListener is given a copy of the state for every step (with the
+        # action list as the action), a TransitionDeltaListener only the changes
+        self.listener: Optional[Union[StateTransitionListener, TransitionDeltaListener]] = None
+        self.budget = budget
+        self.n_mutants = n_mutants
+        self.evaluator = evaluator
+        self.cache = cache
+        self.cache_incumbent_fitness = cache_incumbent_fitness
+        self.coevolve = coevolve
+        self.last_stats = DecisionStats()
 
     def get_int_actions(self, state: MultiUnitGameModel, action_floats: List[float]) -> List[int]:
         return [int(action_float * state.n_actions_unit_i(i)) for i, action_float in enumerate(action_floats)]
 
     def random_action_sequence(self) -> List[float]:
-        return [random.random() for _ in range(self.l)]
+        return self.rng.floats(self.l)
 
     def mutate_sequence(self, seq: List[float]) -> List[float]:
-        return [random.random() if random.random() < self.p_mut else x for x in seq]
+        return self.rng.mutate(seq, self.p_mut)
+
+    def random_genome(self) -> np.ndarray:
+        return np.array(self.rng.floats(self.n_units * self.l)).reshape(self.n_units, self.l)
+
+    def mutate_row(self, genome: np.ndarray, unit: int) -> np.ndarray:
+        """
+        A copy of the genome with one unit's row mutated; the parent is left unchanged
+        """
+        child = genome.copy()
+        child[unit] = self.mutate_sequence(genome[unit].tolist())
+        return child
 
-    def mutate_sequence_array(self, seq_array: List[List[float]]) -> List[List[float]]:
-        seq_index = random.randint(0, len(seq_array) - 1)
-        seq_copy: List[List[float]] = copy.deepcopy(seq_array)
-        seq_copy[seq_index] = self.mutate_sequence(seq_copy[seq_index])
-        return seq_copy
+    def mutate_sequence_array(self, genome: np.ndarray) -> np.ndarray:
+        return self.mutate_row(genome, self.rng.randrange(len(genome)))
 
-    def score(self, state: MultiUnitGameModel, seq: List[List[float]]) -> float:
-        for action_floats in zip(*seq):
+    @staticmethod
+    def steps(seq: Genome) -> List[List[float]]:
+        """
+        The action floats of all the units for each step
+        """
+        return np.asarray(seq, dtype=np.float64).T.tolist()
+
+    def score(self, state: MultiUnitGameModel, seq: Genome) -> float:
+        listener = self.listener
+        if isinstance(listener, TransitionDeltaListener):
+            return self.score_with_deltas(state, seq, listener)
+        for action_floats in self.steps(seq):
             if state.is_terminal():
                 return state.score()
             actions = self.get_int_actions(state, action_floats)
-            state.combo_act(actions)
+            if listener:
+                next_state = copy_model(state)
+                next_state.combo_act(actions)
+                with METRICS.timer("multi_unit_rhea.listener_time"):
+                    listener.state_transition(state, actions, next_state)
+                state = next_state
+            else:
+                state.combo_act(actions)
         return state.score()
 
+    def score_with_deltas(self, state: MultiUnitGameModel, seq: Genome,
+                          listener: TransitionDeltaListener) -> float:
+        """
+        Same as score, with the model reporting its changes to the listener as it goes.
+        The whole rollout counts as listener time, since the model calls the listener
+        from inside each step
+        """
+        with METRICS.timer("multi_unit_rhea.listener_time"):
+            state.delta_listener = listener
+            try:
+                for action_floats in self.steps(seq):
+                    if state.is_terminal():
+                        break
+                    actions = self.get_int_actions(state, action_floats)
+                    state.combo_act(actions)
+                    listener.step_end(actions)
+                value = state.score()
+            finally:
+                state.delta_listener = None
+            listener.rollout_end(value)
+        return value
+
+    def score_cached(self, model: HashableGameModel, seq: Genome) -> float:
+        """
+        Same as score, but resumes from the longest cached prefix of the sequences and
+        caches the states it passes through
+        """
+        steps = [tuple(step) for step in self.steps(seq)]
+        keys = self.cache.prefix_keys(model.state_hash(), steps)
+        start, state = self.cache.resume(model, keys)
+        for step in range(start, len(steps)):
+            if state.is_terminal():
+                return state.score()
+            state.combo_act(self.get_int_actions(state, steps[step]))
+            if keys[step + 1] is not None and not state.is_terminal():
+                self.cache.store(keys[step + 1], state)
+        return state.score()
+
+    def evaluate(self, model: MultiUnitGameModel, seq: Genome) -> float:
+        """
+        Scores a sequence array from the model's current state, leaving the model unchanged.
+        Undoable models are rolled back after the rollout instead of being copied, which is
+        cheaper than the copies the cache makes to resume and store states, so the cache is
+        only used for models without undo.  Listeners see every step, so the cache isn't
+        used while one is set either
+        """
+        in_place = self.listener is None or isinstance(self.listener, TransitionDeltaListener)
+        if in_place and isinstance(model, UndoableGameModel):
+            model.push_undo()
+            try:
+                return self.score(model, seq)
+            finally:
+                model.pop_undo()
+        if self.listener is None and self.cache is not None and isinstance(model, HashableGameModel):
+            return self.score_cached(model, seq)
+        return self.score(copy_model(model), seq)
+
+    def score_batched(self, model: BatchableGameModel, genomes: Sequence[np.ndarray]) -> List[float]:
+        """
+        Rolls out the genomes together on a batch copy of the model, as PopulationRHEA.score
+        does, giving the same scores as evaluate
+        """
+        action_space = np.array(model.get_action_space())
+        actions = (np.stack(genomes) * action_space[:, None]).astype(np.int64)
+        batch = model.to_batch(len(genomes))
+        for step in range(actions.shape[2]):
+            batch.combo_act(actions[:, :, step])
+        return np.asarray(batch.score(), dtype=np.float64).tolist()
+
+    def score_all(self, model: MultiUnitGameModel, genomes: List[np.ndarray], stats: DecisionStats) -> List[float]:
+        """
+        Scores the genomes with the evaluator if there is one, as a batch of rollouts if the
+        model allows it, or one by one.  A listener must see every rollout, so neither the
+        evaluator (which scores on copies of the agent) nor batching is used while one is set,
+        and batching would bypass the cache, which evaluate uses for models without undo
+        """
+        stats.rollouts += len(genomes)
+        if self.evaluator and self.listener is None:
+            return list(self.evaluator.evaluate(genomes))
+        uses_cache = self.cache is not None and not isinstance(model, UndoableGameModel)
+        if len(genomes) >= MIN_BATCH and self.listener is None and not uses_cache and \
+                isinstance(model, BatchableGameModel) and model.n_units() == self.n_units:
+            return self.score_batched(model, genomes)
+        return [self.evaluate(model, genome) for genome in genomes]
+
+    def incumbent_fitness(self, model: MultiUnitGameModel, stats: DecisionStats) -> float:
+        if self.current_fitness is None or not self.cache_incumbent_fitness:
+            self.current_fitness = self.score_all(model, [self.current], stats)[0]
+        return self.current_fitness
+
+    def hill_climb(self, model: MultiUnitGameModel, stats: DecisionStats) -> None:
+        mutants = [self.mutate_sequence_array(self.current) for _ in range(self.n_mutants)]
+        if self.current_fitness is None or not self.cache_incumbent_fitness:
+            # score the incumbent in the same batch as the mutants
+            scores = self.score_all(model, [self.current] + mutants, stats)
+            self.current_fitness = scores.pop(0)
+        else:
+            scores = self.score_all(model, mutants, stats)
+        best = max(range(len(mutants)), key=scores.__getitem__)
+        if scores[best] >= self.current_fitness:
+            self.current = mutants[best]
+            self.current_fitness = scores[best]
+
+    def coevolution_step(self, model: MultiUnitGameModel, stats: DecisionStats) -> None:
+        """
+        Mutates each unit's row against the others' current rows, keeping each unit's best
+        mutant.  If more than one unit's row improves on the incumbent, the improved rows are
+        merged and the merged plan is kept if it scores at least as well as the best single mutant
+        """
+        fitness = self.incumbent_fitness(model, stats)
+        k = self.n_mutants
+        mutants = [self.mutate_row(self.current, unit) for unit in range(self.n_units) for _ in range(k)]
+        scores = self.score_all(model, mutants, stats)
+        # the best mutant of each unit whose row improved
+        improved = {}
+        for unit in range(self.n_units):
+            i = max(range(unit * k, unit * k + k), key=scores.__getitem__)
+            if scores[i] >= fitness:
+                improved[unit] = i
+        if not improved:
+            return
+        best = max(improved.values(), key=scores.__getitem__)
+        self.current, self.current_fitness = mutants[best], scores[best]
+        if len(improved) > 1:
+            merged = self.current.copy()
+            for unit, i in improved.items():
+                merged[unit] = mutants[i][unit]
+            merged_fitness = self.score_all(model, [merged], stats)[0]
+            if merged_fitness >= self.current_fitness:
+                self.current, self.current_fitness = merged, merged_fitness
+
+    def close(self) -> None:
+        if self.evaluator:
+            self.evaluator.close()
+
     def get_actions(self, model: MultiUnitGameModel) -> List[int]:
-        for i in range(self.n):
-            mutated_copy = self.mutate_sequence_array(self.current)
-            current_scored = (self.current, self.score(model.copy_state(), self.current))
-            mutated_scored = (mutated_copy, self.score(model.copy_state(), mutated_copy))
-            if mutated_scored[1] >= current_scored[1]:
-                self.current = mutated_scored[0]
-        selected_action_floats = [seq[0] for seq in self.current]
-        self.current = [seq[1:] + [random.random()] for seq in self.current]
+        if self.evaluator and self.listener is None:
+            self.evaluator.set_root(self.evaluate, model)
+        budget = self.budget or Budget(max_iterations=self.n)
+        stats = budget.start()
+        # the plan was shifted and the root has moved on, so its old score no longer applies
+        self.current_fitness = None
+        while not budget.exhausted():
+            if self.coevolve:
+                self.coevolution_step(model, stats)
+            else:
+                self.hill_climb(model, stats)
+            stats.iterations += 1
+        self.last_stats = stats
+        record_decision("multi_unit_rhea", stats)
+        selected_action_floats = self.current[:, 0].tolist()
+        self.current = np.concatenate([self.current[:, 1:], np.array(self.rng.floats(self.n_units))[:, None]], axis=1)
+        self.current_fitness = None
         selected_action = self.get_int_actions(model, selected_action_floats)
         return selected_action
 
+
+def test():
+    """
+    Checks batched and sequential scores agree, that caching the incumbent's score leaves
+    the play unchanged on a deterministic game, and prints the scores of both modes
+    """
+    import random
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator
+    model = NanoRTSModel(NanoStateGenerator().generate_random(random.Random(0)))
+    agent = MultiUnitRHEA(model.n_units(), l=20, rng=0)
+    genomes = [agent.random_genome() for _ in range(8)]
+    assert agent.score_batched(model, genomes) == [agent.evaluate(model, genome) for genome in genomes]
+    assert agent.evaluate(model, genomes[0]) == agent.evaluate(model, genomes[0].tolist())
+    parent = genomes[0].copy()
+    child = agent.mutate_sequence_array(genomes[0])
+    assert np.array_equal(genomes[0], parent) and (child != parent).any(axis=1).sum() <= 1
+
+    games = []
+    for cache_incumbent_fitness in [False, True]:
+        game, player = model.clone(), MultiUnitRHEA(model.n_units(), l=10, n=20, rng=1,
+                                                    cache_incumbent_fitness=cache_incumbent_fitness)
+        rollouts = 0
+        for step in range(10):
+            game.combo_act(player.get_actions(game))
+            rollouts += player.last_stats.rollouts
+        games.append((game.state, rollouts))
+    assert games[0][0] == games[1][0] and games[1][1] == 10 * 21 and games[0][1] == 10 * 40, games
+
+    scores = {}
+    for name, player in [("hill climbing", MultiUnitRHEA(model.n_units(), l=10, n=20, rng=2)),
+                         ("coevolution", MultiUnitRHEA(model.n_units(), l=10, n=4, n_mutants=5, coevolve=True, rng=2))]:
+        game = model.clone()
+        for step in range(10):
+            game.combo_act(player.get_actions(game))
+        scores[name] = game.score()
+    print(f"scores after 10 steps: {scores}")
+
+
+def speed_test(n_units_list: Sequence[int] = (5, 10, 20), n_decisions: int = 5):
+    import random
+    import time
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator, NanoRTSParams
+    for n_units in n_units_list:
+        params = NanoRTSParams(n_units=n_units, n_resources=2 * n_units, grid_size=2 * n_units)
+        start = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(0)), params)
+        for name, make_agent in [("hill climbing", lambda: MultiUnitRHEA(n_units, l=20, n=100, rng=0)),
+                                 ("coevolution", lambda: MultiUnitRHEA(n_units, l=20, n=5, n_mutants=5, coevolve=True,
+                                                                     rng=0))]:
+            model, agent = start.clone(), make_agent()
+            rollouts = 0
+            t = time.perf_counter()
+            for _ in range(n_decisions):
+                agent.get_actions(model)
+                rollouts += agent.last_stats.rollouts
+            elapsed = time.perf_counter() - t
+            print(f"{n_units} units, {name}: {1e6 * elapsed / rollouts:.0f}us per rollout")
+
+
+if __name__ == '__main__':
+    test()
+    speed_test()
@@ -0,0 +1,149 @@
+"""
+ A population based version of RHEA.
+
+ MultiUnitRHEA is a (1+k) hill climber on one [n_units, l] plan.  Here each generation
+ is a [pop_size, l, n_units] array of action floats which is scored as one batch of
+ rollouts on a BatchGameModel.
+"""
+
+from __future__ import annotations
+
+from typing import List, Union
+
+import numpy as np
+
+from agents.budget import Budget, DecisionStats
+from agents.game_interfaces import MultiUnitPlayerInterface, MultiUnitGameModel, BatchableGameModel
+from agents.seeding import RandomStream, Seed
+from stats.metrics import record_decision
+
+
+class PopulationRHEA(MultiUnitPlayerInterface):
+    def __init__(self, n_units: int, l: int = 5, n: int = 10, pop_size: int = 16, n_elites: int = 2,
+                 p_crossover: float = 0.5, p_mut: float = 0.2, tournament_size: int = 2,
+                 use_buffer: bool = True, cache_elite_fitness: bool = True, budget: Budget = None,
+                 rng: Union[Seed, RandomStream] = None):
+        """
+        :param n: number of generations per decision, used when no budget is given
+        :param n_elites: number of the best sequences copied unchanged to the next generation
+        :param p_crossover: probability that a child is made by uniform crossover of two parents,
+               otherwise it is a copy of a single parent; children are then mutated
+        :param cache_elite_fitness: if set, elites are not re-scored in the next generation.
+               This is exact for deterministic games, and the cache is dropped between decisions
+        :param budget: optional time / rollout budget, counted in generations and sequences evaluated
+        :param rng: seed or RandomStream, whose NumPy Generator makes the whole generation's draws
+        """
+        if not 0 <= n_elites < pop_size:
+            raise ValueError("n_elites must be non-negative and less than pop_size")
+        self.n_units = n_units
+        self.l = l
+        self.n = n
+        self.pop_size = pop_size
+        self.n_elites = n_elites
+        self.p_crossover = p_crossover
+        self.p_mut = p_mut
+        self.tournament_size = tournament_size
+        self.use_buffer = use_buffer
+        self.cache_elite_fitness = cache_elite_fitness
+        self.rng = RandomStream.of(rng).generator
+        self.population: np.ndarray = self.random_population()
+        self.n_evaluated = 0
+        self.budget = budget
+        self.last_stats = DecisionStats()
+
+    def random_population(self) -> np.ndarray:
+        return self.rng.random((self.pop_size, self.l, self.n_units))
+
+    def get_int_actions(self, model: MultiUnitGameModel, population: np.ndarray) -> np.ndarray:
+        action_space = np.array(model.get_action_space())
+        return (population * action_space).astype(np.int64)
+
+    def score(self, model: BatchableGameModel, population: np.ndarray) -> np.ndarray:
+        """
+        Rolls out every sequence in the population together and returns their scores.
+        Games that reach a terminal state are frozen by the batch model, so their final
+        score is the score at the terminal state, as in MultiUnitRHEA.score
+        """
+        actions = self.get_int_actions(model, population)
+        batch = model.to_batch(len(population))
+        for step in range(actions.shape[1]):
+            batch.combo_act(actions[:, step, :])
+        self.n_evaluated += len(population)
+        return np.asarray(batch.score(), dtype=np.float64)
+
+    def select_parents(self, fitness: np.ndarray, n: int) -> np.ndarray:
+        """
+        Tournament selection: returns the indices of n parents
+        """
+        entrants = self.rng.integers(self.pop_size, size=(n, self.tournament_size))
+        winners = np.argmax(fitness[entrants], axis=1)
+        return entrants[np.arange(n), winners]
+
+    def breed(self, population: np.ndarray, fitness: np.ndarray, n: int) -> np.ndarray:
+        """
+        Makes n children by crossover and mutation
+        """
+        mothers = population[self.select_parents(fitness, n)]
+        fathers = population[self.select_parents(fitness, n)]
+        crossed = self.rng.random(n) < self.p_crossover
+        from_father = (self.rng.random(mothers.shape) < 0.5) & crossed[:, None, None]
+        children = np.where(from_father, fathers, mothers)
+        mutated = self.rng.random(children.shape) < self.p_mut
+        return np.where(mutated, self.rng.random(children.shape), children)
+
+    def next_generation(self, population: np.ndarray, fitness: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Returns the next population, sorted with the elites first, and the elite fitness
+        """
+        order = np.argsort(-fitness, kind="stable")
+        elites = population[order[:self.n_elites]]
+        children = self.breed(population, fitness, self.pop_size - self.n_elites)
+        return np.concatenate([elites, children]), fitness[order[:self.n_elites]]
+
+    def get_actions(self, model: MultiUnitGameModel) -> List[int]:
+        if not self.use_buffer:
+            self.population = self.random_population()
+        budget = self.budget or Budget(max_iterations=self.n)
+        stats = budget.start()
+        n_evaluated = self.n_evaluated
+        population = self.population
+        # the first generation is always scored so there is a best sequence to act on
+        fitness = self.score(model, population)
+        stats.iterations = 1
+        stats.rollouts = self.n_evaluated - n_evaluated
+        while not budget.exhausted():
+            population, elite_fitness = self.next_generation(population, fitness)
+            if self.cache_elite_fitness:
+                fitness = np.concatenate([elite_fitness, self.score(model, population[self.n_elites:])])
+            else:
+                fitness = self.score(model, population)
+            stats.iterations += 1
+            stats.rollouts = self.n_evaluated - n_evaluated
+        self.last_stats = stats
+        record_decision("population_rhea", stats)
+        best = population[int(np.argmax(fitness))]
+        selected_action = self.get_int_actions(model, best[0]).tolist()
+        # shift the whole population along by one step, keeping the best first
+        order = np.argsort(-fitness, kind="stable")
+        shifted = population[order, 1:]
+        self.population = np.concatenate([shifted, self.rng.random((self.pop_size, 1, self.n_units))], axis=1)
+        return selected_action
+
+
+def test():
+    from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoStateGenerator
+    from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+    model = NanoRTSModel(NanoStateGenerator().generate())
+    agent = PopulationRHEA(model.n_units(), l=20, n=10, pop_size=32)
+    population = agent.population
+    # batched scores must agree with the sequential MultiUnitRHEA rollouts
+    reference = MultiUnitRHEA(model.n_units(), l=20)
+    expected = [reference.evaluate(model, seq.T.tolist()) for seq in population]
+    assert np.array_equal(agent.score(model, population), expected)
+    for i in range(20):
+        model.combo_act(agent.get_actions(model))
+    print(f"score after 20 steps: {model.score()}, sequences evaluated: {agent.n_evaluated}")
+
+
+if __name__ == '__main__':
+    test()
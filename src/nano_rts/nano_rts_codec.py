@@ -0,0 +1,116 @@
+"""
+Fixed-layout binary encoding of nano_rts states, see agents.shared_state.
+
+Layout (little endian, no padding):
+    n_units: int32, next_id: int32, has_hash: int32, zobrist: uint64
+    max_units x (x, y, fuel, type, player_id, unit_id, action): int32
+Units are stored in the order of state.units, which is the order combo_act gives them
+their actions.  Either state backend can be encoded; decoding gives a NanoRTSState.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import random
+import struct
+
+from agents.shared_state import StateCodec, SharedStateBlock, benchmark as benchmark_codec
+from nano_rts.nano_rts_array_state import ArrayNanoRTSState
+from nano_rts.nano_rts_game import NanoRTSState, UnitState, UnitType, NanoRTSParams, NanoRTSModel, \
+    generate_random_state
+
+HEADER = struct.Struct("<iiiQ")
+UNIT = struct.Struct("<7i")
+UNIT_TYPES = {int(t): t for t in UnitType}
+
+
+class NanoRTSCodec(StateCodec):
+    def __init__(self, max_units: int = 64):
+        self.max_units = max_units
+        self.size = HEADER.size + UNIT.size * max_units
+
+    def encode_into(self, state: NanoRTSState, buffer, offset: int = 0) -> None:
+        n_units = len(state.units)
+        if n_units > self.max_units:
+            raise ValueError(f"state with {n_units} units doesn't fit a codec for {self.max_units}")
+        zobrist = state.zobrist
+        HEADER.pack_into(buffer, offset, n_units, state.next_id, zobrist is not None, zobrist or 0)
+        pos = offset + HEADER.size
+        pack_into = UNIT.pack_into
+        for unit in state.units.values():
+            pack_into(buffer, pos, unit.x, unit.y, unit.fuel, unit.type, unit.player_id, unit.unit_id, unit.action)
+            pos += UNIT.size
+
+    def decode(self, buffer, offset: int = 0) -> NanoRTSState:
+        n_units, next_id, has_hash, zobrist = HEADER.unpack_from(buffer, offset)
+        units = {}
+        for x, y, fuel, unit_type, player_id, unit_id, action in UNIT.iter_unpack(
+                buffer[offset + HEADER.size:offset + HEADER.size + n_units * UNIT.size]):
+            units[unit_id] = UnitState(x, y, fuel, UNIT_TYPES[unit_type], player_id, unit_id, action)
+        return NanoRTSState(units, zobrist if has_hash else None, next_id)
+
+
+def rollout_worker(block: SharedStateBlock, slot: int, seed: int, n_steps: int) -> None:
+    """
+    Reads a root state from the block, plays random actions from it and writes back the score
+    """
+    rng = random.Random(seed)
+    model = NanoRTSModel(block.read(slot))
+    for _ in range(n_steps):
+        model.combo_act([rng.randrange(model.actions_per_unit) for _ in range(model.n_units())])
+    block.values[slot] = model.score()
+    block.close()
+
+
+def test():
+    """
+    Round trips states from random games with both backends, and hands states to
+    worker processes through a shared memory block
+    """
+    params = NanoRTSParams()
+    codec = NanoRTSCodec()
+    rng = random.Random(0)
+    states = []
+    for i in range(20):
+        model = NanoRTSModel(generate_random_state(params, rng), params)
+        if i % 2:
+            model.state_hash()
+        for step in range(rng.randrange(40)):
+            model.combo_act([rng.randrange(model.actions_per_unit) for _ in range(model.n_units())])
+        states.append(model.state)
+    for state in states:
+        for source in [state, ArrayNanoRTSState.from_state(state)]:
+            decoded = codec.decode(codec.encode(source))
+            assert decoded == state and decoded.zobrist == state.zobrist and decoded.next_id == state.next_id
+            assert list(decoded.units) == list(state.units)
+            assert all(type(unit.type) is UnitType for unit in decoded.units.values())
+
+    n_steps = 20
+    with SharedStateBlock(codec, len(states)) as block:
+        for slot, state in enumerate(states):
+            block.write(slot, state)
+        workers = [multiprocessing.Process(target=rollout_worker, args=(block, slot, slot, n_steps))
+                   for slot in range(len(states))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for slot, state in enumerate(states):
+            local = NanoRTSState(dict(state.units), None)
+            model = NanoRTSModel(local.clone())
+            rng = random.Random(slot)
+            for _ in range(n_steps):
+                model.combo_act([rng.randrange(model.actions_per_unit) for _ in range(model.n_units())])
+            assert block.values[slot] == model.score()
+    print(f"nano rts codec round trips ok ({codec.size} bytes per state)")
+
+
+def benchmark(n: int = 20000):
+    params = NanoRTSParams()
+    codec = NanoRTSCodec()
+    state = generate_random_state(params, random.Random(0))
+    benchmark_codec(codec, NanoRTSModel(state, params), n)
+
+
+if __name__ == '__main__':
+    test()
+    benchmark()
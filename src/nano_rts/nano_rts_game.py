@@ -10,15 +10,32 @@ some flexible way.  Each unit will also have a unique id.
 
 Coordination of the units gives a combinatorial action space which
 provides a challenge, even given the simple rules of the game.
-todo: test the minimal game - check that units move and collect resources
-todo: implement standard game interfaces so that we can run RHEA etc on this game.
+
+Each unit has five actions: do nothing, or step right, down, left or up.
+A Worker stepping into an empty cell moves there (costing fuel), into a
+Resource harvests from it and into its own Base deposits its spare fuel.
+A Base stepping into an empty cell spawns a Worker there.  All units act
+at once: see NanoRTSModel.combo_act for how conflicts are resolved.
 
 """
 import copy
-from dataclasses import dataclass
-from typing import List, Dict, Tuple
+import random
+import time
+import threading
+from array import array
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional
+
+from agents.game_interfaces import MultiUnitGameModel, CloneableGameModel, HashableGameModel, \
+    TransitionDeltaListener
+from agents.joint_action_space import JointActionSpace, joint_action_space
+from agents.zobrist import ZobristTable
+from nano_rts.occupancy_grid import OccupancyGrid, EMPTY
+from stats.metrics import METRICS
 
-from agents.game_interfaces import MultiUnitGameModel
+# Zobrist feature tags and the table shared by all states, so hashes can be compared across models
+UNIT_POSITION, UNIT_FUEL, UNIT_ACTION, UNIT_KIND = range(4)
+ZOBRIST = ZobristTable()
 
 
 # define an enum for the unit types
@@ -44,6 +61,9 @@ class UnitState:
     unit_id: int
     action: int = 0
 
+    def clone(self) -> UnitState:
+        return UnitState(self.x, self.y, self.fuel, self.type, self.player_id, self.unit_id, self.action)
+
 
 @dataclass(frozen=False)
 class NanoRTSState:
@@ -53,6 +73,53 @@ class NanoRTSState:
     of resources.  The rules of the game can then be applied.
     """
     units: Dict[int, UnitState]
+    # Zobrist hash of the state, computed on first use and then kept up to date
+    # incrementally by NanoRTSModel.unit_act.  Code which changes the state
+    # directly should reset it to None
+    zobrist: Optional[int] = field(default=None, compare=False, repr=False)
+    # id for the next spawned unit, or 0 to start after the highest id in use
+    next_id: int = field(default=0, compare=False, repr=False)
+
+    def clone(self) -> NanoRTSState:
+        return NanoRTSState({unit_id: unit.clone() for unit_id, unit in self.units.items()},
+                            self.zobrist, self.next_id)
+
+    # units are added and removed through these, so other backends (see
+    # nano_rts.nano_rts_array_state) can keep their own indexes; the hash is left to the caller
+
+    def add_unit(self, unit: UnitState) -> None:
+        self.units[unit.unit_id] = unit
+
+    def remove_unit(self, unit_id: int) -> None:
+        del self.units[unit_id]
+
+    def zobrist_key(self) -> int:
+        """
+        Returns the full 64 bit Zobrist hash; hash() reduces it to fit a Py_hash_t
+        """
+        if self.zobrist is None:
+            self.zobrist = zobrist_hash(self)
+        return self.zobrist
+
+    def __hash__(self) -> int:
+        # consistent with the dataclass __eq__: equal states have the same units
+        return self.zobrist_key()
+
+
+def unit_key(unit: UnitState) -> int:
+    # one key per feature, as in the old game, so the table grows with the number of
+    # positions, fuel levels and actions rather than with their combinations
+    unit_id = unit.unit_id
+    return ZOBRIST(UNIT_POSITION, unit_id, unit.x, unit.y) ^ ZOBRIST(UNIT_FUEL, unit_id, unit.fuel) ^ \
+        ZOBRIST(UNIT_ACTION, unit_id, unit.action) ^ ZOBRIST(UNIT_KIND, unit_id, int(unit.type), unit.player_id)
+
+
+def zobrist_hash(state: NanoRTSState) -> int:
+    h = 0
+    for unit in state.units.values():
+        h ^= unit_key(unit)
+    return h
+
 
 class IdGenerator:
     """
@@ -67,6 +134,8 @@ class IdGenerator:
 
     def __call__(self, *args, **kwargs):
         return self.get_id()
+
+
 def generate_sample_state() -> NanoRTSState:
     id_gen = IdGenerator()
     units = [
@@ -78,6 +147,7 @@ def generate_sample_state() -> NanoRTSState:
     unit_dict = {u.unit_id: u for u in units}
     return NanoRTSState(unit_dict)
 
+
 @dataclass(frozen=False)
 class NanoRTSParams:
     """
@@ -87,46 +157,539 @@ class NanoRTSParams:
     fuel_per_resource: int = 100
     fuel_per_move: int = 2
     fuel_per_nop: int = 0
+    fuel_per_harvest: int = 10
     grid_size: int = 10
     fuel_tank_capacity = 150
 
-class NanoRTSModel(MultiUnitGameModel):
 
-    def __init__(self, state: NanoRTSState, params: NanoRTSParams = None) -> None:
+def generate_random_state(params: NanoRTSParams, rng: random.Random, n_workers: int = 2,
+                          n_resources: int = 5) -> NanoRTSState:
+    """
+    Two players with a Base in opposite corners, each with Workers next to it,
+    and Resources in random free cells.  Bases start with enough fuel for two Workers
+    """
+    g = params.grid_size
+    id_gen = IdGenerator()
+    grid = OccupancyGrid(g)
+    units = {}
+
+    def add(x: int, y: int, fuel: int, unit_type: UnitType, player_id: int):
+        unit = UnitState(x, y, fuel, unit_type, player_id, id_gen())
+        grid.place(unit.unit_id, x, y)
+        units[unit.unit_id] = unit
+
+    for player_id, (x, y) in enumerate([(1, 1), (g - 2, g - 2)]):
+        add(x, y, 2 * params.fuel_per_unit, UnitType.Base, player_id)
+        for wx, wy in grid.free_adjacent(x, y)[:n_workers]:
+            add(wx, wy, params.fuel_per_unit, UnitType.Worker, player_id)
+    for _ in range(n_resources):
+        x, y = rng.randrange(g), rng.randrange(g)
+        while not grid.is_free(x, y):
+            x, y = rng.randrange(g), rng.randrange(g)
+        add(x, y, params.fuel_per_resource, UnitType.Resource, 2)
+    return NanoRTSState(units)
+
+
+# unit actions: do nothing, then step right, down, left or up (as drawn by NanoUnitView)
+ACTIONS = [(0, 0), (1, 0), (0, 1), (-1, 0), (0, -1)]
+N_UNIT_ACTIONS = len(ACTIONS)
+_move_tables: Dict[int, array] = {}
+
+
+def move_table(grid_size: int) -> array:
+    """
+    Returns the cell each action leads to from each cell, at [cell * N_UNIT_ACTIONS + action],
+    with -1 for doing nothing and for steps off the grid.  Cells are indexed as in OccupancyGrid
+    """
+    table = _move_tables.get(grid_size)
+    if table is None:
+        table = array("i", [-1] * (grid_size * grid_size * N_UNIT_ACTIONS))
+        for x in range(grid_size):
+            for y in range(grid_size):
+                for action, (dx, dy) in enumerate(ACTIONS):
+                    nx, ny = x + dx, y + dy
+                    if action and 0 <= nx < grid_size and 0 <= ny < grid_size:
+                        table[(x * grid_size + y) * N_UNIT_ACTIONS + action] = nx * grid_size + ny
+        _move_tables[grid_size] = table
+    return table
+
+
+class ComboScratch:
+    """
+    Scratch space for combo_act, reused between steps: the number of moves into each
+    cell, the units moving and their target cells, the bases that spawn and where,
+    the units changed so far (to update the hash), and the Resources used up.
+    combo_act leaves every claim at 0, so it can be shared by all the models of a grid size
+    """
+    __slots__ = ("claims", "movers", "targets", "spawners", "spawn_cells", "touched", "touched_ids", "used_up")
+
+    def __init__(self, grid_size: int):
+        self.claims = array("i", bytes(4 * grid_size * grid_size))
+        self.movers: List[Optional[UnitState]] = []
+        self.targets: List[int] = []
+        self.spawners: List[Optional[UnitState]] = []
+        self.spawn_cells: List[int] = []
+        self.touched: List[Optional[UnitState]] = []
+        self.touched_ids = set()
+        self.used_up: List[int] = []
+
+
+# one ComboScratch per grid size for each thread, as models may be stepped on several threads
+_scratch = threading.local()
+
+
+def combo_scratch(grid_size: int) -> ComboScratch:
+    spaces = getattr(_scratch, "spaces", None)
+    if spaces is None:
+        spaces = _scratch.spaces = {}
+    scratch = spaces.get(grid_size)
+    if scratch is None:
+        scratch = spaces[grid_size] = ComboScratch(grid_size)
+    return scratch
+
+
+class NanoRTSModel(MultiUnitGameModel, CloneableGameModel, HashableGameModel):
+    actions_per_unit = N_UNIT_ACTIONS
+
+    def __init__(self, state: NanoRTSState, params: NanoRTSParams = None, occupancy: OccupancyGrid = None,
+                 player_id: int = 0) -> None:
+        """
+        :param player_id: the player whose fuel is the score
+        """
         self.state = state
         self.params = params or NanoRTSParams()
+        self.player_id = player_id
+        # unit ids by cell, kept in sync by move_unit, add_unit and remove_unit
+        self.occupancy = occupancy or OccupancyGrid.from_units(state.units.values(), self.params.grid_size)
+        self.move_table = move_table(self.params.grid_size)
+        self.n_resources = sum(1 for unit in state.units.values() if unit.type == UnitType.Resource)
+        # told about every change when set, see TransitionDeltaListener
+        self.delta_listener: Optional[TransitionDeltaListener] = None
 
     def n_units(self) -> int:
         return len(self.state.units)
 
     def n_actions(self) -> int:
-        return 4
+        return self.actions_per_unit ** self.n_units()
 
     def copy_state(self) -> NanoRTSModel:
-        return copy.deepcopy(self)
+        return self.clone()
+
+    def clone(self) -> NanoRTSModel:
+        return NanoRTSModel(self.state.clone(), self.params, self.occupancy.clone(), self.player_id)
 
     def is_terminal(self) -> bool:
-        return False
+        # the game ends when all the Resources have been harvested
+        return self.n_resources == 0
+
+    def _touch(self, unit: UnitState, scratch: ComboScratch) -> None:
+        # takes a unit out of the hash before its first change in this step;
+        # combo_act puts the changed units back in at the end
+        if unit.unit_id not in scratch.touched_ids:
+            scratch.touched_ids.add(unit.unit_id)
+            self.state.zobrist ^= unit_key(unit)
+            self._push(scratch.touched, unit, len(scratch.touched_ids) - 1)
+
+    @staticmethod
+    def _push(items: List, item, i: int) -> None:
+        if i < len(items):
+            items[i] = item
+        else:
+            items.append(item)
+
+    def combo_act(self, actions: List[int]) -> NanoRTSModel:
+        """
+        Applies one action per unit, in the order of state.units; missing actions are
+        taken as doing nothing and Resources ignore theirs.
+
+        All units act at once, judged on the grid as it was at the start of the step.
+        Harvests and deposits are applied in unit order as the units are visited, so two
+        Workers harvesting a nearly empty Resource are served in that order.  Moves and
+        spawns then claim their target cells: a cell claimed by more than one unit stays
+        empty and those units stay put.  Units can't move into cells being vacated, so
+        there are no chains or swaps.  Resources left with no fuel are removed.
+        """
+        if self.n_resources == 0:
+            return self
+        if METRICS.enabled:
+            METRICS.count("nano_rts.steps")
+        p = self.params
+        g = p.grid_size
+        state = self.state
+        units = state.units
+        cells = self.occupancy.cells
+        table = self.move_table
+        scratch = combo_scratch(g)
+        claims = scratch.claims
+        movers = scratch.movers
+        targets = scratch.targets
+        spawners = scratch.spawners
+        spawn_cells = scratch.spawn_cells
+        used_up = scratch.used_up
+        touched_ids = scratch.touched_ids
+        tracking = state.zobrist is not None
+        listener = self.delta_listener
+        touch = self._touch
+        push = self._push
+        n_given = len(actions)
+        n_movers = 0
+        n_used_up = 0
+        worker, base, resource = UnitType.Worker, UnitType.Base, UnitType.Resource
 
-    def act(self, action: int) -> MultiUnitGameModel:
-        pass
+        for i, unit in enumerate(units.values()):
+            kind = unit.type
+            if kind == resource:
+                continue
+            action = actions[i] % N_UNIT_ACTIONS if i < n_given else 0
+            if unit.action != action:
+                if tracking:
+                    touch(unit, scratch)
+                unit.action = action
+            target = table[(unit.x * g + unit.y) * N_UNIT_ACTIONS + action]
+            if target < 0:
+                if action == 0 and kind == worker and p.fuel_per_nop and unit.fuel > 0:
+                    if tracking:
+                        touch(unit, scratch)
+                    fuel = unit.fuel
+                    unit.fuel = max(0, fuel - p.fuel_per_nop)
+                    if listener is not None:
+                        listener.unit_changed(unit.unit_id, unit.x, unit.y, unit.x, unit.y, unit.fuel - fuel)
+                continue
+            occupant = cells[target]
+            if occupant == EMPTY:
+                # a move or a spawn: resolved once every unit has claimed its cell
+                if unit.fuel >= (p.fuel_per_move if kind == worker else p.fuel_per_unit):
+                    claims[target] += 1
+                    push(movers, unit, n_movers)
+                    push(targets, target, n_movers)
+                    n_movers += 1
+            elif kind == worker:
+                other = units[occupant]
+                if other.type == resource:
+                    amount = min(p.fuel_per_harvest, other.fuel, p.fuel_tank_capacity - unit.fuel)
+                    if amount > 0:
+                        if tracking:
+                            touch(unit, scratch)
+                            touch(other, scratch)
+                        unit.fuel += amount
+                        other.fuel -= amount
+                        if listener is not None:
+                            listener.unit_changed(unit.unit_id, unit.x, unit.y, unit.x, unit.y, amount)
+                            listener.resource_consumed(other.x, other.y, amount)
+                        if other.fuel == 0:
+                            push(used_up, occupant, n_used_up)
+                            n_used_up += 1
+                elif other.type == base and other.player_id == unit.player_id:
+                    # workers keep the fuel they were built with
+                    amount = unit.fuel - p.fuel_per_unit
+                    if amount > 0:
+                        if tracking:
+                            touch(unit, scratch)
+                            touch(other, scratch)
+                        unit.fuel -= amount
+                        other.fuel += amount
+                        if listener is not None:
+                            listener.unit_changed(unit.unit_id, unit.x, unit.y, unit.x, unit.y, -amount)
+                            listener.unit_changed(other.unit_id, other.x, other.y, other.x, other.y, amount)
+
+        n_spawned = 0
+        for k in range(n_movers):
+            unit = movers[k]
+            target = targets[k]
+            if claims[target] != 1:
+                continue
+            if tracking:
+                touch(unit, scratch)
+            if unit.type == worker:
+                x0, y0 = unit.x, unit.y
+                cells[x0 * g + y0] = EMPTY
+                cells[target] = unit.unit_id
+                unit.x = target // g
+                unit.y = target % g
+                unit.fuel -= p.fuel_per_move
+                if listener is not None:
+                    listener.unit_changed(unit.unit_id, x0, y0, unit.x, unit.y, -p.fuel_per_move)
+            else:
+                unit.fuel -= p.fuel_per_unit
+                if listener is not None:
+                    listener.unit_changed(unit.unit_id, unit.x, unit.y, unit.x, unit.y, -p.fuel_per_unit)
+                push(spawners, unit, n_spawned)
+                push(spawn_cells, target, n_spawned)
+                n_spawned += 1
+        for k in range(n_movers):
+            claims[targets[k]] = 0
+
+        for k in range(n_spawned):
+            parent = spawners[k]
+            target = spawn_cells[k]
+            spawners[k] = None
+            spawned = UnitState(target // g, target % g, p.fuel_per_unit, worker, parent.player_id,
+                                self.new_unit_id())
+            cells[target] = spawned.unit_id
+            state.add_unit(spawned)
+            if listener is not None:
+                listener.unit_changed(spawned.unit_id, -1, -1, spawned.x, spawned.y, spawned.fuel)
+            if tracking:
+                # not in the hash yet, so it only needs adding at the end
+                touched_ids.add(spawned.unit_id)
+                push(scratch.touched, spawned, len(touched_ids) - 1)
+
+        if tracking:
+            h = state.zobrist
+            touched = scratch.touched
+            for k in range(len(touched_ids)):
+                h ^= unit_key(units[touched[k].unit_id])
+                touched[k] = None
+            state.zobrist = h
+            touched_ids.clear()
+        for k in range(n_used_up):
+            self.remove_unit(used_up[k])
+        return self
 
-    def combo_act(self, action: List[int]) -> MultiUnitGameModel:
-        pass
     def unit_act(self, unit_id: int, action: int) -> MultiUnitGameModel:
-        # extract the required unit
+        """
+        Records a unit's action without resolving it; combo_act resolves all the units' actions together
+        """
         unit = self.state.units[unit_id]
-        # apply the action: we have two types, move and act (collect, attack, etc)
         if unit:
+            h = self.state.zobrist
+            if h is not None:
+                h ^= unit_key(unit)
             unit.action = action
-            # compute the effects of the action
-
+            if h is not None:
+                self.state.zobrist = h ^ unit_key(unit)
         return self
 
+    def new_unit_id(self) -> int:
+        state = self.state
+        if not state.next_id:
+            state.next_id = max(state.units, default=0) + 1
+        unit_id = state.next_id
+        state.next_id += 1
+        return unit_id
+
+    def move_unit(self, unit: UnitState, x: int, y: int) -> None:
+        """
+        Moves a unit to a free cell, keeping the occupancy grid and the hash in sync
+        """
+        h = self.state.zobrist
+        self.occupancy.move(unit.x, unit.y, x, y)
+        if h is not None:
+            h ^= unit_key(unit)
+        unit.x, unit.y = x, y
+        if h is not None:
+            self.state.zobrist = h ^ unit_key(unit)
+
+    def add_unit(self, unit: UnitState) -> None:
+        self.occupancy.place(unit.unit_id, unit.x, unit.y)
+        self.state.add_unit(unit)
+        if self.state.zobrist is not None:
+            self.state.zobrist ^= unit_key(unit)
+        if unit.type == UnitType.Resource:
+            self.n_resources += 1
+
+    def remove_unit(self, unit_id: int) -> None:
+        unit = self.state.units[unit_id]
+        self.occupancy.clear(unit.x, unit.y)
+        if self.state.zobrist is not None:
+            self.state.zobrist ^= unit_key(unit)
+        if unit.type == UnitType.Resource:
+            self.n_resources -= 1
+        self.state.remove_unit(unit_id)
+
+    def unit_at(self, x: int, y: int) -> Optional[UnitState]:
+        unit_id = self.occupancy.at(x, y)
+        return self.state.units[unit_id] if unit_id else None
+
+    def units_within(self, x: int, y: int, radius: int) -> List[UnitState]:
+        """
+        Returns the units within Manhattan distance radius of (x, y), nearest first
+        """
+        return [self.state.units[unit_id] for unit_id, _, _ in self.occupancy.within(x, y, radius)]
+
+    def nearest_unit(self, x: int, y: int, unit_type: UnitType = None, player_id: int = None,
+                     max_radius: int = None) -> Optional[UnitState]:
+        """
+        Returns the nearest unit to (x, y) of the given type and / or player, e.g. the nearest Resource
+        """
+        units = self.state.units
+
+        def accept(unit_id: int) -> bool:
+            unit = units[unit_id]
+            return (unit_type is None or unit.type == unit_type) and (player_id is None or unit.player_id == player_id)
+
+        found = self.occupancy.nearest(x, y, accept, max_radius)
+        return units[found[0]] if found else None
+
+    def free_adjacent(self, x: int, y: int) -> List[Tuple[int, int]]:
+        return self.occupancy.free_adjacent(x, y)
+
     def score(self) -> float:
-        pass
+        # the fuel held by the player's Bases and Workers
+        return sum(unit.fuel for unit in self.state.units.values() if unit.player_id == self.player_id)
 
     def n_actions_unit_i(self, i: int) -> int:
-        return 4
+        return self.actions_per_unit
+
+    def get_action_space(self) -> List[int]:
+        return [self.actions_per_unit] * self.n_units()
+
+    def joint_action_space(self) -> JointActionSpace:
+        return joint_action_space((self.actions_per_unit,) * self.n_units())
+
+    def state_hash(self) -> int:
+        return self.state.zobrist_key()
+
+
+def test_clone():
+    """
+    Checks that clone() gives the same result as copy.deepcopy and that the copies are independent.
+    """
+    model = NanoRTSModel(generate_sample_state())
+    cloned = model.clone()
+    assert cloned.state == copy.deepcopy(model).state
+    assert cloned.params is model.params
+    for unit_id in model.state.units:
+        assert cloned.state.units[unit_id] is not model.state.units[unit_id]
+    cloned.unit_act(2, 3)
+    assert cloned.state.units[2].action == 3 and model.state.units[2].action != 3
+    print("clone matches deepcopy")
+
+
+def test_occupancy():
+    """
+    Checks that the occupancy grid stays in sync through moves, deaths and spawns
+    """
+    model = NanoRTSModel(generate_sample_state())
+    worker = model.state.units[3]
+    assert model.unit_at(2, 2) is worker
+    assert model.nearest_unit(2, 2, UnitType.Resource).unit_id == 4
+    model.move_unit(worker, 2, 3)
+    assert model.unit_at(2, 2) is None and model.unit_at(2, 3) is worker
+    assert [u.unit_id for u in model.units_within(2, 3, 1)] == [3, 4]
+    model.remove_unit(4)
+    assert model.nearest_unit(2, 3, UnitType.Resource) is None
+    model.add_unit(UnitState(3, 3, 10, UnitType.Worker, 1, 5))
+    assert (3, 3) not in model.free_adjacent(2, 3)
+    rebuilt = OccupancyGrid.from_units(model.state.units.values(), model.params.grid_size)
+    assert model.occupancy.cells == rebuilt.cells
+    assert model.state_hash() == zobrist_hash(model.state)
+    print("occupancy grid in sync")
+
+
+def test_hash():
+    """
+    Checks the incremental hash against the full computation, and looks for
+    collisions between different states over random trajectories.
+    """
+    seen: Dict[int, NanoRTSState] = {}
+    rng = random.Random(0)
+    for trajectory in range(50):
+        model = NanoRTSModel(generate_sample_state())
+        unit_ids = list(model.state.units)
+        for step in range(50):
+            h = model.state_hash()
+            assert h == zobrist_hash(model.state)
+            assert model.clone().state_hash() == h
+            other = seen.setdefault(h, model.state.clone())
+            assert other == model.state, "hash collision"
+            model.unit_act(rng.choice(unit_ids), rng.randrange(model.n_actions_unit_i(0)))
+    print(f"no collisions in {len(seen)} distinct states")
+
+
+def test_rules():
+    """
+    Checks moves, conflicts, harvesting, depositing and spawning on small hand made states
+    """
+    params = NanoRTSParams()
+
+    def make(*units: UnitState) -> NanoRTSModel:
+        return NanoRTSModel(NanoRTSState({unit.unit_id: unit for unit in units}), params)
+
+    # two workers claiming the same cell both stay put; a move costs fuel
+    model = make(UnitState(1, 2, 10, UnitType.Worker, 0, 1), UnitState(3, 2, 10, UnitType.Worker, 1, 2),
+                 UnitState(5, 5, 10, UnitType.Worker, 0, 3), UnitState(9, 9, 100, UnitType.Resource, 2, 4))
+    model.combo_act([1, 3, 2])
+    units = model.state.units
+    assert (units[1].x, units[2].x, units[1].fuel) == (1, 3, 10)
+    assert (units[3].x, units[3].y, units[3].fuel) == (5, 6, 10 - params.fuel_per_move)
+    # a worker can't follow another into the cell it leaves
+    model.combo_act([1, 0, 1])
+    assert (units[1].x, units[3].x) == (2, 6)
+    model.combo_act([1, 0, 0])
+    assert units[1].x == 2
+
+    # harvesting and depositing, then the game ends when the last Resource is gone
+    model = make(UnitState(2, 3, 20, UnitType.Worker, 0, 1), UnitState(3, 3, 15, UnitType.Resource, 2, 2),
+                 UnitState(2, 4, 0, UnitType.Base, 0, 3))
+    model.combo_act([1])
+    assert model.state.units[1].fuel == 30 and model.state.units[2].fuel == 5
+    model.combo_act([2])
+    assert model.state.units[1].fuel == params.fuel_per_unit and model.state.units[3].fuel == 10
+    assert model.score() == 30
+    model.combo_act([1])
+    assert 2 not in model.state.units and model.is_terminal() and model.score() == 35
+
+    # a base spawns a worker with fuel_per_unit, paid for by the base
+    model = make(UnitState(7, 4, 30, UnitType.Base, 1, 1), UnitState(0, 0, 10, UnitType.Resource, 2, 4))
+    model.combo_act([1])
+    spawned = model.unit_at(8, 4)
+    assert spawned.unit_id == 5 and spawned.fuel == params.fuel_per_unit and spawned.player_id == 1
+    assert model.state.units[1].fuel == 10
+    model.combo_act([2])
+    assert model.unit_at(7, 5) is None, "not enough fuel to spawn"
+
+    # random play keeps the grid and the hash in sync, clones are independent, and a
+    # model stepped throughout matches one cloned every step (so no scratch state leaks)
+    rng = random.Random(1)
+    model = NanoRTSModel(generate_random_state(params, rng), params)
+    fresh = model.clone()
+    model.state_hash()
+    for step in range(500):
+        if model.is_terminal():
+            break
+        copy_before = model.clone()
+        actions = [rng.randrange(model.actions_per_unit) for _ in range(model.n_units())]
+        model.combo_act(actions)
+        fresh = fresh.clone().combo_act(actions)
+        assert model.state == fresh.state
+        assert copy_before.state_hash() == zobrist_hash(copy_before.state)
+        assert model.state_hash() == zobrist_hash(model.state)
+        rebuilt = OccupancyGrid.from_units(model.state.units.values(), params.grid_size)
+        assert model.occupancy.cells == rebuilt.cells
+    print("rules behave as expected")
+
+
+def speed_test(n_steps: int = 100000):
+    """
+    Steps per second of the rules alone, and with a random player choosing the actions
+    as in the old_nano_rts speed_test.  Games are restarted when they end
+    """
+    from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+    params = NanoRTSParams()
+    rng = random.Random(0)
+    start = generate_random_state(params, rng)
+    print(start)
+    player = MultiUnitRandomPlayer()
+    action_lists = [[rng.randrange(N_UNIT_ACTIONS) for _ in range(50)] for _ in range(1000)]
+    for label, with_player in [("rules only", False), ("random player", True)]:
+        model = NanoRTSModel(start.clone(), params)
+        games = 1
+        t = time.perf_counter()
+        for i in range(n_steps):
+            if model.is_terminal():
+                model = NanoRTSModel(start.clone(), params)
+                games += 1
+            model.combo_act(player.get_actions(model) if with_player else action_lists[i % 1000])
+        elapsed = time.perf_counter() - t
+        print(f"{label}: {n_steps / elapsed:,.0f} steps per second, {games} games, "
+              f"{model.n_units()} units at the end, score {model.score()}")
 
 
+if __name__ == '__main__':
+    test_clone()
+    test_occupancy()
+    test_hash()
+    test_rules()
+    print("Speed test:")
+    speed_test()
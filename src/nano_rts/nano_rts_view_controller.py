@@ -1,14 +1,16 @@
 from __future__ import annotations
 
-from typing import List, Union
+from typing import List, Tuple, Union
 
+import numpy as np
 import pygame
 import pygame.locals
 from pygame import QUIT
 
 from agents.game_interfaces import MultiUnitPlayerInterface, SimplePlayerInterface
 from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
-from nano_rts.nano_rts_game import NanoRTSModel, generate_sample_state, UnitType, UnitState
+from nano_rts.nano_rts_game import NanoRTSModel, generate_sample_state, UnitType, UnitState, ACTIONS
+from rendering.cached_renderer import CachedGridRenderer, headless as use_dummy_video_driver
 
 
 class NanoUnitView:
@@ -49,28 +51,32 @@ class NanoUnitView:
         The first is the background, which is the player colour.
         The second is the foreground, which is the unit type colour.
         """
-        bg_rect = self.xy_to_rect(unit.x, unit.y, 0)
-        fg_rect = self.xy_to_rect(unit.x, unit.y, self.border)
+        self.draw_at(screen, unit.x, unit.y, unit.type, unit.player_id, unit.action)
+
+    def draw_at(self, screen: pygame.Surface, x: int, y: int, unit_type: UnitType, player_id: int,
+                action: int) -> None:
+        bg_rect = self.xy_to_rect(x, y, 0)
+        fg_rect = self.xy_to_rect(x, y, self.border)
         # center is used in drawing action lines and for circles
-        center = (self.size * unit.x + self.size // 2, self.size * unit.y + self.size // 2)
+        center = (self.size * x + self.size // 2, self.size * y + self.size // 2)
 
-        if unit.type in self.RECT_UNITS:
-            pygame.draw.rect(screen, self.PLAYER_COLORS[unit.player_id], bg_rect)
-            pygame.draw.rect(screen, self.UNIT_TYPE_COLORS[unit.type], fg_rect)
+        if unit_type in self.RECT_UNITS:
+            pygame.draw.rect(screen, self.PLAYER_COLORS[player_id], bg_rect)
+            pygame.draw.rect(screen, self.UNIT_TYPE_COLORS[unit_type], fg_rect)
 
-        elif unit.type in self.CIRCLE_UNITS:
+        elif unit_type in self.CIRCLE_UNITS:
             bg_radius = self.size // 2
             fg_radius = self.size // 2 - self.border
-            pygame.draw.circle(screen, self.PLAYER_COLORS[unit.player_id], center, bg_radius)
-            pygame.draw.circle(screen, self.UNIT_TYPE_COLORS[unit.type], center, fg_radius)
+            pygame.draw.circle(screen, self.PLAYER_COLORS[player_id], center, bg_radius)
+            pygame.draw.circle(screen, self.UNIT_TYPE_COLORS[unit_type], center, fg_radius)
 
         # draw the action as a straight line in the player's color connecting the unit
         # center to the action destination centre
-        if unit.action > 0:
-            action_offset = self.ACTION_OFFSETS[unit.action]
-            action_x = self.size * (unit.x + action_offset[0]) + self.size // 2
-            action_y = self.size * (unit.y + action_offset[1]) + self.size // 2
-            pygame.draw.line(screen, self.PLAYER_COLORS[unit.player_id],
+        if action > 0:
+            action_offset = self.ACTION_OFFSETS[action]
+            action_x = self.size * (x + action_offset[0]) + self.size // 2
+            action_y = self.size * (y + action_offset[1]) + self.size // 2
+            pygame.draw.line(screen, self.PLAYER_COLORS[player_id],
                              center, (action_x, action_y), self.line_width)
 
 
@@ -90,7 +96,7 @@ class NanoRTSView:
     COLORS = [BG_COLOR, WALL_COLOR, UNIT_COLOR, RESOURCE_COLOR]
 
     def __init__(self, model: NanoRTSModel, size: int = DEFAULT_SIZE):
-        # todo: add a location and scale to enable multiple views on the same screen
+        # many games on the same screen: see rendering.tiled_dashboard
         self.model = model
         self.size = size
         self.width = model.params.grid_size
@@ -115,13 +121,34 @@ class NanoRTSView:
     def draw_grid(self, screen):
         # fill the background, then draw the grid, then the state items individually
         # screen.set_alpha(20)
+        self.draw_background(screen)
+        for item in self.items(self.model.state):
+            self.draw_item(screen, item)
+
+    def draw_background(self, screen):
         screen.fill(self.BG_COLOR)
         for x in range(self.width):
             for y in range(self.height):
                 rect = self.xy_to_rect(x, y)
                 pygame.draw.rect(screen, self.WALL_COLOR, rect, self.BORDER)
-        for id, unit in self.model.state.units.items():
-            self.unit_view.draw(screen, unit)
+
+    def items(self, state) -> List[Tuple]:
+        """
+        What to draw for a state, in drawing order: each item holds everything needed to draw
+        it, so a cell needs redrawing exactly when its items change (see rendering.cached_renderer)
+        """
+        return [(unit.x, unit.y, unit.type, unit.player_id, unit.action) for unit in state.units.values()]
+
+    def item_cells(self, item: Tuple) -> List[Tuple[int, int]]:
+        # an action line reaches into the neighbouring cell
+        x, y, _, _, action = item
+        if action > 0:
+            dx, dy = ACTIONS[action]
+            return [(x, y), (x + dx, y + dy)]
+        return [(x, y)]
+
+    def draw_item(self, screen, item: Tuple) -> None:
+        self.unit_view.draw_at(screen, *item)
 
     def view_size(self) -> List[int]:
         return [self.size * self.width, self.size * self.height]
@@ -129,16 +156,31 @@ class NanoRTSView:
 
 class NanoRTSController:
     def __init__(self, model: NanoRTSModel, agent: Union[SimplePlayerInterface, MultiUnitPlayerInterface],
-                 frame_rate: int = 10):
+                 frame_rate: int = 10, cached: bool = False, headless: bool = False, record: bool = False):
+        """
+        :param cached: redraw only the cells that changed, see rendering.cached_renderer (this
+               draws opaque frames, without the faint trail the default alpha blending leaves)
+        :param headless: no window (SDL dummy video driver) and no frame rate limit, e.g. on a server
+        :param record: keep every frame shown as a [height, width, 3] RGB array in self.frames
+        """
         self.model = model
         self.agent = agent
         self.view = NanoRTSView(model)
+        self.headless = headless
+        if headless:
+            use_dummy_video_driver()
         pygame.init()
         pygame.display.set_caption("Nano RTS")
         # Set up the drawing window
         self.clock = pygame.time.Clock()
         self.screen = pygame.display.set_mode(self.view.view_size())
         self.surface = pygame.Surface(self.view.view_size(), pygame.locals.SRCALPHA)
+        self.renderer = CachedGridRenderer(self.view, self.screen) if cached else None
+        if self.renderer:
+            # show the background the renderer drew: each frame only updates the changed cells
+            pygame.display.flip()
+        self.record = record
+        self.frames: List[np.ndarray] = []
         self.frame_rate = frame_rate
         self.step = 0
 
@@ -151,7 +193,10 @@ class NanoRTSController:
                 if event.type == QUIT:
                     running = False
 
-            self.view.draw_grid(self.surface)
+            if self.renderer:
+                rects = self.renderer.render(self.model.state)
+            else:
+                self.view.draw_grid(self.surface)
 
             if isinstance(self.agent, MultiUnitPlayerInterface):
                 actions = self.agent.get_actions(self.model)
@@ -161,9 +206,15 @@ class NanoRTSController:
                 self.model.act(action)
 
             # Flip the display
-            self.screen.blit(self.surface, (0, 0))
-            pygame.display.flip()
-            self.clock.tick(self.frame_rate)
+            if self.renderer:
+                pygame.display.update(rects)
+            else:
+                self.screen.blit(self.surface, (0, 0))
+                pygame.display.flip()
+            if self.record:
+                self.frames.append(pygame.surfarray.array3d(self.screen).swapaxes(0, 1))
+            if not self.headless:
+                self.clock.tick(self.frame_rate)
             # print(self.step, "\t", self.model.score())
             self.step += 1
 
@@ -0,0 +1,158 @@
+"""
+An occupancy grid: a grid_size x grid_size int array saying what is in each cell, with 0
+for an empty cell.  The nano_rts model stores unit ids in it and keeps it in sync as
+units move, spawn and die; the old nano_rts model stores resource fuel in one.
+
+Cells are indexed x * grid_size + y, so as_numpy() gives an [x, y] array view,
+matching the layout of the batched models and observations.
+"""
+from __future__ import annotations
+
+from array import array
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+EMPTY = 0
+NEIGHBOURS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+
+
+class OccupancyGrid:
+    def __init__(self, grid_size: int, wrap: bool = False):
+        """
+        :param wrap: if set the grid is a torus (as in old_nano_rts), otherwise
+               cells outside the grid don't exist
+        """
+        self.grid_size = grid_size
+        self.wrap = wrap
+        self.cells = array("i", bytes(4 * grid_size * grid_size))
+
+    @staticmethod
+    def from_units(units: Iterable, grid_size: int) -> OccupancyGrid:
+        """
+        Builds a grid of unit ids from objects with x, y and unit_id attributes
+        """
+        grid = OccupancyGrid(grid_size)
+        for unit in units:
+            grid.place(unit.unit_id, unit.x, unit.y)
+        return grid
+
+    def clone(self) -> OccupancyGrid:
+        copy = OccupancyGrid.__new__(OccupancyGrid)
+        copy.grid_size = self.grid_size
+        copy.wrap = self.wrap
+        copy.cells = array("i", self.cells)
+        return copy
+
+    def as_numpy(self) -> np.ndarray:
+        """
+        Returns a [grid_size, grid_size] view of the cells (no copy)
+        """
+        return np.frombuffer(self.cells, dtype=np.int32).reshape(self.grid_size, self.grid_size)
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.grid_size and 0 <= y < self.grid_size
+
+    def cell(self, x: int, y: int) -> Optional[int]:
+        """
+        Returns the index of cell (x, y), or None if it is off a non-wrapping grid
+        """
+        g = self.grid_size
+        if self.wrap:
+            return (x % g) * g + y % g
+        if 0 <= x < g and 0 <= y < g:
+            return x * g + y
+        return None
+
+    def at(self, x: int, y: int) -> int:
+        i = self.cell(x, y)
+        return EMPTY if i is None else self.cells[i]
+
+    def place(self, occupant: int, x: int, y: int) -> None:
+        i = self.cell(x, y)
+        if i is None:
+            raise IndexError(f"cell ({x}, {y}) is off the grid")
+        if self.cells[i] != EMPTY:
+            raise ValueError(f"cell ({x}, {y}) is already occupied by {self.cells[i]}")
+        self.cells[i] = occupant
+
+    def clear(self, x: int, y: int) -> None:
+        self.cells[self.cell(x, y)] = EMPTY
+
+    def move(self, x0: int, y0: int, x1: int, y1: int) -> None:
+        i = self.cell(x0, y0)
+        occupant = self.cells[i]
+        self.cells[i] = EMPTY
+        self.place(occupant, x1, y1)
+
+    def is_free(self, x: int, y: int) -> bool:
+        i = self.cell(x, y)
+        return i is not None and self.cells[i] == EMPTY
+
+    def free_adjacent(self, x: int, y: int) -> List[Tuple[int, int]]:
+        """
+        Returns the free cells next to (x, y), e.g. for spawning a unit
+        """
+        g = self.grid_size
+        cells = []
+        for dx, dy in NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            if self.wrap:
+                nx, ny = nx % g, ny % g
+            if self.is_free(nx, ny):
+                cells.append((nx, ny))
+        return cells
+
+    def ring(self, x: int, y: int, d: int) -> Iterator[Tuple[int, int]]:
+        """
+        Yields the in-grid cells at Manhattan distance exactly d from (x, y).
+        On a wrapping grid a cell may be yielded more than once when d > grid_size // 2
+        """
+        g = self.grid_size
+        if d == 0:
+            offsets = [(0, 0)]
+        else:
+            offsets = []
+            for i in range(d):
+                offsets += [(i, d - i), (d - i, -i), (-i, i - d), (i - d, i)]
+        for dx, dy in offsets:
+            nx, ny = x + dx, y + dy
+            if self.wrap:
+                yield nx % g, ny % g
+            elif 0 <= nx < g and 0 <= ny < g:
+                yield nx, ny
+
+    def max_distance(self) -> int:
+        g = self.grid_size
+        return 2 * (g // 2) if self.wrap else 2 * (g - 1)
+
+    def within(self, x: int, y: int, radius: int) -> List[Tuple[int, int, int]]:
+        """
+        Returns (occupant, x, y) for every occupied cell within Manhattan distance radius,
+        nearest first
+        """
+        found = []
+        seen = set()
+        for d in range(min(radius, self.max_distance()) + 1):
+            for cx, cy in self.ring(x, y, d):
+                occupant = self.cells[cx * self.grid_size + cy]
+                if occupant != EMPTY and (cx, cy) not in seen:
+                    seen.add((cx, cy))
+                    found.append((occupant, cx, cy))
+        return found
+
+    def nearest(self, x: int, y: int, accept: Callable[[int], bool] = None,
+                max_radius: int = None) -> Optional[Tuple[int, int, int]]:
+        """
+        Returns (occupant, x, y) for the nearest occupied cell (by Manhattan distance)
+        whose occupant passes accept, or None.  Searches outwards ring by ring, so the
+        cost depends on the distance to the answer rather than the number of occupants.
+        """
+        limit = self.max_distance() if max_radius is None else min(max_radius, self.max_distance())
+        g = self.grid_size
+        for d in range(limit + 1):
+            for cx, cy in self.ring(x, y, d):
+                occupant = self.cells[cx * g + cy]
+                if occupant != EMPTY and (accept is None or accept(occupant)):
+                    return occupant, cx, cy
+        return None
@@ -0,0 +1,188 @@
+"""
+A batched version of the old nanoRTS game.
+
+Holds B independent games as NumPy arrays and steps all of them with a single
+call, applying exactly the same rules as NanoRTSModel.update_unit:
+wraparound, tank capacity clamping, resource removal and the is_terminal rules.
+
+Units within a game are still processed in index order (so if two units reach
+the same resource on the same step the lower index one collects it), but each
+unit step is vectorised across the whole batch.
+"""
+from __future__ import annotations
+
+from typing import List, Optional
+
+import numpy as np
+
+from agents.game_interfaces import BatchGameModel
+from old_nano_rts.old_nano_rts_game import NanoRTSModel, NanoRTSParams, NanoRTSState, NanoStateGenerator, UnitState
+from stats.clock_decorator import clock
+from stats.metrics import METRICS
+
+
+class BatchNanoRTSModel(BatchGameModel):
+    """
+    B independent games stored as arrays:
+        x, y, fuel: [B, n_units]
+        resources: [B, grid_size, grid_size] holding the fuel of each resource (0 for none)
+        inert: [B] count of resources that can never be collected
+    Inert resources are those with zero fuel or located off the grid: update_unit
+    never removes them, so they keep a game from ending and have to be counted.
+    """
+    moves = np.array(NanoRTSModel.moves, dtype=np.int64)
+    actions_per_unit = NanoRTSModel.actions_per_unit
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, fuel: np.ndarray, resources: np.ndarray,
+                 inert: np.ndarray, params: NanoRTSParams = None):
+        self.params = params or NanoRTSParams()
+        self.x = x
+        self.y = y
+        self.fuel = fuel
+        self.resources = resources
+        self.inert = inert
+        self.batch_size, self.n_units = x.shape
+        self._rows = np.arange(self.batch_size)
+        # cost of each action, indexed by action % actions_per_unit
+        self._move_cost = np.array([self.params.fuel_per_nop if m == (0, 0) else self.params.fuel_per_move
+                                    for m in NanoRTSModel.moves], dtype=np.int64)
+
+    @staticmethod
+    def from_states(states: List[NanoRTSState], params: NanoRTSParams = None) -> BatchNanoRTSModel:
+        """
+        Builds a batch from a list of states, which must all have the same number of units.
+        """
+        params = params or NanoRTSParams()
+        g = params.grid_size
+        b = len(states)
+        n = len(states[0].units)
+        x = np.zeros((b, n), dtype=np.int64)
+        y = np.zeros((b, n), dtype=np.int64)
+        fuel = np.zeros((b, n), dtype=np.int64)
+        resources = np.zeros((b, g, g), dtype=np.int64)
+        inert = np.zeros(b, dtype=np.int64)
+        for i, state in enumerate(states):
+            if len(state.units) != n:
+                raise ValueError("all states in a batch must have the same number of units")
+            for j, unit in enumerate(state.units):
+                x[i, j], y[i, j], fuel[i, j] = unit.x, unit.y, unit.fuel
+            for (rx, ry), value in state.resources.items():
+                if value and 0 <= rx < g and 0 <= ry < g and rx == int(rx) and ry == int(ry):
+                    resources[i, int(rx), int(ry)] = value
+                else:
+                    inert[i] += 1
+        return BatchNanoRTSModel(x, y, fuel, resources, inert, params)
+
+    @staticmethod
+    def from_model(model: NanoRTSModel, batch_size: int) -> BatchNanoRTSModel:
+        """
+        Builds a batch holding batch_size copies of the model's current state.
+        """
+        return BatchNanoRTSModel.from_states([model.state], model.params).repeat(batch_size)
+
+    def repeat(self, batch_size: int) -> BatchNanoRTSModel:
+        """
+        Returns a new batch with game 0 of this batch copied batch_size times.
+        """
+        def rep(a: np.ndarray) -> np.ndarray:
+            return np.repeat(a[:1], batch_size, axis=0)
+
+        return BatchNanoRTSModel(rep(self.x), rep(self.y), rep(self.fuel), rep(self.resources),
+                                 rep(self.inert), self.params)
+
+    def copy(self) -> BatchNanoRTSModel:
+        return BatchNanoRTSModel(self.x.copy(), self.y.copy(), self.fuel.copy(), self.resources.copy(),
+                                 self.inert.copy(), self.params)
+
+    def to_state(self, i: int) -> NanoRTSState:
+        """
+        Converts game i back to a NanoRTSState.  Inert resources are not tracked
+        individually, so they cannot be restored.
+        """
+        units = [UnitState(int(x), int(y), int(f)) for x, y, f in zip(self.x[i], self.y[i], self.fuel[i])]
+        rx, ry = np.nonzero(self.resources[i])
+        resources = {(int(a), int(b)): int(self.resources[i, a, b]) for a, b in zip(rx, ry)}
+        return NanoRTSState(units, resources)
+
+    def score(self) -> np.ndarray:
+        """
+        Returns the score of every game: the sum of the fuel held by its units.
+        """
+        return self.fuel.sum(axis=1)
+
+    def n_resources(self) -> np.ndarray:
+        return np.count_nonzero(self.resources.reshape(self.batch_size, -1), axis=1) + self.inert
+
+    def is_terminal(self) -> np.ndarray:
+        return (self.n_resources() == 0) | (self.score() <= 0)
+
+    def combo_act(self, actions: np.ndarray, active: Optional[np.ndarray] = None) -> BatchNanoRTSModel:
+        """
+        Applies a [B, n_units] array of actions, one joint action per game.
+        Games that are terminal before the step are left unchanged, as in
+        NanoRTSModel.combo_act.  An optional boolean mask restricts the step to some games.
+        """
+        live = ~self.is_terminal()
+        if active is not None:
+            live &= active
+        rows = self._rows[live]
+        if len(rows) == 0:
+            return self
+        if METRICS.enabled:
+            METRICS.count("batch_nano_rts.steps", len(rows))
+        actions = np.asarray(actions)[live] % self.actions_per_unit
+        g = self.params.grid_size
+        capacity = self.params.fuel_tank_capacity
+        for j in range(self.n_units):
+            a = actions[:, j]
+            x = (self.x[rows, j] + self.moves[a, 0]) % g
+            y = (self.y[rows, j] + self.moves[a, 1]) % g
+            fuel = self.fuel[rows, j]
+            resource = self.resources[rows, x, y]
+            found = resource != 0
+            fuel = np.where(found, np.minimum(fuel + resource, capacity), fuel)
+            self.resources[rows[found], x[found], y[found]] = 0
+            self.x[rows, j] = x
+            self.y[rows, j] = y
+            self.fuel[rows, j] = fuel - self._move_cost[a]
+        return self
+
+
+def test():
+    """
+    Checks that the batch gives the same results as stepping NanoRTSModel instances one by one.
+    """
+    rng = np.random.default_rng(0)
+    params = NanoRTSParams(n_units=3, n_resources=6, grid_size=8, fuel_per_resource=80)
+    states = [NanoStateGenerator(params).generate() for _ in range(16)]
+    for state in states[8:]:
+        state.resources = {(int(rng.integers(8)), int(rng.integers(8))): 80 for _ in range(6)}
+    models = [NanoRTSModel(s, params).copy_state() for s in states]
+    batch = BatchNanoRTSModel.from_states([m.state for m in models], params)
+    for step in range(200):
+        actions = rng.integers(NanoRTSModel.actions_per_unit, size=(len(models), params.n_units))
+        batch.combo_act(actions)
+        for i, model in enumerate(models):
+            model.combo_act(list(actions[i]))
+            assert [(u.x, u.y, u.fuel) for u in model.state.units] == \
+                   list(zip(batch.x[i], batch.y[i], batch.fuel[i])), (step, i)
+            assert model.score() == batch.score()[i]
+            assert model.is_terminal() == batch.is_terminal()[i]
+            assert len(model.state.resources) == batch.n_resources()[i]
+    print("batch model matches NanoRTSModel")
+
+
+@clock
+def speed_test(batch_size: int = 1000, n_steps: int = 1000):
+    state = NanoStateGenerator().generate()
+    batch = BatchNanoRTSModel.from_model(NanoRTSModel(state), batch_size)
+    rng = np.random.default_rng()
+    for i in range(n_steps):
+        batch.combo_act(rng.integers(NanoRTSModel.actions_per_unit, size=(batch_size, batch.n_units)))
+    print(f"{batch_size * n_steps} game steps, mean score {batch.score().mean()}")
+
+
+if __name__ == '__main__':
+    test()
+    print("Speed test:")
+    speed_test()
@@ -0,0 +1,105 @@
+"""
+Fixed-layout binary encoding of old nanoRTS states, see agents.shared_state.
+
+Layout (little endian, no padding):
+    n_units: int32, n_resources: int32, has_hash: int32, zobrist: uint64
+    max_units x (x, y, fuel): int64
+    max_resources x (x, y, fuel): float64, int64, as resource positions may be off-grid floats
+Unused unit and resource entries are left as they were.
+"""
+from __future__ import annotations
+
+import random
+import struct
+
+from agents.shared_state import StateCodec, SharedStateBlock, benchmark as benchmark_codec
+from old_nano_rts.old_nano_rts_game import NanoRTSState, UnitState, NanoRTSParams, NanoStateGenerator, NanoRTSModel
+
+HEADER = struct.Struct("<iiiQ")
+UNIT = struct.Struct("<qqq")
+RESOURCE = struct.Struct("<ddq")
+
+
+def _coordinate(value: float):
+    return int(value) if value.is_integer() else value
+
+
+class OldNanoRTSCodec(StateCodec):
+    def __init__(self, max_units: int, max_resources: int):
+        self.max_units = max_units
+        self.max_resources = max_resources
+        self.units_offset = HEADER.size
+        self.resources_offset = self.units_offset + UNIT.size * max_units
+        self.size = self.resources_offset + RESOURCE.size * max_resources
+
+    @staticmethod
+    def for_params(params: NanoRTSParams) -> OldNanoRTSCodec:
+        return OldNanoRTSCodec(params.n_units, params.n_resources)
+
+    def encode_into(self, state: NanoRTSState, buffer, offset: int = 0) -> None:
+        n_units, n_resources = len(state.units), len(state.resources)
+        if n_units > self.max_units or n_resources > self.max_resources:
+            raise ValueError(f"state with {n_units} units and {n_resources} resources doesn't fit a codec for "
+                             f"{self.max_units} and {self.max_resources}")
+        zobrist = state.zobrist
+        HEADER.pack_into(buffer, offset, n_units, n_resources, zobrist is not None, zobrist or 0)
+        pos = offset + self.units_offset
+        for unit in state.units:
+            UNIT.pack_into(buffer, pos, unit.x, unit.y, unit.fuel)
+            pos += UNIT.size
+        pos = offset + self.resources_offset
+        for (x, y), fuel in state.resources.items():
+            RESOURCE.pack_into(buffer, pos, x, y, fuel)
+            pos += RESOURCE.size
+
+    def decode(self, buffer, offset: int = 0) -> NanoRTSState:
+        n_units, n_resources, has_hash, zobrist = HEADER.unpack_from(buffer, offset)
+        base = offset + self.units_offset
+        units = [UnitState(x, y, fuel) for x, y, fuel in UNIT.iter_unpack(buffer[base:base + n_units * UNIT.size])]
+        base = offset + self.resources_offset
+        resources = {(_coordinate(x), _coordinate(y)): fuel
+                     for x, y, fuel in RESOURCE.iter_unpack(buffer[base:base + n_resources * RESOURCE.size])}
+        return NanoRTSState(units, resources, zobrist if has_hash else None)
+
+
+def test():
+    """
+    Round trips random states, the default state with its off-grid resource, and states
+    part way through games, including through a shared memory block
+    """
+    params = NanoRTSParams()
+    codec = OldNanoRTSCodec.for_params(params)
+    generator = NanoStateGenerator(params)
+    rng = random.Random(0)
+    states = [generator.generate(), generator.generate_hand_designed()]
+    for i in range(20):
+        model = NanoRTSModel(generator.generate_random(rng), params)
+        model.state_hash()
+        for step in range(rng.randrange(30)):
+            model.combo_act([rng.randrange(model.actions_per_unit) for _ in range(model.n_units())])
+        states.append(model.state)
+    with SharedStateBlock(codec, len(states)) as block:
+        for slot, state in enumerate(states):
+            block.write(slot, state)
+        for slot, state in enumerate(states):
+            for decoded in [codec.decode(codec.encode(state)), block.read(slot)]:
+                assert decoded == state and decoded.zobrist == state.zobrist
+                assert [type(unit.x) for unit in decoded.units] == [type(unit.x) for unit in state.units]
+    try:
+        codec.encode(NanoRTSState([UnitState(0, 0, 0)] * (params.n_units + 1), {}))
+        assert False, "too many units should be refused"
+    except ValueError:
+        pass
+    print(f"old nano rts codec round trips ok ({codec.size} bytes per state)")
+
+
+def benchmark(n: int = 20000):
+    params = NanoRTSParams()
+    codec = OldNanoRTSCodec.for_params(params)
+    state = NanoStateGenerator(params).generate_random(random.Random(0))
+    benchmark_codec(codec, NanoRTSModel(state, params), n)
+
+
+if __name__ == '__main__':
+    test()
+    benchmark()
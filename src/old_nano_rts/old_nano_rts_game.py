@@ -12,12 +12,22 @@ from the list, no problem.  Ok, just randomly spawn some extra ones in
 an empty slot.
 """
 import copy
-from dataclasses import dataclass
-from typing import List, Dict, Tuple
-
-from agents.game_interfaces import MultiUnitGameModel
+import random
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional
+
+from agents.game_interfaces import MultiUnitGameModel, CloneableGameModel, UndoableGameModel, BatchableGameModel, \
+    BatchGameModel, HashableGameModel, TransitionDeltaListener
+from agents.joint_action_space import JointActionSpace, joint_action_space
+from agents.zobrist import ZobristTable
+from nano_rts.occupancy_grid import OccupancyGrid, EMPTY
 from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
 from stats.clock_decorator import clock
+from stats.metrics import METRICS
+
+# Zobrist feature tags and the table shared by all states, so hashes can be compared across models
+UNIT_POSITION, UNIT_FUEL, RESOURCE = range(3)
+ZOBRIST = ZobristTable()
 
 
 @dataclass(frozen=False)
@@ -29,6 +39,9 @@ class UnitState:
     y: int
     fuel: int
 
+    def clone(self) -> UnitState:
+        return UnitState(self.x, self.y, self.fuel)
+
 # todo: make a resource class to handle resources of a different type
 class Resource:
     pass
@@ -43,6 +56,41 @@ class NanoRTSState:
     """
     units: List[UnitState]
     resources: Dict[Tuple[int, int], int]
+    # Zobrist hash of the state, computed on first use and then kept up to date
+    # incrementally by NanoRTSModel.update_unit.  Code which changes the state
+    # directly should reset it to None
+    zobrist: Optional[int] = field(default=None, compare=False, repr=False)
+
+    def clone(self) -> NanoRTSState:
+        """
+        Copies the units and takes a shallow copy of the resources dict,
+        whose keys and values are immutable.
+        """
+        return NanoRTSState([unit.clone() for unit in self.units], dict(self.resources), self.zobrist)
+
+    def zobrist_key(self) -> int:
+        """
+        Returns the full 64 bit Zobrist hash; hash() reduces it to fit a Py_hash_t
+        """
+        if self.zobrist is None:
+            self.zobrist = zobrist_hash(self)
+        return self.zobrist
+
+    def __hash__(self) -> int:
+        # consistent with the dataclass __eq__: equal states have the same features
+        return self.zobrist_key()
+
+
+def zobrist_hash(state: NanoRTSState) -> int:
+    """
+    Hashes the unit positions and fuel and the remaining resources
+    """
+    h = 0
+    for i, unit in enumerate(state.units):
+        h ^= ZOBRIST(UNIT_POSITION, i, unit.x, unit.y) ^ ZOBRIST(UNIT_FUEL, i, unit.fuel)
+    for (x, y), fuel in state.resources.items():
+        h ^= ZOBRIST(RESOURCE, int(x), int(y), fuel)
+    return h
 
 
 @dataclass(frozen=False)
@@ -78,6 +126,18 @@ class NanoStateGenerator:
         resources = {(p.grid_size/2, p.grid_size - i): p.fuel_per_resource for i in range(p.n_resources)}
         return NanoRTSState(units, resources)
 
+    def generate_random(self, rng: random.Random) -> NanoRTSState:
+        """
+        Generates a state with units and resources placed at random, with each resource
+        in a different cell.
+        """
+        p = self.params
+        units = [UnitState(rng.randrange(p.grid_size), rng.randrange(p.grid_size), p.fuel_per_unit)
+                 for _ in range(p.n_units)]
+        cells = rng.sample(range(p.grid_size * p.grid_size), min(p.n_resources, p.grid_size * p.grid_size))
+        resources = {(c % p.grid_size, c // p.grid_size): p.fuel_per_resource for c in cells}
+        return NanoRTSState(units, resources)
+
     def generate_hand_designed(self) -> NanoRTSState:
         """
         Generates a specific state for the game.  This is useful for particular experiments.
@@ -91,7 +151,8 @@ class NanoStateGenerator:
         return NanoRTSState(units, resources)
 
 
-class NanoRTSModel(MultiUnitGameModel):
+class NanoRTSModel(MultiUnitGameModel, CloneableGameModel, UndoableGameModel, BatchableGameModel,
+                   HashableGameModel):
     """
     Defines the rules of the game.
     """
@@ -101,6 +162,20 @@ class NanoRTSModel(MultiUnitGameModel):
     def __init__(self, state: NanoRTSState, params: NanoRTSParams = None):
         self.state = state or NanoStateGenerator(params).generate()
         self.params = params or NanoRTSParams()
+        # undo journal: each mark is the x, y and fuel of every unit at push_undo followed
+        # by the number of removed resource entries and the state hash, written into a flat
+        # list that only grows, with _undo_top marking its end, so a rollout allocates nothing.
+        # Every unit can change on every step, so it's cheaper to record all the units once
+        # per mark than to journal each update.  Removed resources are journalled as
+        # x, y, fuel entries in a list that pop_undo truncates
+        self._undo_journal: List = []
+        self._undo_top = 0
+        self._removed_resources: List[int] = []
+        # resource fuel by cell, built on first use by resource_grid() and then used for
+        # every resource lookup, so the resources dict must not be changed directly after that
+        self._resource_grid: Optional[OccupancyGrid] = None
+        # told about every change when set, see TransitionDeltaListener
+        self.delta_listener: Optional[TransitionDeltaListener] = None
 
     def n_actions(self) -> int:
         # number of actions is exponential in the number of units
@@ -117,24 +192,49 @@ class NanoRTSModel(MultiUnitGameModel):
 
     # todo: introduce the spawning of new units in response to resource collection
 
-    def update_unit(self, unit: UnitState, move: (int, int)) -> UnitState:
+    def update_unit(self, unit: UnitState, move: (int, int), index: int = None) -> UnitState:
         """
-        Updates state single unit and checks for collisions with resources
+        Updates state single unit and checks for collisions with resources.
+        The index of the unit is needed to update the state hash incrementally,
+        without it the hash is recomputed on next use.
         """
+        listener = self.delta_listener
+        if listener is not None:
+            x0, y0, fuel0 = unit.x, unit.y, unit.fuel
+        h = self.state.zobrist
+        if h is not None:
+            if index is None:
+                self.state.zobrist = h = None
+            else:
+                h ^= ZOBRIST(UNIT_POSITION, index, unit.x, unit.y) ^ ZOBRIST(UNIT_FUEL, index, unit.fuel)
         unit.x = (unit.x + move[0]) % self.params.grid_size
         unit.y = (unit.y + move[1]) % self.params.grid_size
-        resource = self.state.resources.get((unit.x, unit.y))
+        grid = self._resource_grid or self.resource_grid()
+        cell = unit.x * grid.grid_size + unit.y
+        resource = grid.cells[cell]
         # this deletes the resource from the state,
         # but we could also just transfer a unit of fuel
         if resource:
             unit.fuel += resource
             if unit.fuel > self.params.fuel_tank_capacity:
                 unit.fuel = self.params.fuel_tank_capacity
+            if self._undo_top:
+                self._removed_resources.extend((unit.x, unit.y, resource))
             del self.state.resources[(unit.x, unit.y)]
+            grid.cells[cell] = EMPTY
+            if h is not None:
+                h ^= ZOBRIST(RESOURCE, unit.x, unit.y, resource)
         if move == (0, 0):
             unit.fuel -= self.params.fuel_per_nop
         else:
             unit.fuel -= self.params.fuel_per_move
+        if h is not None:
+            self.state.zobrist = h ^ ZOBRIST(UNIT_POSITION, index, unit.x, unit.y) ^ \
+                ZOBRIST(UNIT_FUEL, index, unit.fuel)
+        if listener is not None:
+            if resource:
+                listener.resource_consumed(unit.x, unit.y, resource)
+            listener.unit_changed(-1 if index is None else index, x0, y0, unit.x, unit.y, unit.fuel - fuel0)
         return unit
 
     def score(self) -> float:
@@ -149,9 +249,11 @@ class NanoRTSModel(MultiUnitGameModel):
         """
         if self.is_terminal():
             return self
+        if METRICS.enabled:
+            METRICS.count("old_nano_rts.steps")
         for i, unit in enumerate(self.state.units):
             move = self.action_to_move(action_list[i])
-            self.update_unit(unit, move)
+            self.update_unit(unit, move, i)
         return self
 
     def is_terminal(self) -> bool:
@@ -159,22 +261,93 @@ class NanoRTSModel(MultiUnitGameModel):
 
     # implement: act, copy_state, n_actions_unit_i, n_units
 
-    def act(self, action: int) -> NanoRTSModel:
-        # the actions for each unit are combined in this single int
-        # so we need to split them up
-        action_list = []
-        for i in range(self.n_units()):
-            action_list.append(action % self.actions_per_unit)
-            action = action // self.actions_per_unit
-        self.combo_act(action_list)
-        return self
-
     def copy_state(self) -> MultiUnitGameModel:
-        return copy.deepcopy(self)
+        return self.clone()
+
+    def clone(self) -> NanoRTSModel:
+        # params are never modified by the model, so they are shared rather than copied
+        copy = NanoRTSModel(self.state.clone(), self.params)
+        if self._resource_grid is not None:
+            copy._resource_grid = self._resource_grid.clone()
+        return copy
+
+    def push_undo(self) -> None:
+        units = self.state.units
+        journal = self._undo_journal
+        top = self._undo_top
+        end = top + 3 * len(units) + 2
+        if end > len(journal):
+            journal.extend([0] * (end - len(journal)))
+        for unit in units:
+            journal[top] = unit.x
+            journal[top + 1] = unit.y
+            journal[top + 2] = unit.fuel
+            top += 3
+        journal[top] = len(self._removed_resources)
+        journal[top + 1] = self.state.zobrist
+        self._undo_top = end
+
+    def pop_undo(self) -> None:
+        units = self.state.units
+        journal = self._undo_journal
+        top = self._undo_top - 2
+        n_removed = journal[top]
+        self.state.zobrist = journal[top + 1]
+        start = top - 3 * len(units)
+        i = start
+        for unit in units:
+            unit.x, unit.y, unit.fuel = journal[i], journal[i + 1], journal[i + 2]
+            i += 3
+        self._undo_top = start
+        removed = self._removed_resources
+        if len(removed) > n_removed:
+            resources = self.state.resources
+            grid = self._resource_grid
+            for k in range(len(removed) - 3, n_removed - 1, -3):
+                x, y, fuel = removed[k], removed[k + 1], removed[k + 2]
+                resources[(x, y)] = fuel
+                if grid is not None:
+                    grid.place(fuel, x, y)
+            del removed[n_removed:]
+
+    def resource_grid(self) -> OccupancyGrid:
+        """
+        Returns a wrapping grid of resource fuel, kept in sync with the resources dict
+        once built.  Resources off the grid can never be reached and are left out.
+        """
+        if self._resource_grid is None:
+            g = self.params.grid_size
+            grid = OccupancyGrid(g, wrap=True)
+            for (x, y), fuel in self.state.resources.items():
+                if fuel and 0 <= x < g and 0 <= y < g and x == int(x) and y == int(y):
+                    grid.place(fuel, int(x), int(y))
+            self._resource_grid = grid
+        return self._resource_grid
+
+    def nearest_resource(self, x: int, y: int) -> Optional[Tuple[int, int]]:
+        """
+        Returns the location of the nearest resource to (x, y), allowing for wraparound
+        """
+        found = self.resource_grid().nearest(x, y)
+        return (found[1], found[2]) if found else None
+
+    def state_hash(self) -> int:
+        return self.state.zobrist_key()
+
+    def to_batch(self, batch_size: int) -> BatchGameModel:
+        # imported here as the batch module builds on this one
+        from old_nano_rts.batch_nano_rts_game import BatchNanoRTSModel
+        return BatchNanoRTSModel.from_model(self, batch_size)
 
     def n_actions_unit_i(self, i: int) -> int:
         return len(self.moves)
 
+    def get_action_space(self) -> List[int]:
+        return [self.actions_per_unit] * self.n_units()
+
+    def joint_action_space(self) -> JointActionSpace:
+        return joint_action_space((self.actions_per_unit,) * self.n_units())
+
     def n_units(self) -> int:
         return len(self.state.units)
 
@@ -188,6 +361,90 @@ def test():
     print(f"Score: {model.score()}")
 
 
+def test_clone():
+    """
+    Checks that clone() gives the same result as copy.deepcopy and that the copies are independent.
+    """
+    model = NanoRTSModel(NanoStateGenerator().generate())
+    player = MultiUnitRandomPlayer()
+    for i in range(50):
+        cloned = model.clone()
+        deep = copy.deepcopy(model)
+        assert cloned.state == deep.state == model.state
+        assert cloned.params is model.params
+        actions = player.get_actions(model)
+        cloned.combo_act(actions)
+        deep.combo_act(actions)
+        assert cloned.state == deep.state
+        assert cloned.state.units[0] is not model.state.units[0]
+        model.combo_act(player.get_actions(model))
+    print("clone matches deepcopy")
+
+
+def test_undo():
+    """
+    Checks that rolling back with pop_undo restores the state exactly.
+    """
+    params = NanoRTSParams(n_units=3, grid_size=6)
+    model = NanoRTSModel(NanoStateGenerator(params).generate(), params)
+    player = MultiUnitRandomPlayer()
+    for i in range(20):
+        root = model.clone()
+        model.push_undo()
+        for j in range(30):
+            model.combo_act(player.get_actions(model))
+            if j == 10:
+                inner = model.clone()
+                model.push_undo()
+                model.combo_act(player.get_actions(model))
+                model.pop_undo()
+                assert model.state == inner.state
+        model.pop_undo()
+        assert model.state == root.state
+        model.combo_act(player.get_actions(model))
+    # the journal is reused: it only ever held the two nested marks
+    assert model._undo_top == 0 and len(model._undo_journal) == 2 * (3 * params.n_units + 2)
+    print("undo restores state")
+
+
+def test_hash():
+    """
+    Checks the incremental hash against the full computation, and looks for
+    collisions between different states over random trajectories.
+    """
+    params = NanoRTSParams(n_units=2, n_resources=4, grid_size=5)
+    player = MultiUnitRandomPlayer()
+    seen: Dict[int, NanoRTSState] = {}
+    for seed in range(50):
+        model = NanoRTSModel(NanoStateGenerator(params).generate_random(random.Random(seed)), params)
+        while not model.is_terminal():
+            h = model.state_hash()
+            assert h == zobrist_hash(model.state)
+            other = seen.setdefault(h, model.state.clone())
+            assert other == model.state, "hash collision"
+            assert model.clone().state_hash() == h
+            assert hash(model.clone().state) == hash(model.state)
+            model.push_undo()
+            model.combo_act(player.get_actions(model))
+            model.pop_undo()
+            assert model.state_hash() == h
+            model.combo_act(player.get_actions(model))
+    print(f"no collisions in {len(seen)} distinct states")
+
+
+def test_resource_grid():
+    params = NanoRTSParams(n_units=1, grid_size=10)
+    model = NanoRTSModel(NanoRTSState([UnitState(0, 0, 20)], {(9, 0): 50, (3, 3): 50}), params)
+    # (9, 0) is one step away through the wraparound
+    assert model.nearest_resource(0, 0) == (9, 0)
+    model.push_undo()
+    model.combo_act([4])
+    assert model.nearest_resource(0, 0) == (3, 3)
+    model.pop_undo()
+    assert model.nearest_resource(0, 0) == (9, 0)
+    print("resource grid in sync")
+
+
 @clock
 def speed_test(n_steps: int = 100000):
     state_generator = NanoStateGenerator()
@@ -204,5 +461,9 @@ def speed_test(n_steps: int = 100000):
 
 if __name__ == '__main__':
     test()
+    test_clone()
+    test_undo()
+    test_hash()
+    test_resource_grid()
     print("Speed test:")
     speed_test()
@@ -1,5 +1,6 @@
-from typing import List, Union
+from typing import Iterable, List, Tuple, Union
 
+import numpy as np
 import pygame
 import pygame.locals
 from pygame import QUIT
@@ -7,6 +8,7 @@ from pygame import QUIT
 from agents.game_interfaces import MultiUnitPlayerInterface, SimplePlayerInterface
 from agents.rhea_agent import RHEA
 from old_nano_rts.old_nano_rts_game import NanoRTSState, NanoRTSModel, NanoStateGenerator, NanoRTSParams
+from rendering.cached_renderer import CachedGridRenderer, headless as use_dummy_video_driver
 
 
 class NanoRTSView:
@@ -25,7 +27,7 @@ class NanoRTSView:
     COLORS = [BG_COLOR, WALL_COLOR, UNIT_COLOR, RESOURCE_COLOR]
 
     def __init__(self, model: NanoRTSModel, size: int = DEFAULT_SIZE):
-        # todo: add a location and scale to enable multiple views on the same screen
+        # many games on the same screen: see rendering.tiled_dashboard
         self.model = model
         self.size = size
         self.width = model.params.grid_size
@@ -49,23 +51,37 @@ class NanoRTSView:
     def draw_grid(self, screen):
         # fill the background, then draw the grid, then the state items individually
         # screen.set_alpha(20)
+        self.draw_background(screen)
+        for item in self.items(self.model.state):
+            self.draw_item(screen, item)
+
+    def draw_background(self, screen):
         screen.fill(self.BG_COLOR)
         for x in range(self.width):
             for y in range(self.height):
                 rect = self.xy_to_rect(x, y)
                 pygame.draw.rect(screen, self.WALL_COLOR, rect, self.BORDER)
-        for i, unit in enumerate(self.model.state.units):
-            rect = self.xy_to_rect(unit.x, unit.y)
-            pygame.draw.rect(screen, self.UNIT_COLORS[i % self.N_UNIT_COLORS], rect)
-            # print(self.UNIT_COLORS[i % self.N_UNIT_COLORS])
-        for location in self.model.state.resources.keys():
-            rect = self.xy_to_rect(location[0], location[1])
-            pygame.draw.rect(screen, self.RESOURCE_COLOR, rect)
+
+    def items(self, state: NanoRTSState) -> List[Tuple]:
+        """
+        What to draw for a state, in drawing order: each item holds everything needed to draw
+        it, so a cell needs redrawing exactly when its items change (see rendering.cached_renderer)
+        """
+        units = [(unit.x, unit.y, self.UNIT_COLORS[i % self.N_UNIT_COLORS]) for i, unit in enumerate(state.units)]
+        return units + [(x, y, self.RESOURCE_COLOR) for x, y in state.resources.keys()]
+
+    def item_cells(self, item: Tuple) -> List[Tuple]:
+        return [item[:2]]
+
+    def draw_item(self, screen, item: Tuple) -> None:
+        x, y, color = item
+        pygame.draw.rect(screen, color, self.xy_to_rect(x, y))
 
     def view_size(self) -> List[int]:
         return [self.size * self.width, self.size * self.height]
 
-    def draw_trajectory(self, screen, trajectory: List[NanoRTSState]):
+    def draw_trajectory(self, screen, trajectory: Iterable[NanoRTSState]):
+        # trajectory can be a list of states or a recorded agents.trajectory.TrajectoryReader
         for state in trajectory:
             for unit in state.units:
                 rect = self.xy_to_rect(unit.x, unit.y)
@@ -76,16 +92,31 @@ class NanoRTSView:
 
 class NanoRTSController:
     def __init__(self, model: NanoRTSModel, agent: Union[SimplePlayerInterface, MultiUnitPlayerInterface],
-                 frame_rate: int = 10):
+                 frame_rate: int = 10, cached: bool = False, headless: bool = False, record: bool = False):
+        """
+        :param cached: redraw only the cells that changed, see rendering.cached_renderer (this
+               draws opaque frames, without the faint trail the default alpha blending leaves)
+        :param headless: no window (SDL dummy video driver) and no frame rate limit, e.g. on a server
+        :param record: keep every frame shown as a [height, width, 3] RGB array in self.frames
+        """
         self.model = model
         self.agent = agent
         self.view = NanoRTSView(model)
+        self.headless = headless
+        if headless:
+            use_dummy_video_driver()
         pygame.init()
         pygame.display.set_caption('Old Nano RTS')
         # Set up the drawing window
         self.clock = pygame.time.Clock()
         self.screen = pygame.display.set_mode(self.view.view_size())
         self.surface = pygame.Surface(self.view.view_size(), pygame.locals.SRCALPHA )
+        self.renderer = CachedGridRenderer(self.view, self.screen) if cached else None
+        if self.renderer:
+            # show the background the renderer drew: each frame only updates the changed cells
+            pygame.display.flip()
+        self.record = record
+        self.frames: List[np.ndarray] = []
         self.frame_rate = frame_rate
         self.step = 0
 
@@ -98,7 +129,10 @@ class NanoRTSController:
                 if event.type == QUIT:
                     running = False
 
-            self.view.draw_grid(self.surface)
+            if self.renderer:
+                rects = self.renderer.render(self.model.state)
+            else:
+                self.view.draw_grid(self.surface)
 
             if isinstance(self.agent, MultiUnitPlayerInterface):
                 actions = self.agent.get_actions(self.model)
@@ -108,9 +142,15 @@ class NanoRTSController:
                 self.model.act(action)
 
             # Flip the display
-            self.screen.blit(self.surface, (0, 0))
-            pygame.display.flip()
-            self.clock.tick(self.frame_rate)
+            if self.renderer:
+                pygame.display.update(rects)
+            else:
+                self.screen.blit(self.surface, (0, 0))
+                pygame.display.flip()
+            if self.record:
+                self.frames.append(pygame.surfarray.array3d(self.screen).swapaxes(0, 1))
+            if not self.headless:
+                self.clock.tick(self.frame_rate)
             print(self.step, "\t", self.model.score())
             self.step += 1
 
@@ -0,0 +1,199 @@
+"""
+ Dirty-region rendering and headless frame export for the NanoRTSViews of both games.
+
+ NanoRTSView.draw_grid repaints the background, every grid cell outline and every
+ unit on each frame.  CachedGridRenderer draws the static background once into a
+ cached surface, and on each frame works out which cells' items changed since the
+ last one: only those cells are restored from the background and redrawn (clipped
+ to the cell, in the view's drawing order), so the result is pixel for pixel what
+ draw_grid would draw.  The rects returned by render can be passed straight to
+ pygame.display.update.
+
+ A view provides:
+     draw_background(surface)
+     items(state) -> list of hashable items, in drawing order
+     item_cells(item) -> the cells the item draws in
+     draw_item(surface, item)
+
+ None of this needs a window: call headless() before pygame is initialised on a
+ machine without a display, then use record_frames to get frames as a NumPy
+ [n, height, width, 3] uint8 array, or save_frames to write an image sequence.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pygame
+
+Cell = Tuple[int, int]
+
+
+def headless() -> None:
+    """
+    Makes pygame use the SDL dummy video driver (unless a driver was chosen already),
+    so no window is opened even if a display is initialised
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+
+class CachedGridRenderer:
+    def __init__(self, view, surface: pygame.Surface = None):
+        """
+        :param surface: surface to draw on, e.g. the display; by default a new opaque
+               surface of the view's size.  The renderer assumes nothing else draws on it
+        """
+        self.view = view
+        self.surface = surface or pygame.Surface(view.view_size())
+        self.background = pygame.Surface(view.view_size())
+        view.draw_background(self.background)
+        self.cells: Dict[Cell, List] = {}
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """
+        Repaints the background, so the next render draws every item
+        """
+        self.surface.blit(self.background, (0, 0))
+        self.cells = {}
+
+    def cell_rect(self, cell: Cell) -> pygame.Rect:
+        size = self.view.size
+        return pygame.Rect(int(size * cell[0]), int(size * cell[1]), size, size)
+
+    def render(self, state) -> List[pygame.Rect]:
+        """
+        Brings the surface up to date with the state, and returns the rects of the cells redrawn
+        """
+        view = self.view
+        cells: Dict[Cell, List] = {}
+        for item in view.items(state):
+            for cell in view.item_cells(item):
+                items = cells.get(cell)
+                if items is None:
+                    cells[cell] = [item]
+                else:
+                    items.append(item)
+        last = self.cells
+        dirty = [cell for cell, items in cells.items() if last.get(cell) != items]
+        dirty.extend(cell for cell in last if cell not in cells)
+        surface = self.surface
+        rects = []
+        for cell in dirty:
+            rect = self.cell_rect(cell)
+            surface.set_clip(rect)
+            surface.blit(self.background, rect, rect)
+            for item in cells.get(cell, ()):
+                view.draw_item(surface, item)
+            rects.append(rect)
+        surface.set_clip(None)
+        self.cells = cells
+        return rects
+
+    def to_array(self) -> np.ndarray:
+        """
+        The current frame as a [height, width, 3] uint8 RGB array
+        """
+        return pygame.surfarray.array3d(self.surface).swapaxes(0, 1)
+
+
+def record_frames(view, states: Iterable) -> np.ndarray:
+    """
+    Renders each state (e.g. a list of states or an agents.trajectory.TrajectoryReader)
+    and returns the frames as an [n, height, width, 3] uint8 array
+    """
+    renderer = CachedGridRenderer(view)
+    frames = []
+    for state in states:
+        renderer.render(state)
+        frames.append(renderer.to_array())
+    width, height = view.view_size()
+    return np.array(frames, dtype=np.uint8).reshape(-1, height, width, 3)
+
+
+def save_frames(view, states: Iterable, folder: str, pattern: str = "frame_{:05d}.png") -> int:
+    """
+    Renders each state to an image file in folder (the format follows the extension in
+    pattern; PNG needs pygame's image support, BMP always works), returning the number saved
+    """
+    os.makedirs(folder, exist_ok=True)
+    renderer = CachedGridRenderer(view)
+    n = 0
+    for n, state in enumerate(states, 1):
+        renderer.render(state)
+        pygame.image.save(renderer.surface, os.path.join(folder, pattern.format(n - 1)))
+    return n
+
+
+def test():
+    """
+    Checks the cached renderer draws the same frames as draw_grid over random games of both versions
+    """
+    import random
+    import tempfile
+    import old_nano_rts.old_nano_rts_game as old_game
+    import nano_rts.nano_rts_game as new_game
+    from old_nano_rts.old_nano_rts_view_controller import NanoRTSView as OldView
+    from nano_rts.nano_rts_view_controller import NanoRTSView as NewView
+    from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+
+    player = MultiUnitRandomPlayer(0)
+    params = new_game.NanoRTSParams()
+    for name, model, view_class in [
+        ("old nano rts", old_game.NanoRTSModel(old_game.NanoStateGenerator().generate()), OldView),
+        ("nano rts", new_game.NanoRTSModel(new_game.generate_random_state(params, random.Random(0))), NewView)]:
+        view = view_class(model)
+        renderer = CachedGridRenderer(view)
+        full = pygame.Surface(view.view_size())
+        states = []
+        for step in range(100):
+            renderer.render(model.state)
+            view.draw_grid(full)
+            assert np.array_equal(renderer.to_array(), pygame.surfarray.array3d(full).swapaxes(0, 1)), (name, step)
+            states.append(model.state.clone())
+            model.combo_act(player.get_actions(model))
+        frames = record_frames(view, states)
+        width, height = view.view_size()
+        assert frames.shape == (len(states), height, width, 3)
+        with tempfile.TemporaryDirectory() as folder:
+            assert save_frames(view, states[:5], folder, "frame_{:05d}.bmp") == 5
+            assert sorted(os.listdir(folder))[-1] == "frame_00004.bmp"
+        print(f"{name}: cached frames match draw_grid")
+
+
+def speed_test(n_steps: int = 500):
+    import random
+    import nano_rts.nano_rts_game as new_game
+    from nano_rts.nano_rts_view_controller import NanoRTSView
+    from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+    for grid_size in [10, 40]:
+        params = new_game.NanoRTSParams(grid_size=grid_size)
+        model = new_game.NanoRTSModel(new_game.generate_random_state(params, random.Random(0), n_workers=8,
+                                                                     n_resources=2 * grid_size), params)
+        player = MultiUnitRandomPlayer(0)
+        states = []
+        for _ in range(n_steps):
+            states.append(model.state.clone())
+            model.combo_act(player.get_actions(model))
+        view = NanoRTSView(model, size=20)
+        surface = pygame.Surface(view.view_size())
+        t = time.perf_counter()
+        for state in states:
+            view.model.state = state
+            view.draw_grid(surface)
+        t_full = time.perf_counter() - t
+        renderer = CachedGridRenderer(view)
+        t = time.perf_counter()
+        for state in states:
+            renderer.render(state)
+        t_cached = time.perf_counter() - t
+        print(f"grid {grid_size}: draw_grid {n_steps / t_full:.0f} fps, cached {n_steps / t_cached:.0f} fps")
+
+
+if __name__ == '__main__':
+    headless()
+    test()
+    speed_test()
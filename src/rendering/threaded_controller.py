@@ -0,0 +1,220 @@
+"""
+ A controller that runs the game and the agent on a worker thread, so that a slow
+ decision doesn't freeze the window, and the frame rate doesn't throttle the game.
+
+ The simulation thread appends a snapshot (a copy of the state) to a deque after
+ every step; appending and popping at the two ends of a deque are atomic, so the two
+ threads share no locks.  The render loop in the main thread handles events and
+ draws snapshots with a CachedGridRenderer.
+
+ Simulation speed:
+     sim_rate=None: as fast as the agent can decide
+     sim_rate=k: a fixed tick of k steps per second (or slower, if decisions take longer)
+ Rendering:
+     frame_skip=True: each frame shows the newest snapshot, skipping any the renderer
+         fell behind on (the deque is bounded, so old snapshots are dropped)
+     frame_skip=False: every snapshot is shown in order, and the simulation waits when
+         max_queue snapshots are waiting to be drawn
+
+ Both loops share the interpreter lock, so the agent gets the CPU time the renderer
+ leaves, but event handling stays responsive whatever the agent is doing.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, List, Optional, Union
+
+import numpy as np
+import pygame
+from pygame import QUIT
+
+from agents.game_interfaces import MultiUnitPlayerInterface, SimplePlayerInterface, MultiUnitGameModel
+from rendering.cached_renderer import CachedGridRenderer, headless as use_dummy_video_driver
+
+
+@dataclass
+class Snapshot:
+    step: int
+    state: Any
+    score: float
+
+
+class ThreadedController:
+    def __init__(self, model: MultiUnitGameModel, agent: Union[SimplePlayerInterface, MultiUnitPlayerInterface],
+                 view, frame_rate: Optional[int] = 30, sim_rate: Optional[float] = None, frame_skip: bool = True,
+                 max_queue: int = 64, max_steps: int = None, headless: bool = False, record: bool = False,
+                 caption: str = "Nano RTS"):
+        """
+        :param view: a NanoRTSView of either game, drawn from the snapshots' states
+        :param frame_rate: most frames drawn per second, None for no limit
+        :param sim_rate: game steps per second, None for as fast as possible
+        :param max_steps: stop the game after this many steps, as well as at a terminal state
+        :param headless: no window (SDL dummy video driver), e.g. to record games on a server
+        :param record: keep every frame drawn as a [height, width, 3] RGB array in self.frames
+        """
+        self.model = model
+        self.agent = agent
+        self.view = view
+        self.frame_rate = frame_rate
+        self.sim_rate = sim_rate
+        self.frame_skip = frame_skip
+        self.max_queue = max_queue
+        self.max_steps = max_steps
+        self.headless = headless
+        self.record = record
+        self.caption = caption
+        self.snapshots: Deque[Snapshot] = deque(maxlen=max_queue if frame_skip else None)
+        self.stop = threading.Event()
+        self.finished = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.frames: List[np.ndarray] = []
+        self.last: Optional[Snapshot] = None
+        self.n_frames = 0
+        self.n_skipped = 0
+        self.step = 0
+
+    def decide_and_act(self) -> None:
+        if isinstance(self.agent, MultiUnitPlayerInterface):
+            self.model.combo_act(self.agent.get_actions(self.model))
+        else:
+            self.model.act(self.agent.get_action(self.model))
+
+    def push(self) -> None:
+        if not self.frame_skip:
+            # wait for the renderer rather than dropping snapshots
+            while len(self.snapshots) >= self.max_queue and not self.stop.is_set():
+                time.sleep(0.001)
+        self.snapshots.append(Snapshot(self.step, self.model.state.clone(), self.model.score()))
+
+    def simulate(self) -> None:
+        """
+        The simulation thread: plays the game, pushing a snapshot after every step
+        """
+        try:
+            self.push()
+            next_tick = time.perf_counter()
+            while not self.stop.is_set() and not self.model.is_terminal() and \
+                    (self.max_steps is None or self.step < self.max_steps):
+                self.decide_and_act()
+                self.step += 1
+                self.push()
+                if self.sim_rate:
+                    next_tick += 1 / self.sim_rate
+                    delay = next_tick - time.perf_counter()
+                    if delay > 0:
+                        self.stop.wait(delay)
+                    else:
+                        # running behind: don't try to catch up with a burst of steps
+                        next_tick = time.perf_counter()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finished.set()
+
+    def next_snapshot(self) -> Optional[Snapshot]:
+        snapshots = self.snapshots
+        if not snapshots:
+            return None
+        if not self.frame_skip:
+            return snapshots.popleft()
+        snapshot = snapshots.popleft()
+        while snapshots:
+            snapshot = snapshots.popleft()
+        return snapshot
+
+    def run(self) -> None:
+        if self.headless:
+            use_dummy_video_driver()
+        pygame.init()
+        pygame.display.set_caption(self.caption)
+        clock = pygame.time.Clock()
+        screen = pygame.display.set_mode(self.view.view_size())
+        renderer = CachedGridRenderer(self.view, screen)
+        pygame.display.flip()
+        thread = threading.Thread(target=self.simulate, daemon=True)
+        thread.start()
+        running = True
+        try:
+            while running:
+                for event in pygame.event.get():
+                    if event.type == QUIT:
+                        running = False
+                # check before taking snapshots, so none pushed in between are missed
+                finished = self.finished.is_set()
+                snapshot = self.next_snapshot()
+                if snapshot is not None:
+                    pygame.display.update(renderer.render(snapshot.state))
+                    self.n_skipped += snapshot.step - (self.last.step + 1 if self.last else 0)
+                    self.last = snapshot
+                    self.n_frames += 1
+                    if self.record:
+                        self.frames.append(renderer.to_array())
+                elif finished:
+                    break
+                if self.frame_rate:
+                    clock.tick(self.frame_rate)
+                elif snapshot is None:
+                    time.sleep(0.001)
+        finally:
+            self.stop.set()
+            thread.join(timeout=1)
+            pygame.quit()
+        if self.error is not None:
+            raise self.error
+
+
+def test():
+    """
+    Plays headless games in each mode, checking the last frame shows the final state
+    and that the render loop keeps running while the agent is thinking
+    """
+    import random
+    import old_nano_rts.old_nano_rts_game as old_game
+    import nano_rts.nano_rts_game as new_game
+    from old_nano_rts.old_nano_rts_view_controller import NanoRTSView
+    from nano_rts.nano_rts_view_controller import NanoRTSView as NewView
+    from multi_unit_agents.multi_unit_random_agent import MultiUnitRandomPlayer
+    from multi_unit_agents.multi_unit_rhea import MultiUnitRHEA
+
+    def make_model():
+        return old_game.NanoRTSModel(old_game.NanoStateGenerator().generate_random(random.Random(0)))
+
+    # every step drawn in order
+    model = make_model()
+    controller = ThreadedController(model, MultiUnitRandomPlayer(0), NanoRTSView(model), frame_rate=None,
+                                    frame_skip=False, max_queue=4, max_steps=200, headless=True, record=True)
+    controller.run()
+    n_steps = controller.step
+    assert controller.n_frames == n_steps + 1 and controller.n_skipped == 0 and len(controller.frames) == n_steps + 1
+    assert controller.last.state == model.state and controller.last.step == n_steps
+
+    # a fast game drawn at a low frame rate skips most steps but ends on the final state
+    model = new_game.NanoRTSModel(new_game.generate_random_state(new_game.NanoRTSParams(), random.Random(0)))
+    controller = ThreadedController(model, MultiUnitRandomPlayer(0), NewView(model), frame_rate=20,
+                                    max_steps=2000, headless=True)
+    controller.run()
+    n_steps = controller.step
+    assert controller.last.state == model.state and controller.n_frames + controller.n_skipped == n_steps + 1
+    print(f"frame skipping: {controller.n_frames} frames drawn for {n_steps} steps")
+
+    # a fixed tick, with a slow agent: frames keep coming while it thinks
+    model = make_model()
+    frame_times = []
+    controller = ThreadedController(model, MultiUnitRHEA(model.n_units(), l=20, n=1000, rng=0), NanoRTSView(model),
+                                    frame_rate=60, sim_rate=20, max_steps=10, headless=True)
+    old_next = controller.next_snapshot
+    controller.next_snapshot = lambda: frame_times.append(time.perf_counter()) or old_next()
+    t = time.perf_counter()
+    controller.run()
+    elapsed = time.perf_counter() - t
+    longest = max(b - a for a, b in zip(frame_times, frame_times[1:]))
+    print(f"fixed tick: 10 steps in {elapsed:.2f}s, longest gap between frames {1000 * longest:.0f}ms")
+    assert controller.last.state == model.state and elapsed >= 10 / 20 and longest < 0.1
+
+
+if __name__ == '__main__':
+    test()
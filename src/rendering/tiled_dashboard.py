@@ -0,0 +1,250 @@
+"""
+ A dashboard showing many games at once, e.g. every row of a VectorEnv or the games
+ of a population of agents, as a grid of tiles in one surface.
+
+ Nothing is drawn with per-unit draw calls: each kind of unit (type and player colour
+ for nano_rts, colour for old_nano_rts) is drawn once into a cached sprite by the
+ game's own unit drawing code, the grid background of every tile is cached in one
+ surface, and a frame is a single background blit followed by one Surface.blits
+ call for all the units of all the tiles.  At dashboard scales the units are drawn
+ without their action lines.
+
+ Games can be drawn from their states (draw_states, draw_models), or straight from a
+ batch of VectorEnv observation planes (draw_planes), which finds the units of all
+ the games with one np.nonzero.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pygame
+
+import nano_rts.nano_rts_game as nano_rts
+from envs.vector_env import UNIT_TYPE, OWNER, RESOURCES, NanoRTSGame
+from nano_rts.nano_rts_game import UnitType
+from nano_rts.nano_rts_view_controller import NanoRTSView, NanoUnitView
+from old_nano_rts.old_nano_rts_view_controller import NanoRTSView as OldNanoRTSView
+
+# (sprite key, x, y)
+Item = Tuple[Hashable, int, int]
+
+
+class TiledDashboard:
+    def __init__(self, n_tiles: int, grid_size: int, cell_size: int = 8, columns: int = None, padding: int = 2,
+                 old_game: bool = False):
+        """
+        :param cell_size: pixels per grid cell within a tile
+        :param columns: tiles per row, by default enough for a square-ish layout
+        :param padding: pixels between tiles
+        :param old_game: draw old_nano_rts states rather than nano_rts ones
+        """
+        self.n_tiles = n_tiles
+        self.grid_size = grid_size
+        self.cell_size = cell_size
+        self.columns = columns or math.ceil(math.sqrt(n_tiles))
+        self.rows = math.ceil(n_tiles / self.columns)
+        self.padding = padding
+        self.old_game = old_game
+        self.tile_size = grid_size * cell_size
+        step = self.tile_size + padding
+        self.origins = np.array([(padding + (i % self.columns) * step, padding + (i // self.columns) * step)
+                                 for i in range(n_tiles)], dtype=np.int64)
+        self.size = (padding + self.columns * step, padding + self.rows * step)
+        self.sprites = self.make_sprites()
+        self.background = pygame.Surface(self.size)
+        tile = self.make_tile_background()
+        self.background.blits([(tile, tuple(origin)) for origin in self.origins.tolist()], doreturn=False)
+        self.surface = pygame.Surface(self.size)
+
+    def make_sprites(self) -> Dict[Hashable, pygame.Surface]:
+        size = self.cell_size
+        sprites = {}
+        if self.old_game:
+            border = max(1, size * OldNanoRTSView.BORDER // OldNanoRTSView.DEFAULT_SIZE)
+            colors = {("unit", i): color for i, color in enumerate(OldNanoRTSView.UNIT_COLORS)}
+            colors["resource"] = OldNanoRTSView.RESOURCE_COLOR
+            for key, color in colors.items():
+                sprite = pygame.Surface((size, size), pygame.SRCALPHA)
+                pygame.draw.rect(sprite, color, (border, border, size - 2 * border, size - 2 * border))
+                sprites[key] = sprite
+        else:
+            unit_view = NanoUnitView(size)
+            for unit_type in UnitType:
+                for player_id in range(len(NanoUnitView.PLAYER_COLORS)):
+                    sprite = pygame.Surface((size, size), pygame.SRCALPHA)
+                    unit_view.draw_at(sprite, 0, 0, unit_type, player_id, 0)
+                    sprites[unit_type, player_id] = sprite
+        if pygame.display.get_surface() is not None:
+            sprites = {key: sprite.convert_alpha() for key, sprite in sprites.items()}
+        return sprites
+
+    def make_tile_background(self) -> pygame.Surface:
+        view = OldNanoRTSView if self.old_game else NanoRTSView
+        tile = pygame.Surface((self.tile_size, self.tile_size))
+        tile.fill(view.BG_COLOR)
+        width = max(1, self.cell_size * view.BORDER // view.DEFAULT_SIZE)
+        for x in range(self.grid_size):
+            for y in range(self.grid_size):
+                rect = (x * self.cell_size, y * self.cell_size, self.cell_size, self.cell_size)
+                pygame.draw.rect(tile, view.WALL_COLOR, rect, width)
+        return tile
+
+    def items(self, state) -> List[Item]:
+        """
+        The sprites to draw for a state, in drawing order
+        """
+        if self.old_game:
+            units = [(("unit", i % OldNanoRTSView.N_UNIT_COLORS), unit.x, unit.y) for i, unit in enumerate(state.units)]
+            return units + [("resource", x, y) for x, y in state.resources.keys()]
+        return [((unit.type, unit.player_id), unit.x, unit.y) for unit in state.units.values()]
+
+    def draw_items(self, tiles: Sequence[Iterable[Item]]) -> pygame.Surface:
+        """
+        Draws the items of each tile, and returns the surface drawn on
+        """
+        sprites, cell = self.sprites, self.cell_size
+        blits = []
+        for (ox, oy), items in zip(self.origins.tolist(), tiles):
+            blits.extend((sprites[key], (ox + int(x * cell), oy + int(y * cell))) for key, x, y in items)
+        self.surface.blit(self.background, (0, 0))
+        self.surface.blits(blits, doreturn=False)
+        return self.surface
+
+    def draw_states(self, states: Sequence) -> pygame.Surface:
+        return self.draw_items([self.items(state) for state in states])
+
+    def draw_models(self, models: Sequence) -> pygame.Surface:
+        return self.draw_states([model.state for model in models])
+
+    def draw_planes(self, obs: np.ndarray) -> pygame.Surface:
+        """
+        Draws a batch of VectorEnv observations, a [B, C, grid_size, grid_size] array.
+        Old game planes only say where units are, so they all get the first unit colour
+        """
+        if self.old_game:
+            codes = {1: self.sprites["unit", 0]}
+            resource_sprite = self.sprites["resource"]
+        else:
+            codes = {int(unit_type) * 4 + player_id: sprite for (unit_type, player_id), sprite in self.sprites.items()}
+            resource_sprite = self.sprites[UnitType.Resource, 2]
+        cell = self.cell_size
+        blits = []
+        b, x, y = np.nonzero(obs[:, UNIT_TYPE])
+        if len(b):
+            unit_codes = obs[b, UNIT_TYPE, x, y].astype(np.int64)
+            if not self.old_game:
+                unit_codes = unit_codes * 4 + obs[b, OWNER, x, y].astype(np.int64) - 1
+            positions = self.origins[b] + np.stack([x, y], axis=1) * cell
+            blits.extend(zip(map(codes.__getitem__, unit_codes.tolist()), map(tuple, positions.tolist())))
+        b, x, y = np.nonzero(obs[:, RESOURCES])
+        if len(b):
+            positions = self.origins[b] + np.stack([x, y], axis=1) * cell
+            blits.extend((resource_sprite, position) for position in map(tuple, positions.tolist()))
+        self.surface.blit(self.background, (0, 0))
+        self.surface.blits(blits, doreturn=False)
+        return self.surface
+
+    def to_array(self) -> np.ndarray:
+        """
+        The current frame as a [height, width, 3] uint8 RGB array
+        """
+        return pygame.surfarray.array3d(self.surface).swapaxes(0, 1)
+
+
+def watch(env, cell_size: int = 8, frame_rate: int = 30, max_frames: int = None, seed: int = 0) -> int:
+    """
+    Shows every row of a VectorEnv in a window, stepping random actions between frames,
+    until the window is closed (or max_frames), and returns the number of frames shown
+    """
+    pygame.init()
+    pygame.display.set_caption(f"Nano RTS: {env.batch_size} games")
+    old_game = not isinstance(env.game, NanoRTSGame)
+    dashboard = TiledDashboard(env.batch_size, env.game.grid_size, cell_size, old_game=old_game)
+    screen = pygame.display.set_mode(dashboard.size)
+    dashboard.surface = screen
+    clock = pygame.time.Clock()
+    rng = np.random.default_rng(seed)
+    obs = env.reset()
+    n_frames = 0
+    running = True
+    while running and (max_frames is None or n_frames < max_frames):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+        dashboard.draw_planes(obs)
+        pygame.display.flip()
+        n_frames += 1
+        obs = env.step(rng.integers(env.game.n_actions_unit, size=(env.batch_size, env.game.n_units)))[0]
+        clock.tick(frame_rate)
+    pygame.quit()
+    return n_frames
+
+
+def test():
+    """
+    Checks units land on their tiles and cells, and that drawing from states and from
+    observation planes gives the same frame
+    """
+    from envs.vector_env import VectorEnv, NanoRTSGame, OldNanoRTSGame
+
+    params = nano_rts.NanoRTSParams()
+    env = VectorEnv(NanoRTSGame(params), 16, seed=0)
+    obs = env.reset()
+    dashboard = TiledDashboard(16, params.grid_size, cell_size=10)
+    from_states = dashboard.draw_models(env.models).copy()
+    from_planes = dashboard.draw_planes(obs)
+    assert np.array_equal(pygame.surfarray.array3d(from_states), pygame.surfarray.array3d(from_planes))
+    frame = dashboard.to_array()
+    for b in [0, 5, 15]:
+        unit = next(u for u in env.models[b].state.units.values() if u.type == UnitType.Base)
+        ox, oy = dashboard.origins[b]
+        centre = frame[oy + unit.y * 10 + 5, ox + unit.x * 10 + 5]
+        assert tuple(centre) == NanoUnitView.UNIT_TYPE_COLORS[UnitType.Base], (b, centre)
+
+    old_env = VectorEnv(OldNanoRTSGame(), 9, seed=0)
+    old_env.reset()
+    old_dashboard = TiledDashboard(9, old_env.game.grid_size, cell_size=10, old_game=True)
+    old_dashboard.draw_models(old_env.models)
+    frame = old_dashboard.to_array()
+    ox, oy = old_dashboard.origins[4]
+    unit = old_env.models[4].state.units[0]
+    assert tuple(frame[oy + int(unit.y) * 10 + 5, ox + int(unit.x) * 10 + 5]) in \
+        {OldNanoRTSView.UNIT_COLORS[i] for i in range(len(old_env.models[4].state.units))} | \
+        {OldNanoRTSView.RESOURCE_COLOR}
+    assert watch(VectorEnv(NanoRTSGame(params), 4, seed=0), frame_rate=0, max_frames=5) == 5
+    print("dashboard tiles ok")
+
+
+def speed_test(n_tiles: int = 64, n_frames: int = 200):
+    """
+    Frames per second drawing 64 running games, with the games stepped between frames
+    (the stepping is not timed)
+    """
+    from envs.vector_env import VectorEnv, NanoRTSGame
+    game = NanoRTSGame(nano_rts.NanoRTSParams(), n_workers=4, n_resources=10)
+    env = VectorEnv(game, n_tiles, seed=0)
+    obs = env.reset()
+    rng = np.random.default_rng(0)
+    dashboard = TiledDashboard(n_tiles, game.grid_size, cell_size=10)
+    # the lambdas read obs when called, so the planes drawn are the latest observations
+    for label, draw in [("states", lambda: dashboard.draw_models(env.models)),
+                        ("planes", lambda: dashboard.draw_planes(obs))]:
+        elapsed = 0.0
+        for _ in range(n_frames):
+            obs = env.step(rng.integers(game.n_actions_unit, size=(n_tiles, game.n_units)))[0]
+            t = time.perf_counter()
+            draw()
+            elapsed += time.perf_counter() - t
+        print(f"{n_tiles} tiles from {label}: {n_frames / elapsed:.0f} fps, "
+              f"{dashboard.size[0]}x{dashboard.size[1]} pixels")
+
+
+if __name__ == '__main__':
+    from rendering.cached_renderer import headless
+    headless()
+    test()
+    speed_test()
@@ -1,17 +1,37 @@
+import reprlib
 import time
 from functools import wraps
 
+from stats.metrics import METRICS
+
+
+# @clock prints each call unless the times are going to METRICS; set False to silence it
+VERBOSE = not METRICS.enabled
+
+
+def clock(func=None, *, verbose: bool = None):
+    """
+    Records the time taken by each call in the METRICS histogram clock.<function name>
+    when metrics are enabled, and prints it, with the arguments shortened by reprlib,
+    if verbose (VERBOSE by default, read at call time). Use as @clock or @clock(verbose=True).
+    For probes in hot code use stats.metrics directly
+    """
+    if func is None:
+        return lambda f: clock(f, verbose=verbose)
+    name = func.__qualname__
 
-def clock(func):
     @wraps(func)
-    def clocked(*args):
-        t0 = time.time()
-        result = func(*args)
-        elapsed = time.time() - t0
-        name = func.__name__
-        arg_str = ', '.join(repr(arg) for arg in args)
-        print('[%0.8fs] %s(%s) -> %r' %
-              (elapsed, name, arg_str, result))
+    def clocked(*args, **kwargs):
+        t0 = time.perf_counter_ns()
+        result = func(*args, **kwargs)
+        elapsed = (time.perf_counter_ns() - t0) * 1e-9
+        METRICS.observe(f"clock.{name}", elapsed)
+        if not (VERBOSE if verbose is None else verbose):
+            return result
+        arg_str = ', '.join([reprlib.repr(arg) for arg in args] +
+                            [f'{key}={reprlib.repr(value)}' for key, value in kwargs.items()])
+        print('[%0.8fs] %s(%s) -> %s' %
+              (elapsed, name, arg_str, reprlib.repr(result)))
         return result
 
     return clocked
@@ -19,10 +39,10 @@ def clock(func):
 
 # Example use
 if __name__ == '__main__':
-    @clock
-    def snooze(seconds):
+    @clock(verbose=True)
+    def snooze(seconds, label=None):
         time.sleep(seconds)
 
 
     for i in range(3):
-        snooze(.123)
+        snooze(.123, label=i)
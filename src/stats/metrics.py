@@ -0,0 +1,276 @@
+"""
+Named counters and histograms (including timers) for profiling agents and games.
+
+Everything goes through the shared METRICS registry, which is disabled by default
+(set NANORTS_METRICS=1 in the environment, or call METRICS.enable()).  Probes in hot
+code are written as
+
+    if METRICS.enabled:
+        METRICS.count("nano_rts.steps")
+
+so a disabled probe costs one attribute check.  Timers use time.perf_counter_ns and
+record seconds.  Histograms keep at most max_samples values (a uniform reservoir
+sample once full) for the percentiles, while count, total, min and max are exact.
+
+snapshot() gives everything as a dict, and to_json() as JSON for dashboards; counter
+rates are per second since the registry was enabled or reset, e.g. steps per second.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+
+def nearest_rank(ordered: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of sorted values, p in [0, 100]
+    """
+    return ordered[int(max(1, -(-len(ordered) * p // 100))) - 1]
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, n: int = 1) -> None:
+        self.value += n
+
+
+class Histogram:
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max_samples
+        self.samples: List[float] = []
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self._rng = random.Random(0)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.samples) < self.max_samples:
+            self.samples.append(value)
+        else:
+            i = self._rng.randrange(self.count)
+            if i < self.max_samples:
+                self.samples[i] = value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Nearest-rank percentile of the samples, p in [0, 100]
+        """
+        return nearest_rank(sorted(self.samples), p) if self.samples else None
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": nearest_rank(ordered, 50),
+            "p99": nearest_rank(ordered, 99),
+        }
+
+
+class _Timing:
+    """
+    Context manager recording the time spent in a with block into a histogram
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> _Timing:
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.add((time.perf_counter_ns() - self.start) * 1e-9)
+
+
+class _NoTiming:
+    __slots__ = ()
+
+    def __enter__(self) -> _NoTiming:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+NO_TIMING = _NoTiming()
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, max_samples: int = 10000):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.counters: Dict[str, Counter] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.started = time.perf_counter()
+
+    def enable(self) -> None:
+        if not self.enabled:
+            self.enabled = True
+            self.started = time.perf_counter()
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+        self.started = time.perf_counter()
+
+    def counter(self, name: str) -> Counter:
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter()
+        return counter
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.max_samples)
+        return histogram
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self.counter(name).add(n)
+
+    def observe(self, name: str, value: float) -> None:
+        if self.enabled:
+            self.histogram(name).add(value)
+
+    def observe_ns(self, name: str, start_ns: int) -> None:
+        """
+        Records the seconds since start_ns, a time.perf_counter_ns() reading
+        """
+        if self.enabled:
+            self.histogram(name).add((time.perf_counter_ns() - start_ns) * 1e-9)
+
+    def timer(self, name: str):
+        """
+        with METRICS.timer("name"): ... records the time taken by the block
+        """
+        return _Timing(self.histogram(name)) if self.enabled else NO_TIMING
+
+    def timed(self, name: str = None) -> Callable:
+        """
+        Decorator recording the time of each call, named after the function by default
+        """
+        def decorate(func: Callable) -> Callable:
+            label = name or func.__qualname__
+
+            @wraps(func)
+            def timed_func(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.histogram(label).add((time.perf_counter_ns() - start) * 1e-9)
+
+            return timed_func
+
+        return decorate
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "elapsed": elapsed,
+            "counters": {name: {"value": c.value, "rate": c.value / elapsed if elapsed > 0 else 0.0}
+                         for name, c in sorted(self.counters.items())},
+            "histograms": {name: h.summary() for name, h in sorted(self.histograms.items())},
+        }
+
+    def to_json(self, path: str = None, indent: int = 2) -> str:
+        """
+        Returns the snapshot as JSON, also writing it to path if given
+        """
+        text = json.dumps(self.snapshot(), indent=indent)
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
+
+
+# shared by all the probes
+METRICS = Metrics(enabled=bool(os.environ.get("NANORTS_METRICS")))
+
+
+def record_decision(agent: str, stats) -> None:
+    """
+    Probe for the end of an agent's decision, given its DecisionStats
+    """
+    if METRICS.enabled:
+        METRICS.count(f"{agent}.decisions")
+        METRICS.observe(f"{agent}.rollouts_per_decision", stats.rollouts)
+        METRICS.observe(f"{agent}.iterations_per_decision", stats.iterations)
+        METRICS.observe(f"{agent}.decision_time", stats.elapsed)
+
+
+def test():
+    metrics = Metrics()
+    metrics.count("ignored")
+    with metrics.timer("ignored"):
+        pass
+    assert not metrics.counters and not metrics.histograms
+    metrics.enable()
+    for i in range(1, 101):
+        metrics.observe("values", i)
+        metrics.count("calls")
+
+    @metrics.timed()
+    def work(n, scale=1):
+        return sum(range(n)) * scale
+
+    assert work(1000, scale=2) == 999000
+    summary = metrics.snapshot()["histograms"]["values"]
+    assert (summary["count"], summary["mean"], summary["p50"], summary["p99"]) == (100, 50.5, 50, 99)
+    assert metrics.counters["calls"].value == 100
+    assert metrics.histograms["test.<locals>.work"].count == 1
+    # the reservoir keeps the percentiles close once it is full
+    small = Histogram(max_samples=1000)
+    for i in range(100000):
+        small.add(i % 1000)
+    assert len(small.samples) == 1000 and abs(small.percentile(50) - 500) < 60
+    json.loads(metrics.to_json())
+    print("metrics ok")
+
+
+def overhead_test(n: int = 1000000):
+    """
+    Time per disabled and enabled probe
+    """
+    metrics = Metrics()
+    for enabled in [False, True]:
+        metrics.enabled = enabled
+        t = time.perf_counter()
+        for _ in range(n):
+            if metrics.enabled:
+                metrics.count("probe")
+        elapsed = time.perf_counter() - t
+        print(f"{'enabled' if enabled else 'disabled'}: {1e9 * elapsed / n:.1f}ns per probe")
+
+
+if __name__ == '__main__':
+    test()
+    overhead_test()